@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Benchmarks the main steps of generating a visualization on synthetic
+# datasets of various sizes (see synthetic.py), as well as how quickly the
+# command-line scripts start up, and optionally compares the results to a
+# baseline from an earlier run.
+#
+# Example usage (from the root of the repository):
+#
+#   python3 benchmarks/run_benchmarks.py --scale small --output small.json
+#   ... make some changes ...
+#   python3 benchmarks/run_benchmarks.py --scale small --baseline small.json
+#
+# "make benchmark" compares the tiny and small scales to the baseline in
+# benchmarks/baselines/tiny_small.json ("make benchmark-baseline" regenerates
+# it).
+# ----------------------------------------------------------------------------
+
+import io
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import click
+import synthetic
+
+# Bump this if the format of the results changes.
+RESULTS_VERSION = 1
+
+STAGES = ["process_input", "gen_rank_plot", "gen_sample_plot",
+          "gen_visualization"]
+
+# Regressions smaller than these are ignored, since they're within the noise
+# of timing/measuring memory usage on small datasets.
+MIN_SECONDS_REGRESSION = 0.05
+MIN_RSS_REGRESSION_MB = 10
+# Output sizes are deterministic, so any real growth in them is flagged.
+SIZE_TOLERANCE = 0.01
+
+# Commands whose startup time is measured: just printing their help text
+# shouldn't require importing any heavy dependencies.
+STARTUP_COMMANDS = {
+    "rankratioviz": "rankratioviz.scripts._plot:plot",
+    "rankratioviz-batch": "rankratioviz.scripts._batch:batch",
+    "rankratioviz-serve": "rankratioviz.scripts._serve:serve",
+}
+MIN_STARTUP_REGRESSION = 0.05
+
+
+def _peak_rss_mb():
+    """Returns the peak resident set size of this process so far, in MB."""
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak / 2**20
+    return peak / 2**10
+
+
+class _CountingWriter(io.TextIOBase):
+    """A file-like object that just counts how many bytes are written to it.
+    """
+
+    def __init__(self):
+        self.num_bytes = 0
+
+    def write(self, text):
+        self.num_bytes += len(text.encode("utf-8"))
+        return len(text)
+
+
+def _json_size(plot_json):
+    from rankratioviz._json_writer import dump
+    writer = _CountingWriter()
+    dump(plot_json, writer)
+    return writer.num_bytes
+
+
+def _run_stage(stage, paths, queue):
+    """Runs a single stage of generating a visualization, and puts how long
+    it took (and how much memory it used) in queue.
+
+    This is run in a fresh process for each stage, so that the inputs to the
+    stage can be prepared first (without that counting towards the stage's
+    time) and so that each stage's memory usage is measured separately.
+    """
+
+    import pandas as pd
+    from biom import load_table
+    from rankratioviz import generate
+    from rankratioviz._rank_processing import rank_file_to_df
+    # generate.py only imports altair when it's first used; import it now, so
+    # that the time this takes doesn't count towards the first stage using it
+    import altair  # noqa: F401
+
+    def read_metadata(md_file_loc):
+        return pd.read_csv(md_file_loc, index_col=0, sep='\t')
+
+    # Set up the stage's inputs, the same way the rankratioviz script does
+    table = load_table(paths["table"])
+    sample_metadata = read_metadata(paths["sample_metadata"])
+    feature_metadata = read_metadata(paths["feature_metadata"])
+    feature_ranks = rank_file_to_df(paths["ranks"])
+    if stage != "process_input":
+        V, processed_table = generate.process_input(
+            feature_ranks, sample_metadata, table, feature_metadata
+        )
+    out_dir = tempfile.mkdtemp(prefix="rankratioviz-benchmark-")
+
+    result = {}
+    rss_before = _peak_rss_mb()
+    start = time.perf_counter()
+    if stage == "process_input":
+        generate.process_input(feature_ranks, sample_metadata, table,
+                               feature_metadata)
+    elif stage == "gen_rank_plot":
+        output = generate.gen_rank_plot(V)
+    elif stage == "gen_sample_plot":
+        output = generate.gen_sample_plot(processed_table, sample_metadata)
+    elif stage == "gen_visualization":
+        generate.gen_visualization(V, processed_table, sample_metadata,
+                                   out_dir)
+    result["seconds"] = time.perf_counter() - start
+    rss_after = _peak_rss_mb()
+    result["peak_rss_mb"] = rss_after
+    # How much the stage raised the process' peak memory usage, beyond that
+    # needed to set up its inputs
+    result["rss_increase_mb"] = rss_after - rss_before
+
+    if stage in ("gen_rank_plot", "gen_sample_plot"):
+        result["json_bytes"] = _json_size(output)
+    elif stage == "gen_visualization":
+        result["output_bytes"] = {
+            name: os.path.getsize(os.path.join(out_dir, name))
+            for name in ("rank_plot.json", "sample_plot.json")
+        }
+    shutil.rmtree(out_dir, ignore_errors=True)
+    queue.put(result)
+
+
+def run_stage(stage, paths):
+    """Runs _run_stage() in a new process, and returns its result."""
+
+    # We use spawn rather than fork so that each stage starts from scratch
+    # (a forked process would start with the parent's peak memory usage).
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_run_stage, args=(stage, paths, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    if process.exitcode != 0:
+        raise click.ClickException("Benchmarking {} failed.".format(stage))
+    return result
+
+
+def get_dataset(scale, ranks_type, data_dir):
+    """Returns the paths of the files of a synthetic dataset, generating it
+    in data_dir if it isn't already there.
+    """
+
+    params = synthetic.SCALES[scale]
+    dataset_dir = os.path.join(data_dir, "{}-{}".format(scale, ranks_type))
+    done_loc = os.path.join(dataset_dir, "done.json")
+    if os.path.isfile(done_loc):
+        with open(done_loc, "r") as f:
+            return json.load(f)
+    click.echo("Generating the {} dataset ({} features x {} samples)..."
+               .format(scale, params["features"], params["samples"]))
+    paths = synthetic.write_dataset(
+        dataset_dir, params["features"], params["samples"],
+        params["density"], ranks_type=ranks_type
+    )
+    with open(done_loc, "w") as f:
+        json.dump(paths, f)
+    return paths
+
+
+def benchmark_scale(scale, ranks_type, data_dir, repeat):
+    """Benchmarks every stage on the dataset of the given scale.
+
+    Each stage is run repeat times; the shortest time (and the largest
+    memory usage) of these runs is reported.
+    """
+
+    paths = get_dataset(scale, ranks_type, data_dir)
+    stages = {}
+    for stage in STAGES:
+        runs = [run_stage(stage, paths) for _ in range(repeat)]
+        result = runs[0]
+        result["seconds"] = min(r["seconds"] for r in runs)
+        for key in ("peak_rss_mb", "rss_increase_mb"):
+            result[key] = max(r[key] for r in runs)
+        stages[stage] = result
+        click.echo("{} {}: {:.3f} s, peak RSS {:.1f} MB (+{:.1f} MB)".format(
+            scale, stage, result["seconds"], result["peak_rss_mb"],
+            result["rss_increase_mb"]
+        ))
+    return {"dataset": dict(synthetic.SCALES[scale], ranks_type=ranks_type),
+            "stages": stages}
+
+
+def benchmark_startup(repeat):
+    """Measures how long each of the STARTUP_COMMANDS takes to print its
+    help text, in a fresh Python process (the fastest of repeat runs).
+    """
+
+    startup = {}
+    for command, entry_point in sorted(STARTUP_COMMANDS.items()):
+        module, function = entry_point.split(":")
+        code = "from {} import {}; {}()".format(module, function, function)
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.check_call([sys.executable, "-c", code, "--help"],
+                                  stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        startup[command] = min(times)
+        click.echo("{} --help: {:.3f} s".format(command, startup[command]))
+    return startup
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Returns a list of descriptions of regressions from baseline."""
+
+    regressions = []
+
+    def check(label, value, base_value, rel_tolerance, min_increase=0):
+        if value > base_value * (1 + rel_tolerance) and \
+                value - base_value > min_increase:
+            regressions.append("{}: {:.3f} (baseline: {:.3f})".format(
+                label, value, base_value
+            ))
+
+    for scale, scale_results in results["results"].items():
+        if scale not in baseline["results"]:
+            continue
+        base_stages = baseline["results"][scale]["stages"]
+        for stage, result in scale_results["stages"].items():
+            if stage not in base_stages:
+                continue
+            base = base_stages[stage]
+            prefix = "{} {}".format(scale, stage)
+            check(prefix + " seconds", result["seconds"], base["seconds"],
+                  tolerance, MIN_SECONDS_REGRESSION)
+            check(prefix + " RSS increase (MB)", result["rss_increase_mb"],
+                  base["rss_increase_mb"], tolerance, MIN_RSS_REGRESSION_MB)
+            if "json_bytes" in base:
+                check(prefix + " JSON bytes", result["json_bytes"],
+                      base["json_bytes"], SIZE_TOLERANCE)
+            for name, size in base.get("output_bytes", {}).items():
+                check("{} {} bytes".format(prefix, name),
+                      result["output_bytes"][name], size, SIZE_TOLERANCE)
+    for command, seconds in results.get("startup", {}).items():
+        if command in baseline.get("startup", {}):
+            check("{} startup seconds".format(command), seconds,
+                  baseline["startup"][command], tolerance,
+                  MIN_STARTUP_REGRESSION)
+    return regressions
+
+
+@click.command()
+@click.option('-s', '--scale', 'scales', multiple=True,
+              type=click.Choice(sorted(synthetic.SCALES)),
+              help="Dataset size to benchmark. Can be given multiple times."
+                   + " Defaults to tiny and small.")
+@click.option('--ranks-type', default="differentials",
+              type=click.Choice(["differentials", "ordination"]),
+              help="Type of ranks file to generate.")
+@click.option('--data-dir', default=None,
+              help="Directory in which to store the generated datasets, so"
+                   + " that they can be reused by later runs. By default, a"
+                   + " temporary directory is used.")
+@click.option('-n', '--repeat', default=3, type=click.IntRange(min=1),
+              help="Number of times to run each stage (the fastest run"
+                   + " is reported).")
+@click.option('-o', '--output', default=None,
+              help="File to write the results (as JSON) to. These results"
+                   + " can later be used as a baseline.")
+@click.option('-b', '--baseline', default=None,
+              help="Results of an earlier run to compare to. Exits with an"
+                   + " error if anything has regressed.")
+@click.option('--tolerance', default=0.25, type=click.FloatRange(min=0),
+              help="How much slower (or more memory-hungry) than the"
+                   + " baseline a stage can be, as a fraction of the"
+                   + " baseline, before it's considered a regression.")
+def benchmark(scales, ranks_type, data_dir, repeat, output, baseline,
+              tolerance):
+    """Benchmarks rankratioviz on synthetic datasets."""
+
+    import rankratioviz
+    if len(scales) == 0:
+        scales = ("tiny", "small")
+    temp_data_dir = None
+    if data_dir is None:
+        temp_data_dir = data_dir = tempfile.mkdtemp(
+            prefix="rankratioviz-benchmark-data-"
+        )
+    try:
+        results = {
+            "version": RESULTS_VERSION,
+            "rankratioviz_version": rankratioviz.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "startup": benchmark_startup(repeat),
+            "results": {
+                scale: benchmark_scale(scale, ranks_type, data_dir, repeat)
+                for scale in scales
+            }
+        }
+    finally:
+        if temp_data_dir is not None:
+            shutil.rmtree(temp_data_dir, ignore_errors=True)
+
+    if output is not None:
+        if os.path.dirname(output) != "":
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if baseline is not None:
+        with open(baseline, "r") as f:
+            baseline_results = json.load(f)
+        if baseline_results.get("version") != RESULTS_VERSION:
+            raise click.ClickException("The baseline's format is outdated.")
+        regressions = compare_to_baseline(results, baseline_results,
+                                          tolerance)
+        if len(regressions) > 0:
+            raise click.ClickException(
+                "Regressions from the baseline:\n" + "\n".join(regressions)
+            )
+        click.echo("No regressions from the baseline.")
+
+
+if __name__ == '__main__':
+    benchmark()
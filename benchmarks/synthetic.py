@@ -0,0 +1,168 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Generates synthetic rankratioviz inputs (BIOM tables, ranks, and metadata)
+# of a given size, for benchmarking.
+# ----------------------------------------------------------------------------
+
+import os
+import numpy as np
+import pandas as pd
+import skbio
+from biom import Table
+from biom.util import biom_open
+from scipy.sparse import coo_matrix
+
+# Named dataset sizes. density is the fraction of counts that are nonzero:
+# real tables get sparser as they get wider (most features are only seen in
+# a few samples), so the larger scales are sparser.
+SCALES = {
+    "tiny": {"features": 1000, "samples": 50, "density": 0.1},
+    "small": {"features": 10000, "samples": 500, "density": 0.03},
+    "medium": {"features": 100000, "samples": 5000, "density": 0.005},
+    "large": {"features": 500000, "samples": 20000, "density": 0.001},
+}
+
+TAXONOMY_LEVELS = ["k", "p", "c", "o", "f", "g", "s"]
+
+
+def feature_ids(num_features):
+    return np.array(["F{}".format(i) for i in range(num_features)],
+                    dtype=object)
+
+
+def sample_ids(num_samples):
+    return np.array(["S{}".format(i) for i in range(num_samples)],
+                    dtype=object)
+
+
+def make_table(num_features, num_samples, density, seed=0):
+    """Returns a biom.Table of random counts.
+
+    Like real feature tables, features' overall abundances vary a lot:
+    each feature's prevalence and counts are scaled by a log-normally
+    distributed abundance, so a few features are in most samples (with
+    large counts) and most are in only a few.
+    """
+
+    rng = np.random.RandomState(seed)
+    abundance = rng.lognormal(sigma=1.5, size=num_features)
+    prevalence = np.minimum(abundance / abundance.mean() * density, 1)
+    nnz_per_feature = rng.binomial(num_samples, prevalence)
+    # Pick the samples each feature is in at random. (This is done with
+    # replacement, since that's much faster for big tables: the few
+    # duplicates this creates are just merged.)
+    rows = np.repeat(np.arange(num_features), nnz_per_feature)
+    cols = rng.randint(0, num_samples, len(rows))
+    data = 1 + rng.poisson(np.repeat(abundance * 10, nnz_per_feature))
+    matrix = coo_matrix((data.astype(np.float64), (rows, cols)),
+                        shape=(num_features, num_samples)).tocsr()
+    matrix.sum_duplicates()
+    return Table(matrix, feature_ids(num_features), sample_ids(num_samples))
+
+
+def make_differentials(num_features, num_columns=3, seed=0):
+    """Returns a DataFrame of random differentials (like songbird's output).
+    """
+
+    rng = np.random.RandomState(seed + 1)
+    columns = ["Intercept"] + ["C(Group)[T.{}]".format(i)
+                               for i in range(1, num_columns)]
+    return pd.DataFrame(
+        rng.normal(size=(num_features, num_columns)),
+        index=pd.Index(feature_ids(num_features), name="featureid"),
+        columns=columns
+    )
+
+
+def make_ordination(num_features, num_samples, num_axes=3, seed=0):
+    """Returns a random skbio.OrdinationResults (like DEICODE's output)."""
+
+    rng = np.random.RandomState(seed + 2)
+    axes = ["PC{}".format(i + 1) for i in range(num_axes)]
+    eigvals = np.sort(rng.uniform(1, 10, num_axes))[::-1]
+    return skbio.OrdinationResults(
+        "RPCA", "Robust Principal Component Analysis",
+        pd.Series(eigvals, index=axes),
+        pd.DataFrame(rng.normal(size=(num_samples, num_axes)),
+                     index=sample_ids(num_samples), columns=axes),
+        features=pd.DataFrame(rng.normal(size=(num_features, num_axes)),
+                              index=feature_ids(num_features), columns=axes),
+        proportion_explained=pd.Series(eigvals / eigvals.sum(), index=axes)
+    )
+
+
+def make_sample_metadata(num_samples, seed=0):
+    """Returns a DataFrame of sample metadata with a few types of columns."""
+
+    rng = np.random.RandomState(seed + 3)
+    return pd.DataFrame({
+        "Group": rng.choice(["A", "B", "C", "D"], num_samples),
+        "Subject": ["Subject{}".format(i) for i in
+                    rng.randint(0, max(num_samples // 5, 1), num_samples)],
+        "Age": rng.randint(1, 90, num_samples),
+        "pH": rng.uniform(4, 9, num_samples).round(2)
+    }, index=pd.Index(sample_ids(num_samples), name="Sample ID"))
+
+
+def make_feature_metadata(num_features, seed=0):
+    """Returns a DataFrame of taxonomy-like feature metadata."""
+
+    rng = np.random.RandomState(seed + 4)
+    # Each taxon has up to 3 child taxa at the next level down, so the
+    # lineages form a tree (like a real taxonomy)
+    taxon = np.zeros(num_features, dtype=np.int64)
+    taxonomy = None
+    for level in TAXONOMY_LEVELS:
+        taxon = taxon * 3 + rng.randint(0, 3, num_features)
+        names = "{}__{}".format(level, level.upper()) + \
+            pd.Series(taxon).astype(str)
+        if taxonomy is None:
+            taxonomy = names
+        else:
+            taxonomy = taxonomy.str.cat(names, sep="; ")
+    return pd.DataFrame({
+        "Taxon": taxonomy.values,
+        "Confidence": rng.uniform(0.7, 1, num_features).round(4)
+    }, index=pd.Index(feature_ids(num_features), name="Feature ID"))
+
+
+def write_dataset(output_dir, num_features, num_samples, density,
+                  ranks_type="differentials", seed=0):
+    """Writes a synthetic dataset to output_dir.
+
+    Returns a dict of the paths of the files written, under the keys "ranks",
+    "table", "sample_metadata", and "feature_metadata".
+    """
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {
+        "table": os.path.join(output_dir, "table.biom"),
+        "sample_metadata": os.path.join(output_dir, "sample_metadata.tsv"),
+        "feature_metadata": os.path.join(output_dir, "feature_metadata.tsv")
+    }
+    table = make_table(num_features, num_samples, density, seed=seed)
+    with biom_open(paths["table"], "w") as f:
+        table.to_hdf5(f, "rankratioviz synthetic benchmark data")
+    if ranks_type == "differentials":
+        paths["ranks"] = os.path.join(output_dir, "differentials.tsv")
+        make_differentials(num_features, seed=seed).to_csv(paths["ranks"],
+                                                           sep="\t")
+    elif ranks_type == "ordination":
+        paths["ranks"] = os.path.join(output_dir, "ordination.txt")
+        make_ordination(num_features, num_samples, seed=seed).write(
+            paths["ranks"]
+        )
+    else:
+        raise ValueError("Unknown ranks type: {}".format(ranks_type))
+    make_sample_metadata(num_samples, seed=seed).to_csv(
+        paths["sample_metadata"], sep="\t"
+    )
+    make_feature_metadata(num_features, seed=seed).to_csv(
+        paths["feature_metadata"], sep="\t"
+    )
+    return paths
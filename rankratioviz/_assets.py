@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Utilities for putting the support files (index.html, rankratioviz.js, the
+# vendored Vega libraries, etc.) in place for a visualization.
+# ----------------------------------------------------------------------------
+
+import base64
+import gzip
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+from functools import lru_cache
+
+# NOTE: We can just join this directory with support_files/, since
+# support_files/ is located within the same directory as this file.
+SUPPORT_FILES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                 "support_files")
+
+INDEX_FILE = "index.html"
+
+# The name of the subdirectory of an output directory that shared assets are
+# linked into (see link_shared_assets()).
+ASSETS_SUBDIR = "assets"
+
+
+def list_support_files():
+    """Returns the paths of all support files, relative to SUPPORT_FILES_DIR.
+
+    Paths use forward slashes as separators (i.e. they're what index.html
+    uses to refer to the files).
+    """
+
+    rel_paths = []
+    for dir_loc, _, file_names in os.walk(SUPPORT_FILES_DIR):
+        rel_dir = os.path.relpath(dir_loc, SUPPORT_FILES_DIR)
+        for file_name in file_names:
+            if file_name == ".DS_Store":
+                continue
+            rel_path = os.path.normpath(os.path.join(rel_dir, file_name))
+            rel_paths.append(rel_path.replace(os.sep, "/"))
+    return sorted(rel_paths)
+
+
+@lru_cache(maxsize=None)
+def _cached_digest(file_loc, size, mtime_ns):
+    hasher = hashlib.sha256()
+    with open(file_loc, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def file_digest(file_loc):
+    """Returns the SHA-256 hex digest of a file's contents.
+
+    Digests are cached (by path, size, and modification time), so hashing
+    the same support files for many visualizations only reads them once.
+    """
+
+    stat = os.stat(file_loc)
+    return _cached_digest(os.path.realpath(file_loc), stat.st_size,
+                          stat.st_mtime_ns)
+
+
+def _same_contents(loc1, loc2):
+    if not os.path.isfile(loc2):
+        return False
+    if os.path.getsize(loc1) != os.path.getsize(loc2):
+        return False
+    return file_digest(loc1) == file_digest(loc2)
+
+
+def _umask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _replace_file(dst, write_func):
+    """Writes a file (using write_func(tmp_loc)) to a temporary location
+    next to dst, and then moves it into place.
+    """
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    fd, tmp_loc = tempfile.mkstemp(dir=os.path.dirname(dst))
+    os.close(fd)
+    try:
+        write_func(tmp_loc)
+        # mkstemp() creates files that only their owner can read; give the
+        # file the permissions it would've had if we'd just opened it.
+        if not os.path.islink(tmp_loc) and os.stat(tmp_loc).st_nlink == 1:
+            os.chmod(tmp_loc, 0o666 & ~_umask())
+        os.replace(tmp_loc, dst)
+    except BaseException:
+        os.remove(tmp_loc)
+        raise
+
+
+def sync_file(src, dst):
+    """Copies src to dst, unless dst already has the same contents.
+
+    Returns True if dst was (re)written.
+    """
+
+    if _same_contents(src, dst):
+        return False
+    _replace_file(dst, lambda tmp_loc: shutil.copyfile(src, tmp_loc))
+    return True
+
+
+def write_text_if_changed(dst, text):
+    """Writes text to dst, unless dst already contains exactly that text."""
+
+    data = text.encode("utf-8")
+    if os.path.isfile(dst) and os.path.getsize(dst) == len(data):
+        with open(dst, "rb") as f:
+            if f.read() == data:
+                return False
+
+    def write(tmp_loc):
+        with open(tmp_loc, "wb") as f:
+            f.write(data)
+
+    _replace_file(dst, write)
+    return True
+
+
+def read_index_html(precompressed=False):
+    """Returns the contents of the support files' index.html.
+
+    If precompressed is True, the page tells rankratioviz.js that the
+    visualization's data files have gzipped versions (see
+    rankratioviz._compression.precompress()) that it can request; otherwise,
+    it just requests the data files themselves.
+    """
+
+    with open(os.path.join(SUPPORT_FILES_DIR, INDEX_FILE), "r") as f:
+        index_html = f.read()
+    if precompressed:
+        index_html = index_html.replace(
+            "ssmv.loadJSONFiles();",
+            "ssmv.precompressed = true;\n            ssmv.loadJSONFiles();"
+        )
+    return index_html
+
+
+def copy_support_files(output_dir, precompressed=False):
+    """Copies every support file into output_dir.
+
+    Files already present in output_dir with the same contents are left
+    alone, so this can be run repeatedly on the same output directory.
+    precompressed is passed to read_index_html().
+
+    Returns the path to index.html in output_dir.
+    """
+
+    index_loc = os.path.join(output_dir, INDEX_FILE)
+    for rel_path in list_support_files():
+        if rel_path == INDEX_FILE and precompressed:
+            write_text_if_changed(index_loc, read_index_html(precompressed))
+            continue
+        sync_file(os.path.join(SUPPORT_FILES_DIR, rel_path),
+                  os.path.join(output_dir, *rel_path.split("/")))
+    return index_loc
+
+
+def remove_support_files(output_dir):
+    """Removes the support files (other than index.html) that
+    copy_support_files() or link_shared_assets() put in output_dir, e.g.
+    when it's regenerated as a single-file visualization.
+
+    Subdirectories of output_dir left empty by this are removed too.
+    """
+
+    sub_dirs = set()
+    for rel_path in list_support_files():
+        if rel_path == INDEX_FILE:
+            continue
+        parts = rel_path.split("/")
+        loc = os.path.join(output_dir, *parts)
+        if os.path.isfile(loc):
+            os.remove(loc)
+        if len(parts) > 1:
+            sub_dirs.add(os.path.join(output_dir, *parts[:-1]))
+    # (Deepest directories first, so their parents can be removed after)
+    for dir_loc in sorted(sub_dirs, key=len, reverse=True):
+        if os.path.isdir(dir_loc) and len(os.listdir(dir_loc)) == 0:
+            os.rmdir(dir_loc)
+    shutil.rmtree(os.path.join(output_dir, ASSETS_SUBDIR), ignore_errors=True)
+
+
+def hashed_name(rel_path):
+    """Returns the content-addressed name of a support file.
+
+    For example, vendor/vega.min.js becomes vega.min.<hash>.js, where <hash>
+    is the start of the SHA-256 digest of the file's contents.
+    """
+
+    base_name = rel_path.split("/")[-1]
+    stem, ext = os.path.splitext(base_name)
+    digest = file_digest(os.path.join(SUPPORT_FILES_DIR, rel_path))
+    return "{}.{}{}".format(stem, digest[:16], ext)
+
+
+def _link_or_copy(src, dst):
+    """Hard-links src to dst, or copies src to dst if linking isn't possible
+    (e.g. if they're on different filesystems).
+    """
+
+    def link(tmp_loc):
+        os.remove(tmp_loc)
+        try:
+            os.link(src, tmp_loc)
+        except OSError:
+            shutil.copyfile(src, tmp_loc)
+
+    _replace_file(dst, link)
+
+
+def _is_linked(src, dst):
+    """Returns True if dst is already a hard link to src (or, if they're on
+    different filesystems, so that linking isn't possible, a copy of src).
+    """
+
+    if not os.path.isfile(dst):
+        return False
+    if os.path.samefile(src, dst):
+        return True
+    return (os.stat(src).st_dev != os.stat(dst).st_dev and
+            _same_contents(src, dst))
+
+
+def link_shared_assets(output_dir, asset_dir, precompressed=False):
+    """Puts the support files for a visualization in place using a shared
+    directory of content-addressed assets.
+
+    Every support file other than index.html is stored in asset_dir under
+    its content-addressed name (see hashed_name()). Each of these is only
+    ever written once: since its name depends on its contents, an existing
+    file with the same name is already up to date. The assets are then
+    hard-linked into output_dir/assets/ (or copied there, if hard links
+    aren't possible), and output_dir/index.html is written to point to them.
+    Outdated assets in output_dir/assets/ are removed.
+
+    So generating many visualizations this way writes each asset once, and
+    each output directory only contains links to them (plus index.html and
+    the visualization's data). Running this again on the same output
+    directory only changes what's changed. precompressed is passed to
+    read_index_html().
+
+    Returns the path to index.html in output_dir.
+    """
+
+    os.makedirs(asset_dir, exist_ok=True)
+    out_assets_dir = os.path.join(output_dir, ASSETS_SUBDIR)
+    os.makedirs(out_assets_dir, exist_ok=True)
+    index_html = read_index_html(precompressed)
+
+    current_assets = set()
+    for rel_path in list_support_files():
+        if rel_path == INDEX_FILE:
+            continue
+        name = hashed_name(rel_path)
+        current_assets.add(name)
+        shared_loc = os.path.join(asset_dir, name)
+        if not os.path.isfile(shared_loc):
+            sync_file(os.path.join(SUPPORT_FILES_DIR, rel_path), shared_loc)
+        out_loc = os.path.join(out_assets_dir, name)
+        if not _is_linked(shared_loc, out_loc):
+            _link_or_copy(shared_loc, out_loc)
+        index_html = index_html.replace(
+            '"{}"'.format(rel_path),
+            '"{}/{}"'.format(ASSETS_SUBDIR, name)
+        )
+
+    for name in os.listdir(out_assets_dir):
+        if name not in current_assets:
+            os.remove(os.path.join(out_assets_dir, name))
+
+    index_loc = os.path.join(output_dir, INDEX_FILE)
+    write_text_if_changed(index_loc, index_html)
+    return index_loc
+
+
+def _inline_text(rel_path, end_tag):
+    """Returns the contents of a support file, for inclusion in an HTML tag.
+
+    Any occurrences of end_tag (e.g. "</script") are escaped so that they
+    don't end the tag early.
+    """
+
+    with open(os.path.join(SUPPORT_FILES_DIR, rel_path), "r") as f:
+        text = f.read()
+    return re.sub(re.escape(end_tag), lambda m: m.group(0).replace("/", "\\/"),
+                  text, flags=re.IGNORECASE)
+
+
+def _data_uri(rel_path, mime_type):
+    with open(os.path.join(SUPPORT_FILES_DIR, rel_path), "rb") as f:
+        encoded = base64.b64encode(f.read()).decode("ascii")
+    return "data:{};base64,{}".format(mime_type, encoded)
+
+
+def compress_for_embedding(data):
+    """Gzips some bytes and returns them as a base64 string.
+
+    (The gzip header's modification time is zeroed out, so the output only
+    depends on data.)
+    """
+
+    return base64.b64encode(
+        gzip.compress(data, compresslevel=9, mtime=0)
+    ).decode("ascii")
+
+
+def write_single_file(output_loc, embedded_files):
+    """Writes a visualization as one self-contained HTML file.
+
+    The CSS and JavaScript support files (including the vendored Vega
+    libraries) are inlined into the HTML, and the icon is inlined as a data
+    URI. embedded_files should be a dict mapping the names of the files
+    that rankratioviz.js would otherwise request (e.g. "rank_plot.json") to
+    their contents, as bytes: each is embedded in the HTML as a gzipped
+    base64 blob, which ssmv.fetchFile() decompresses in the browser.
+
+    The resulting file can be opened directly from disk; it doesn't need to
+    be served by a web server.
+    """
+
+    with open(os.path.join(SUPPORT_FILES_DIR, INDEX_FILE), "r") as f:
+        html = f.read()
+
+    html = html.replace(
+        '<link rel="shortcut icon" href="icon.png" />',
+        '<link rel="shortcut icon" href="{}" />'.format(
+            _data_uri("icon.png", "image/png")
+        )
+    )
+    html = html.replace(
+        '<link rel="stylesheet" href="rankratioviz.css" />',
+        '<style>\n{}\n</style>'.format(
+            _inline_text("rankratioviz.css", "</style")
+        )
+    )
+    data_tags = "".join(
+        '\n<script type="application/octet-stream" data-rrv-file="{}">'
+        '{}</script>'.format(name, compress_for_embedding(contents))
+        for name, contents in embedded_files.items()
+    )
+    for rel_path in list_support_files():
+        if not rel_path.endswith(".js"):
+            continue
+        inlined = '<script>\n{}\n</script>'.format(
+            _inline_text(rel_path, "</script")
+        )
+        if rel_path == "rankratioviz.js":
+            # The data needs to be on the page before ssmv.loadJSONFiles()
+            # is called, which happens right after rankratioviz.js is loaded.
+            inlined += data_tags
+        html = html.replace('<script src="{}"></script>'.format(rel_path),
+                            inlined)
+    write_text_if_changed(output_loc, html)
+    return output_loc
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Utilities for caching parsed input files (and the BIOM table matched up
+# with the other inputs) on disk, so that repeated runs on the same inputs can
+# skip parsing and matching them.
+# ----------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+from biom import Table
+from scipy.sparse import csr_matrix
+import rankratioviz
+
+# Bump this whenever the format of cached data (or the way in which the data
+# being cached is produced) changes, so that old cache entries are ignored.
+CACHE_VERSION = 2
+
+# By default, the least recently used entries are evicted from a cache
+# directory once it's bigger than this (in bytes).
+DEFAULT_MAX_SIZE = 2**30
+
+# The names of the arrays making up a CSR matrix.
+_CSR_ARRAYS = ("data", "indices", "indptr")
+
+
+def file_key(file_loc, cache_dir=None):
+    """Returns a string identifying the contents of a file.
+
+    This is a SHA-256 hash of the file's contents, combined with the file's
+    size. (It doesn't depend on the file's modification time, so e.g.
+    touching a file doesn't invalidate anything cached for it.)
+
+    If cache_dir is not None, the key is also cached there (by the file's
+    path, size, and modification time), so that the next call on the same,
+    unmodified file doesn't have to hash it all over again.
+    """
+
+    stat = os.stat(file_loc)
+    if cache_dir is not None:
+        stat_key = "{}:{}:{}".format(os.path.abspath(file_loc), stat.st_size,
+                                     stat.st_mtime_ns)
+        entry_dir = _load_entry(cache_dir, "file_keys", stat_key)
+        if entry_dir is not None:
+            with open(os.path.join(entry_dir, "key.txt"), "r") as kf:
+                return kf.read()
+    hasher = hashlib.sha256()
+    with open(file_loc, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            hasher.update(block)
+    key = "{}-{}".format(hasher.hexdigest(), stat.st_size)
+    if cache_dir is not None:
+        def write(tmp_dir):
+            with open(os.path.join(tmp_dir, "key.txt"), "w") as kf:
+                kf.write(key)
+
+        _save_entry(cache_dir, "file_keys", stat_key, write)
+    return key
+
+
+def _entry_dir(cache_dir, category, key):
+    """Returns the directory a cache entry is stored in."""
+
+    name = hashlib.sha256(
+        "{}:{}".format(CACHE_VERSION, key).encode("utf-8")
+    ).hexdigest()
+    return os.path.join(cache_dir, category, name)
+
+
+def inputs_key(file_keys, options):
+    """Returns a string identifying a set of input files and options.
+
+    file_keys is a dict mapping names to the file_key()s of input files (or
+    None, for inputs that weren't given); options is a dict of
+    JSON-serializable values.
+    """
+
+    return json.dumps({
+        "version": rankratioviz.__version__,
+        "cache_version": CACHE_VERSION,
+        "files": file_keys,
+        "options": options
+    }, sort_keys=True)
+
+
+def ids_key(ids):
+    """Returns a string identifying a set of IDs (regardless of their order).
+    """
+
+    hasher = hashlib.sha256()
+    for id_ in sorted(str(i) for i in ids):
+        hasher.update(id_.encode("utf-8"))
+        hasher.update(b"\n")
+    return hasher.hexdigest()
+
+
+def _load_entry(cache_dir, category, key):
+    """Returns the directory of a cache entry (marking it as just used), or
+    None if there isn't one.
+    """
+
+    entry_dir = _entry_dir(cache_dir, category, key)
+    if not os.path.isdir(entry_dir):
+        return None
+    try:
+        os.utime(entry_dir)
+    except OSError:
+        pass
+    return entry_dir
+
+
+def _save_entry(cache_dir, category, key, write):
+    """Creates a cache entry, by calling write() with the path of a
+    directory to write its files to.
+
+    The entry is written to a temporary directory first and then moved into
+    place, so partially written entries are never loaded.
+    """
+
+    entry_dir = _entry_dir(cache_dir, category, key)
+    os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(entry_dir))
+    try:
+        write(tmp_dir)
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another process might've just created the same entry; either way,
+        # failing to cache something shouldn't cause the run to fail.
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_df(cache_dir, category, key):
+    """Loads a cached DataFrame of floats, or returns None if there isn't one.
+    """
+
+    entry_dir = _load_entry(cache_dir, category, key)
+    if entry_dir is None:
+        return None
+    values = np.load(os.path.join(entry_dir, "values.npy"))
+    index = np.load(os.path.join(entry_dir, "index.npy"))
+    with open(os.path.join(entry_dir, "labels.json"), "r") as lf:
+        labels = json.load(lf)
+    return pd.DataFrame(values, index=pd.Index(index, name=labels["name"]),
+                        columns=labels["columns"])
+
+
+def save_df(cache_dir, category, key, df):
+    """Caches a DataFrame of floats (with string index labels).
+
+    The DataFrame's values and index are stored as .npy files, and its column
+    labels and index name are stored as JSON (so that integer column labels,
+    like those of ordination features, are preserved).
+    """
+
+    def write(tmp_dir):
+        np.save(os.path.join(tmp_dir, "values.npy"),
+                df.to_numpy(dtype=np.float64))
+        np.save(os.path.join(tmp_dir, "index.npy"),
+                df.index.to_numpy(dtype=str))
+        with open(os.path.join(tmp_dir, "labels.json"), "w") as lf:
+            json.dump({"name": df.index.name, "columns": list(df.columns)},
+                      lf)
+
+    _save_entry(cache_dir, category, key, write)
+
+
+def matched_table_key(table_key, sample_metadata_key, feature_metadata_key,
+                      feature_ids):
+    """Returns the key of the matched table (see save_matched_table()) for
+    the given input files (identified by their file_key()s; the feature
+    metadata's is None if it wasn't given) and ranked feature IDs.
+    """
+
+    return json.dumps({
+        "table": table_key,
+        "sample_metadata": sample_metadata_key,
+        "feature_metadata": feature_metadata_key,
+        "ranked_features": ids_key(feature_ids)
+    }, sort_keys=True)
+
+
+def load_matched_table(cache_dir, key):
+    """Loads a cached matched table, or returns None if there isn't one.
+
+    The table's counts are memory-mapped, rather than read into memory.
+
+    Returns:
+
+    (table, original_ids), as returned by
+    rankratioviz.generate.match_inputs().
+    """
+
+    entry_dir = _load_entry(cache_dir, "matched", key)
+    if entry_dir is None:
+        return None
+    arrays = [np.load(os.path.join(entry_dir, name + ".npy"), mmap_mode="r")
+              for name in _CSR_ARRAYS]
+    with open(os.path.join(entry_dir, "ids.json"), "r") as idf:
+        ids = json.load(idf)
+    matrix = csr_matrix(tuple(arrays), copy=False,
+                        shape=(len(ids["observation_ids"]),
+                               len(ids["sample_ids"])))
+    table = Table(matrix, np.array(ids["observation_ids"], dtype=object),
+                  np.array(ids["sample_ids"], dtype=object), validate=False)
+    return table, pd.Index(ids["original_ids"])
+
+
+def save_matched_table(cache_dir, key, table, original_ids):
+    """Caches the output of rankratioviz.generate.match_inputs() (the BIOM
+    table matched up with the other inputs, with its features relabelled,
+    and the original IDs of its features).
+
+    The table's CSR matrix is stored as .npy files, so that the counts can
+    be memory-mapped when they're loaded. The IDs are stored as JSON (since
+    feature IDs including feature metadata can be long, and .npy files of
+    strings pad every string to the length of the longest one).
+    """
+
+    def write(tmp_dir):
+        matrix = table.matrix_data.tocsr()
+        for name in _CSR_ARRAYS:
+            array = getattr(matrix, name)
+            if name == "data":
+                array = array.astype(np.float64, copy=False)
+            np.save(os.path.join(tmp_dir, name + ".npy"), array)
+        with open(os.path.join(tmp_dir, "ids.json"), "w") as idf:
+            json.dump({
+                "observation_ids": [str(i) for i in
+                                    table.ids(axis="observation")],
+                "sample_ids": [str(i) for i in table.ids(axis="sample")],
+                "original_ids": [str(i) for i in original_ids]
+            }, idf)
+
+    _save_entry(cache_dir, "matched", key, write)
+
+
+def _dir_size(dir_loc):
+    size = 0
+    for parent, _, file_names in os.walk(dir_loc):
+        for file_name in file_names:
+            try:
+                size += os.path.getsize(os.path.join(parent, file_name))
+            except OSError:
+                pass
+    return size
+
+
+def evict(cache_dir, max_size=DEFAULT_MAX_SIZE):
+    """Deletes the least recently used entries in a cache directory until
+    its entries take up at most max_size bytes.
+
+    Returns the number of entries deleted.
+    """
+
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return 0
+    for category in os.listdir(cache_dir):
+        category_dir = os.path.join(cache_dir, category)
+        if not os.path.isdir(category_dir):
+            continue
+        for name in os.listdir(category_dir):
+            entry_dir = os.path.join(category_dir, name)
+            # (Skip temporary directories of entries being written.)
+            if len(name) != 64 or not os.path.isdir(entry_dir):
+                continue
+            try:
+                last_used = os.stat(entry_dir).st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, entry_dir, _dir_size(entry_dir)))
+    total_size = sum(e[2] for e in entries)
+    num_deleted = 0
+    for _, entry_dir, size in sorted(entries):
+        if total_size <= max_size:
+            break
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        total_size -= size
+        num_deleted += 1
+    return num_deleted
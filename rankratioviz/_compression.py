@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Utilities for writing precompressed (gzip and brotli) versions of a
+# visualization's data files, which can be sent as-is by a web server.
+# ----------------------------------------------------------------------------
+
+import gzip
+import os
+import shutil
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from rankratioviz._assets import _replace_file
+
+# Maps the content codings we precompress files with (as used in the HTTP
+# Accept-Encoding and Content-Encoding headers) to the extensions of the
+# precompressed files. These are in order of preference.
+PRECOMPRESSED_EXTENSIONS = (("br", ".br"), ("gzip", ".gz"))
+
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 11
+
+# The size of the chunks in which files are read when compressing them.
+_CHUNK_SIZE = 2**20
+
+
+def _gzip_file(src, dst):
+    with open(src, "rb") as in_f, open(dst, "wb") as out_f:
+        # (mtime=0 keeps the output the same for the same input.)
+        with gzip.GzipFile(fileobj=out_f, mode="wb",
+                           compresslevel=GZIP_LEVEL, mtime=0) as gz:
+            shutil.copyfileobj(in_f, gz, _CHUNK_SIZE)
+
+
+def _brotli_file(src, dst):
+    import brotli
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    with open(src, "rb") as in_f, open(dst, "wb") as out_f:
+        for chunk in iter(lambda: in_f.read(_CHUNK_SIZE), b""):
+            out_f.write(compressor.process(chunk))
+        out_f.write(compressor.finish())
+
+
+_COMPRESSORS = {"gzip": _gzip_file, "br": _brotli_file}
+
+
+def available_encodings():
+    """Returns the content codings that files can be precompressed with.
+
+    gzip is always available; brotli is only available if the (optional)
+    brotli package is installed.
+    """
+
+    encodings = []
+    for encoding, _ in PRECOMPRESSED_EXTENSIONS:
+        if encoding == "br":
+            try:
+                import brotli  # noqa: F401
+            except ImportError:
+                continue
+        encodings.append(encoding)
+    return encodings
+
+
+def precompress(file_locs, max_workers=None):
+    """Writes compressed versions of files alongside them.
+
+    For each file, a gzipped version (with .gz appended to its name) is
+    written, along with a brotli-compressed version (with .br appended) if
+    the brotli package is installed. Both use their highest compression
+    levels. The files are compressed in parallel: zlib and brotli both
+    release the GIL while compressing, so this just uses threads.
+
+    Returns a list of the paths of the compressed files.
+    """
+
+    encodings = available_encodings()
+    if "br" not in encodings:
+        warnings.warn("The brotli package isn't installed, so only gzipped "
+                      "versions of files will be written.")
+    extensions = dict(PRECOMPRESSED_EXTENSIONS)
+    tasks = []
+    for file_loc in file_locs:
+        for encoding in encodings:
+            tasks.append((_COMPRESSORS[encoding], file_loc,
+                          file_loc + extensions[encoding]))
+
+    def run(task):
+        compress_func, src, dst = task
+        _replace_file(dst, lambda tmp_loc: compress_func(src, tmp_loc))
+        return dst
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, tasks))
+
+
+def remove_precompressed(file_locs):
+    """Removes any precompressed versions of files (so that outdated ones
+    aren't served in place of the files).
+    """
+
+    for file_loc in file_locs:
+        for _, ext in PRECOMPRESSED_EXTENSIONS:
+            if os.path.isfile(file_loc + ext):
+                os.remove(file_loc + ext)
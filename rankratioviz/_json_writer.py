@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Writes the plot JSON files. The large datasets in these files are streamed
+# out in chunks, straight from the arrays underlying them, rather than first
+# being converted to lists of Python objects in their entirety.
+# ----------------------------------------------------------------------------
+
+import json
+import numpy as np
+import pandas as pd
+
+# Compact separators (no spaces after commas or colons) save a good amount of
+# space in large files.
+SEPARATORS = (",", ":")
+_encoder = json.JSONEncoder(separators=SEPARATORS)
+
+
+def _sanitize_chunk(col, start, end):
+    """Converts part of a pandas Series to a list of JSON-serializable values.
+
+    This mirrors how Altair sanitizes DataFrames passed to an alt.Chart:
+    NaN/infinite floats and missing values are converted to None (so they'll
+    become nulls in the JSON), numpy values are converted to their Python
+    equivalents, and datetimes are converted to ISO 8601 strings.
+    """
+
+    col = col.iloc[start:end]
+    if isinstance(col.dtype, pd.CategoricalDtype) or (
+        isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and
+        not pd.api.types.is_datetime64_any_dtype(col.dtype)
+    ):
+        # Categorical and nullable (e.g. "Int64") columns are handled like
+        # object columns; the latter's missing values (pd.NA) become None.
+        col = col.astype(object)
+    if pd.api.types.is_float_dtype(col.dtype):
+        vals = col.to_numpy()
+        col_list = vals.tolist()
+        bad_positions = np.flatnonzero(~np.isfinite(vals))
+    elif pd.api.types.is_datetime64_any_dtype(col.dtype):
+        col_list = col.dt.strftime("%Y-%m-%dT%H:%M:%S").tolist()
+        bad_positions = np.flatnonzero(col.isnull().to_numpy())
+    elif (pd.api.types.is_integer_dtype(col.dtype) or
+          pd.api.types.is_bool_dtype(col.dtype)):
+        col_list = col.tolist()
+        bad_positions = []
+    else:
+        # Object columns can contain numpy scalars, which the json module
+        # can't serialize
+        col_list = [v.item() if isinstance(v, np.generic) else v
+                    for v in col.tolist()]
+        bad_positions = np.flatnonzero(col.isnull().to_numpy())
+    for i in bad_positions:
+        col_list[i] = None
+    return col_list
+
+
+class ColumnarRecords(object):
+    """A dataset of records (one per row of a DataFrame) stored column-wise.
+
+    When written out using dump(), this is written as a JSON array of
+    objects (i.e. what df.to_dict(orient="records") would produce), but only
+    a chunk of these records is ever materialized at once.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.col_names = [str(c) for c in df.columns]
+
+    def __len__(self):
+        return self.df.shape[0]
+
+    def records(self, start=0, end=None):
+        """Returns a list of the records from row start up to row end."""
+
+        if end is None:
+            end = len(self)
+        columns = [_sanitize_chunk(self.df[c], start, end)
+                   for c in self.df.columns]
+        return [dict(zip(self.col_names, row)) for row in zip(*columns)]
+
+
+def _dump_sequence(seq, fp, chunk_size, get_chunk):
+    """Writes a sequence to fp as a JSON array, chunk_size elements at a time.
+
+    get_chunk(start, end) should return a list of the JSON-serializable
+    elements in [start, end).
+    """
+
+    fp.write("[")
+    for start in range(0, len(seq), chunk_size):
+        if start > 0:
+            fp.write(",")
+        # Encoding a list of elements is done in C by the json module. We
+        # just strip the enclosing brackets off of the chunk's JSON.
+        fp.write(_encoder.encode(get_chunk(start, start + chunk_size))[1:-1])
+    fp.write("]")
+
+
+def dump(obj, fp, chunk_size=10000):
+    """Writes obj to the file-like object fp as compact JSON.
+
+    Like json.dump(), except that:
+
+    -numpy arrays (e.g. of feature counts) are written out as JSON arrays,
+     chunk_size elements at a time, straight from the array.
+    -ColumnarRecords objects are written out as JSON arrays of objects,
+     chunk_size records at a time.
+    -Other lists are also written out chunk_size elements at a time.
+    """
+
+    if isinstance(obj, dict):
+        fp.write("{")
+        for i, (key, val) in enumerate(obj.items()):
+            if i > 0:
+                fp.write(",")
+            fp.write(_encoder.encode(str(key)))
+            fp.write(":")
+            dump(val, fp, chunk_size)
+        fp.write("}")
+    elif isinstance(obj, np.ndarray):
+        _dump_sequence(obj, fp, chunk_size,
+                       lambda s, e: obj[s:e].tolist())
+    elif isinstance(obj, ColumnarRecords):
+        _dump_sequence(obj, fp, chunk_size, obj.records)
+    elif isinstance(obj, list) and len(obj) > chunk_size:
+        _dump_sequence(obj, fp, chunk_size, lambda s, e: obj[s:e])
+    else:
+        fp.write(_encoder.encode(obj))
@@ -0,0 +1,222 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Opt-in instrumentation of the steps ("stages") of generating a
+# visualization. Code marks its stages with stage(); these are no-ops unless
+# they're run inside profiling(), which records how long each stage took and
+# how much memory it used, and writes this out as a JSON report.
+# ----------------------------------------------------------------------------
+
+import cProfile
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+import rankratioviz
+
+REPORT_FILE = "rankratioviz_profile.json"
+
+# The profiler that stage() reports to, if profiling() is active. (We don't
+# support generating multiple visualizations at once in the same process, so
+# a module-level variable suffices.)
+_active = None
+
+
+def _peak_rss_bytes():
+    """Returns the peak resident set size of this process so far, in bytes,
+    or None if this can't be determined (e.g. on Windows).
+    """
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == "darwin":
+        return peak
+    return peak * 1024
+
+
+class StageProfiler(object):
+    """Records the wall time, CPU time, and memory usage of stages.
+
+    Stages can be nested; each stage's record is named by the path of stages
+    it's in (e.g. "gen_visualization/gen_sample_plot"). Records are listed
+    in the order their stages started.
+
+    If use_cprofile is True, each top-level stage is also run under cProfile
+    (which slows it down), so that the slowest one's profile can be dumped.
+    """
+
+    def __init__(self, use_cprofile=False):
+        self.use_cprofile = use_cprofile
+        self.records = []
+        self.discarded = False
+        self._stack = []
+        self._cprofiles = {}
+
+    @contextmanager
+    def stage(self, name, **info):
+        names = [r["name"] for r in self._stack]
+        record = {"name": "/".join(names + [name]),
+                  "depth": len(self._stack),
+                  "info": dict(info)}
+        self.records.append(record)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_mem, peak_mem = tracemalloc.get_traced_memory()
+            self._note_traced_peak(peak_mem)
+            if hasattr(tracemalloc, "reset_peak"):
+                # (Python 3.9+; before that, each stage's peak is just the
+                # peak of the whole run so far.)
+                tracemalloc.reset_peak()
+            record["_child_peak"] = 0
+        cprof = None
+        if self.use_cprofile and len(self._stack) == 0:
+            cprof = cProfile.Profile()
+            self._cprofiles[record["name"]] = cprof
+        self._stack.append(record)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if cprof is not None:
+            cprof.enable()
+        try:
+            yield record["info"]
+        finally:
+            if cprof is not None:
+                cprof.disable()
+            record["wall_seconds"] = time.perf_counter() - start_wall
+            record["cpu_seconds"] = time.process_time() - start_cpu
+            self._stack.pop()
+            record["tracemalloc_peak_bytes"] = None
+            if tracing:
+                peak_mem = max(tracemalloc.get_traced_memory()[1],
+                               record.pop("_child_peak"))
+                record["tracemalloc_peak_bytes"] = peak_mem - start_mem
+                self._note_traced_peak(peak_mem)
+            record["peak_rss_bytes"] = _peak_rss_bytes()
+
+    def _note_traced_peak(self, peak_mem):
+        """Passes on a traced memory peak to the enclosing stage, before
+        tracemalloc's peak is reset.
+        """
+        if len(self._stack) > 0:
+            parent = self._stack[-1]
+            parent["_child_peak"] = max(parent.get("_child_peak", 0),
+                                        peak_mem)
+
+    def note(self, **info):
+        """Adds information (e.g. input dimensions) to the current stage."""
+        if len(self._stack) > 0:
+            self._stack[-1]["info"].update(info)
+
+    def discard(self):
+        """Tells profiling() not to write a report (e.g. because nothing
+        worth profiling was done, and an earlier report should be kept).
+        """
+        self.discarded = True
+
+    def slowest_stage(self):
+        """Returns the name of the slowest top-level stage, or None if no
+        stages have finished.
+        """
+        top_level = [r for r in self.records
+                     if r["depth"] == 0 and "wall_seconds" in r]
+        if len(top_level) == 0:
+            return None
+        return max(top_level, key=lambda r: r["wall_seconds"])["name"]
+
+    def write_report(self, output_dir, total_wall_seconds=None):
+        """Writes the report (and, if use_cprofile is True, a cProfile dump
+        of the slowest top-level stage) to output_dir.
+
+        Returns the path of the report.
+        """
+        report = {
+            "rankratioviz_version": rankratioviz.__version__,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "total_wall_seconds": total_wall_seconds,
+            "stages": self.records,
+            "slowest_stage": self.slowest_stage(),
+            "cprofile_file": None
+        }
+        os.makedirs(output_dir, exist_ok=True)
+        slowest = report["slowest_stage"]
+        if slowest in self._cprofiles:
+            report["cprofile_file"] = "rankratioviz_profile_{}.prof".format(
+                slowest
+            )
+            self._cprofiles[slowest].dump_stats(
+                os.path.join(output_dir, report["cprofile_file"])
+            )
+        report_loc = os.path.join(output_dir, REPORT_FILE)
+        with open(report_loc, "w") as f:
+            json.dump(report, f, indent=2)
+        return report_loc
+
+
+@contextmanager
+def profiling(output_dir, enabled=True, use_cprofile=False,
+              trace_memory=True):
+    """Profiles the stages run inside this context, and writes a report to
+    output_dir (see StageProfiler.write_report()) once they've finished,
+    unless the profiler's discard() method was called.
+
+    If enabled is False, this does nothing. If trace_memory is True,
+    tracemalloc is used to measure the peak memory allocated by each stage
+    (this slows things down a bit); the process' peak RSS is always
+    recorded.
+    """
+
+    global _active
+    if not enabled:
+        yield None
+        return
+    profiler = StageProfiler(use_cprofile=use_cprofile)
+    started_tracing = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = profiler
+    start_wall = time.perf_counter()
+    try:
+        yield profiler
+    finally:
+        _active = None
+        if started_tracing:
+            tracemalloc.stop()
+    if not profiler.discarded:
+        profiler.write_report(output_dir, time.perf_counter() - start_wall)
+
+
+@contextmanager
+def stage(name, **info):
+    """Marks the code run inside this context as a stage called name.
+
+    Keyword arguments (and anything passed to note() during the stage) are
+    included in the stage's record. If profiling isn't active, this does
+    nothing.
+    """
+
+    if _active is None:
+        yield None
+    else:
+        with _active.stage(name, **info) as stage_info:
+            yield stage_info
+
+
+def note(**info):
+    """Adds information to the current stage's record, if profiling is
+    active.
+    """
+
+    if _active is not None:
+        _active.note(**info)
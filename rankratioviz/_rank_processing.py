@@ -7,31 +7,107 @@
 # The full license is in the file LICENSE.txt, distributed with this software.
 # ----------------------------------------------------------------------------
 
-import skbio
+import numpy as np
 import pandas as pd
+from rankratioviz import _cache
 
 
-def rank_file_to_df(file_loc):
-    """Converts an input file of ranks to a DataFrame."""
+def rank_file_to_df(file_loc, cache_dir=None, key=None):
+    """Converts an input file of ranks to a DataFrame.
+
+    If cache_dir is not None, the parsed ranks are cached in this directory
+    (keyed by the contents and modification time of the input file), and
+    later calls on the same file will just load the cached ranks. If the
+    file's rankratioviz._cache.file_key() has already been computed, it can
+    be passed as key.
+    """
+
+    if cache_dir is not None:
+        if key is None:
+            key = _cache.file_key(file_loc, cache_dir)
+        cached_ranks = _cache.load_df(cache_dir, "ranks", key)
+        if cached_ranks is not None:
+            return cached_ranks
 
     if file_loc.endswith(".tsv"):
-        return differentials_to_df(file_loc)
+        ranks = differentials_to_df(file_loc)
     else:
         # ordination_to_df() will raise an appropriate error if it can't
         # process this file.
-        return ordination_to_df(file_loc)
+        ranks = ordination_to_df(file_loc)
+
+    if cache_dir is not None:
+        _cache.save_df(cache_dir, "ranks", key, ranks)
+    return ranks
+
+
+def read_ordination_features(ordination_file_loc):
+    """Reads just the feature ("Species") section of an ordination.txt file.
+
+    Returns a DataFrame of the feature coordinates, just like the "features"
+    attribute of the skbio.OrdinationResults that would be read from this
+    file -- or None if the file doesn't look like an ordination.txt file
+    with a nonempty feature section.
+
+    Unlike skbio.OrdinationResults.read(), this doesn't parse any of the
+    other sections of the file (e.g. the sample coordinates, which we don't
+    use): it just skips over lines until it reaches the feature section.
+    """
+
+    with open(ordination_file_loc, "r") as of:
+        if not of.readline().startswith("Eigvals\t"):
+            return None
+        line = of.readline()
+        while line != "" and not line.startswith("Species\t"):
+            line = of.readline()
+        if line == "":
+            return None
+        header = line.rstrip("\n").split("\t")
+        if len(header) != 3:
+            return None
+        num_features, num_dims = int(header[1]), int(header[2])
+        if num_features == 0:
+            return None
+        features = pd.read_csv(
+            of, sep="\t", header=None, index_col=0, nrows=num_features,
+            dtype={0: str, **{d: np.float64 for d in range(1, num_dims + 1)}},
+            engine="c"
+        )
+    # skbio labels these columns 0, 1, ... and doesn't name the index
+    features.columns = range(num_dims)
+    features.index.name = None
+    return features
 
 
 def ordination_to_df(ordination_file_loc):
     """Converts an ordination.txt file to a DataFrame of its feature ranks."""
 
-    # If this fails, it raises an skbio.io.UnrecognizedFormatError.
-    ordination = skbio.OrdinationResults.read(ordination_file_loc)
-    return ordination.features
+    features = read_ordination_features(ordination_file_loc)
+    if features is None:
+        # Fall back to letting skbio read the file. (skbio takes a while to
+        # import, so we only import it when we need it.)
+        import skbio
+        # If this fails, it raises an skbio.io.UnrecognizedFormatError.
+        ordination = skbio.OrdinationResults.read(ordination_file_loc)
+        features = ordination.features
+    return features
 
 
 def differentials_to_df(differentials_loc):
-    """Converts a differential rank TSV file to a DataFrame."""
+    """Converts a differential rank TSV file to a DataFrame.
+
+    The first column of the file is used as the index (and read as strings);
+    every other column is read as float64s. (This way pandas doesn't have to
+    infer the type of each column, and a non-numeric value in a column of
+    differentials results in an error here rather than in a column of
+    objects.)
+    """
 
-    differentials = pd.read_csv(differentials_loc, sep='\t', index_col=0)
+    # Read just the header, in order to figure out the column names.
+    header = pd.read_csv(differentials_loc, sep='\t', nrows=0).columns
+    dtypes = {header[0]: str}
+    for col in header[1:]:
+        dtypes[col] = np.float64
+    differentials = pd.read_csv(differentials_loc, sep='\t', index_col=0,
+                                dtype=dtypes, engine="c")
     return differentials
@@ -14,21 +14,78 @@
 # https://github.com/knightlab-analyses/reference-frames.
 # ----------------------------------------------------------------------------
 
+import io
 import json
 import os
-from shutil import copyfile, copytree
+import shutil
+import tempfile
+import numpy as np
 import pandas as pd
-import altair as alt
+from biom import Table
+from scipy.sparse import csr_matrix, vstack
+from rankratioviz._json_writer import ColumnarRecords, dump
+from rankratioviz._assets import (SUPPORT_FILES_DIR, INDEX_FILE,
+                                  copy_support_files, link_shared_assets,
+                                  remove_support_files, write_single_file)
+from rankratioviz._compression import precompress, remove_precompressed
+from rankratioviz import _profiling
 
+# Describes the inputs a visualization was last generated from (see
+# gen_visualization()'s inputs_key argument).
+INPUTS_FILE = ".rankratioviz_inputs.json"
 
-def matchdf(df1, df2):
-    """Filters both DataFrames to just the rows of their shared indices.
+
+def _get_ids(obj, axis):
+    """Returns the IDs of a DataFrame (its index) or of a biom.Table (its IDs
+       along the given axis) as a pandas Index.
+    """
+
+    if isinstance(obj, pd.DataFrame):
+        return obj.index
+    return pd.Index(obj.ids(axis=axis))
+
+
+def _take_ids(obj, ids, positions, axis):
+    """Filters a DataFrame or biom.Table to the IDs at the given positions.
+
+       For biom.Tables, this slices the underlying sparse matrix directly
+       (without densifying it or copying the entire table).
+    """
+
+    if isinstance(obj, pd.DataFrame):
+        return obj.iloc[positions]
+    if axis == "observation":
+        return Table(obj.matrix_data[positions], ids, obj.ids(axis="sample"),
+                     validate=False)
+    return Table(obj.matrix_data[:, positions], obj.ids(axis="observation"),
+                 ids, validate=False)
+
+
+def matchdf(df1, df2, axis="observation", return_dropped=False):
+    """Filters both inputs to just the rows of their shared indices.
+
+       Each input can be either a pandas DataFrame (in which case its index
+       is used) or a biom.Table (in which case its IDs along the specified
+       axis are used). Matching is done using hash-based pandas Index
+       lookups, and the order of the shared IDs in df1 is preserved in both
+       outputs -- so the output is deterministic.
+
+       If return_dropped is True, this also returns two pandas Indexes
+       containing the IDs that were dropped from df1 and from df2,
+       respectively (in their original orders).
 
        Derived from gneiss.util.match() (https://github.com/biocore/gneiss).
     """
 
-    idx = set(df1.index) & set(df2.index)
-    return df1.loc[idx], df2.loc[idx]
+    ids1 = _get_ids(df1, axis)
+    ids2 = _get_ids(df2, axis)
+    in_ids2 = ids1.isin(ids2)
+    idx = ids1[in_ids2]
+    matched1 = _take_ids(df1, idx, in_ids2.nonzero()[0], axis)
+    matched2 = _take_ids(df2, idx, ids2.get_indexer(idx), axis)
+    if return_dropped:
+        return matched1, matched2, ids1[~in_ids2], ids2[~ids2.isin(idx)]
+    return matched1, matched2
 
 
 def assert_df_indices_unique(df):
@@ -36,9 +93,170 @@ def assert_df_indices_unique(df):
     assert len(df.index.unique()) == df.shape[0]
 
 
+def read_feature_list(file_loc):
+    """Reads a file of feature IDs, one per line (ignoring blank lines)."""
+    with open(file_loc, "r") as f:
+        return [line.strip() for line in f if line.strip() != ""]
+
+
+def select_budget_features(feature_ranks, table, tail_features=None,
+                           keep_features=None, min_prevalence=None,
+                           min_abundance=None, feature_ids=None):
+    """Decides which features to keep under a "feature budget".
+
+       Arguments:
+
+       feature_ranks: DataFrame of feature ranks, with the same features (in
+                      the same order) as table's observations.
+       table: biom.Table of feature counts.
+       tail_features: if this isn't None, only the tail_features highest-
+                      and tail_features lowest-ranked eligible features for
+                      each rank column are kept.
+       keep_features: IDs of features to keep no matter what.
+       min_prevalence: if this isn't None, features present (with a nonzero
+                       count) in less than this fraction of samples aren't
+                       eligible.
+       min_abundance: if this isn't None, features whose total count across
+                      all samples is less than this aren't eligible.
+       feature_ids: the IDs that keep_features refers to the features by (in
+                    the same order as feature_ranks). Defaults to the index
+                    of feature_ranks.
+
+       Returns:
+
+       A boolean numpy array: for each feature, whether it's kept.
+
+       Raises:
+
+       ValueError: if keep_features contains an ID that isn't in
+                   feature_ids.
+    """
+    if feature_ids is None:
+        feature_ids = feature_ranks.index
+    # These are computed on the sparse matrix (so they only look at the
+    # nonzero counts).
+    counts = table.matrix_data.tocsr(copy=True)
+    counts.eliminate_zeros()
+    eligible = np.ones(counts.shape[0], dtype=bool)
+    if min_prevalence is not None:
+        prevalence = counts.getnnz(axis=1) / max(counts.shape[1], 1)
+        eligible &= prevalence >= min_prevalence
+    if min_abundance is not None:
+        eligible &= np.asarray(counts.sum(axis=1)).ravel() >= min_abundance
+
+    keep = eligible.copy()
+    if tail_features is not None:
+        keep[:] = False
+        eligible_positions = eligible.nonzero()[0]
+        for col in feature_ranks.columns:
+            col_ranks = feature_ranks[col].values[eligible_positions]
+            order = np.argsort(col_ranks, kind="mergesort")
+            keep[eligible_positions[order[:tail_features]]] = True
+            keep[eligible_positions[order[-tail_features:]]] = True
+    if keep_features is not None:
+        keep_ids = pd.Index(list(keep_features)).unique()
+        positions = pd.Index(feature_ids).get_indexer(keep_ids)
+        if (positions < 0).any():
+            missing = keep_ids[positions < 0]
+            raise ValueError(
+                "{} feature(s) to keep are not ranked features, including "
+                "{}".format(len(missing), missing[0])
+            )
+        keep[positions] = True
+    return keep
+
+
+def collapse_features(feature_ranks, table, keep):
+    """Collapses the features that aren't kept into a single feature.
+
+       The collapsed feature (named "Other (N features)") has the sum of the
+       collapsed features' counts in each sample, and the mean of their
+       ranks for each rank column. This way, it's drawn in the middle of the
+       rank plot -- in place of the features it replaces -- and using it in
+       a log ratio is the same as using all of those features.
+
+       feature_ranks and table should have the same features, in the same
+       order; keep is a boolean array indicating which features to keep (see
+       select_budget_features()).
+
+       Returns:
+
+       (feature_ranks, table), with just the kept features followed by the
+       collapsed feature (if any features were collapsed).
+    """
+    kept_positions = keep.nonzero()[0]
+    other_positions = (~keep).nonzero()[0]
+    feature_ids = table.ids(axis="observation")
+    matrix = table.matrix_data.tocsr()
+    kept_ranks = feature_ranks.iloc[kept_positions]
+    kept_ids = list(feature_ids[kept_positions])
+    kept_matrix = matrix[kept_positions]
+    if len(other_positions) > 0:
+        other_id = "Other ({} features)".format(len(other_positions))
+        # (It's really unlikely that a feature already has this ID, but
+        # feature IDs have to be unique, so we check.)
+        while other_id in kept_ranks.index:
+            other_id = "Other " + other_id
+        other_ranks = feature_ranks.iloc[other_positions].mean(axis=0)
+        kept_ranks = pd.concat([kept_ranks, other_ranks.to_frame(other_id).T])
+        kept_ranks.index.name = feature_ranks.index.name
+        other_counts = csr_matrix(matrix[other_positions].sum(axis=0))
+        kept_matrix = vstack([kept_matrix, other_counts], format="csr")
+        kept_ids.append(other_id)
+    return kept_ranks, Table(kept_matrix, kept_ids, table.ids(axis="sample"),
+                             validate=False)
+
+
+def apply_feature_budget(feature_ranks, table, tail_features=None,
+                         keep_features=None, min_prevalence=None,
+                         min_abundance=None, feature_ids=None):
+    """Filters feature_ranks and table down to the features selected by
+       select_budget_features(), collapsing the rest into one feature (see
+       collapse_features()).
+
+       feature_ranks and table should have the same features, in the same
+       order. Returns (feature_ranks, table).
+    """
+    keep = select_budget_features(feature_ranks, table, tail_features,
+                                  keep_features, min_prevalence,
+                                  min_abundance, feature_ids)
+    _profiling.note(budget_kept_features=int(keep.sum()),
+                    budget_collapsed_features=int((~keep).sum()))
+    return collapse_features(feature_ranks, table, keep)
+
+
 def process_input(feature_ranks, sample_metadata, biom_table,
-                  feature_metadata=None):
-    """Loads the ordination file, BIOM table, and optionally taxonomy data."""
+                  feature_metadata=None, feature_budget=None):
+    """Loads the ordination file, BIOM table, and optionally taxonomy data.
+
+       This is just match_inputs() followed by finish_input(); see those for
+       details.
+
+       If feature_budget is not None, it should be a dict of keyword
+       arguments for apply_feature_budget() (e.g. {"tail_features": 100}):
+       only the features this selects are kept, and the rest are collapsed
+       into a single "Other" feature.
+    """
+    table, original_ids = match_inputs(feature_ranks, sample_metadata,
+                                       biom_table, feature_metadata)
+    return finish_input(feature_ranks, table, original_ids, feature_budget)
+
+
+def match_inputs(feature_ranks, sample_metadata, biom_table,
+                 feature_metadata=None):
+    """Matches the BIOM table up with the feature ranks and sample metadata,
+       and (if feature_metadata is given) relabels its features to include
+       their metadata.
+
+       This only uses the IDs of the features in feature_ranks, and not their
+       ranks -- so its output can be reused for other ranks of the same
+       features (see rankratioviz._cache.save_matched_table()).
+
+       Returns:
+
+       (table, original_ids): the matched and relabelled biom.Table, and a
+       pandas Index of the original IDs of its features (in the same order).
+    """
 
     # Assert that the feature IDs and sample IDs contain only unique IDs.
     # (This doesn't check that there aren't any identical IDs between the
@@ -48,22 +266,44 @@ def process_input(feature_ranks, sample_metadata, biom_table,
     assert_df_indices_unique(feature_ranks)
     assert_df_indices_unique(sample_metadata)
 
-    table = biom_table.to_dataframe().to_dense()
     # Match features to BIOM table, and then match samples to BIOM table.
     # This should bring us to a point where every feature/sample is
     # supported in the BIOM table. (Note that the input BIOM table might
     # contain features or samples that are not included in feature_ranks or
     # sample_metadata, respectively -- this is totally fine. The opposite,
     # though, is a big no-no.)
-    table, V = matchdf(table, feature_ranks)
+    #
+    # We do all of this directly on the sparse BIOM table: converting it to a
+    # dense DataFrame here would allocate (# features) x (# samples) values,
+    # which is infeasible for large tables (most of whose entries are zeros).
+    _profiling.note(table_features=biom_table.shape[0],
+                    table_samples=biom_table.shape[1],
+                    ranked_features=feature_ranks.shape[0],
+                    rank_columns=feature_ranks.shape[1],
+                    metadata_samples=sample_metadata.shape[0])
+    with _profiling.stage("match_features"):
+        table, V, _, dropped_features = matchdf(
+            biom_table, feature_ranks, axis="observation",
+            return_dropped=True
+        )
     # Assert that every ranked feature was present in the BIOM table.
-    assert V.shape[0] == feature_ranks.shape[0]
+    assert len(dropped_features) == 0, (
+        "{} ranked feature(s) are not present in the BIOM table, including "
+        "{}".format(len(dropped_features), dropped_features[0])
+    )
 
-    table, U = matchdf(table.T, sample_metadata)
+    with _profiling.stage("match_samples"):
+        table, U, _, dropped_samples = matchdf(
+            table, sample_metadata, axis="sample", return_dropped=True
+        )
     # Assert that every sample was present in the BIOM table.
-    assert U.shape[0] == sample_metadata.shape[0]
+    assert len(dropped_samples) == 0, (
+        "{} sample(s) in the sample metadata are not present in the BIOM "
+        "table, including {}".format(len(dropped_samples), dropped_samples[0])
+    )
 
-    labelled_feature_ranks = feature_ranks.copy()
+    table_feature_ids = table.ids(axis="observation")
+    original_ids = pd.Index(table_feature_ids)
     # Now that we've matched up the BIOM table with the feature ranks and
     # sample metadata, we're pretty much done. If the user passed in feature
     # metadata corresponding to taxonomy information, then we use that to
@@ -79,30 +319,57 @@ def process_input(feature_ranks, sample_metadata, biom_table,
         # metadata values, this is how we'd do that.
         # assert V.shape[0] == feature_ranks.shape[0]
 
-        no_metadata_feature_ids = (set(feature_ranks.index)
-                                   - set(matched_feature_metadata.index))
-
-        # Create nice IDs for each feature with associated metadata.
-        new_feature_ids = pd.Series(index=feature_ranks.index)
-        for feature_row in matched_feature_metadata.iterrows():
-            str_vals = [str(v) for v in feature_row[1].values]
-            id_prefix = feature_row[0] + '|'
-            new_feature_ids[feature_row[0]] = id_prefix + '|'.join(str_vals)
-        # Features with no associated metadata just get their old IDs.
-        for feature_row_id in no_metadata_feature_ids:
-            new_feature_ids[feature_row_id] = feature_row_id
-        # Now we have our nice IDs. Update labelled_feature_ranks and the
-        # table accordingly.
-        labelled_feature_ranks.index = new_feature_ids
-        # Update the table's columns (corresponding to features) to match the
-        # new feature IDs.
-        # First, we define new_feature_ids_tbl, which is just a list of the
-        # values of new_feature_ids sorted to match the order of the
-        # columns in the BIOM table.
-        new_feature_ids_tbl = [new_feature_ids[fc] for fc in table.columns]
-        # Then, we can just set the table's columns to this in order to augment
-        # existing columns' IDs with feature metadata where available.
-        table.columns = new_feature_ids_tbl
+        # Create nice IDs for each feature with associated metadata: each of
+        # these IDs is the feature's original ID followed by all of its
+        # metadata values, separated by | characters.
+        #
+        # We stringify the metadata values from the metadata's .values array.
+        # For DataFrames with mixed dtypes, this is an object array of the
+        # original values; otherwise, it's an array of the common dtype of all
+        # columns. Either way, converting this array to strings with numpy
+        # converts each value just like str() would when iterating over the
+        # rows of the DataFrame. The joining is then done column-wise using
+        # pandas' string methods, rather than row by row.
+        md_strs = pd.DataFrame(
+            matched_feature_metadata.values.astype(str),
+            index=matched_feature_metadata.index
+        )
+        md_cols = [md_strs[c] for c in md_strs.columns]
+        if len(md_cols) > 0:
+            joined_vals = md_cols[0].str.cat(md_cols[1:], sep='|')
+        else:
+            joined_vals = ''
+        md_feature_ids = md_strs.index.to_series() + '|' + joined_vals
+        # Features with no associated metadata just get their old IDs. (The
+        # table's features are exactly the ranked features, so this gives us
+        # the new IDs in the same order as the table's features.)
+        new_feature_ids_tbl = md_feature_ids.reindex(original_ids)
+        new_feature_ids_tbl.fillna(original_ids.to_series(), inplace=True)
+        # Now we have our nice IDs. Update the table's observation IDs
+        # (corresponding to features) to match them, in order to augment
+        # existing features' IDs with feature metadata where available.
+        table.update_ids(dict(zip(table_feature_ids,
+                                  new_feature_ids_tbl.values)),
+                         axis="observation", inplace=True)
+
+    _profiling.note(matched_features=table.shape[0],
+                    matched_samples=table.shape[1],
+                    matched_nonzero_counts=table.matrix_data.nnz)
+    return table, original_ids
+
+
+def finish_input(feature_ranks, table, original_ids, feature_budget=None):
+    """Relabels feature_ranks to match the output of match_inputs() (and
+       applies the feature budget, if one is given; see process_input()).
+
+       Returns:
+
+       (V, table): the relabelled feature ranks and the table.
+    """
+    labels = pd.Series(table.ids(axis="observation"), index=original_ids)
+    V = feature_ranks.copy()
+    V.index = pd.Index(labels.reindex(feature_ranks.index).values,
+                       name=feature_ranks.index.name)
 
     # Small sanity test: check that incorporating feature metadata didn't
     # accidentally make some feature IDs the same.
@@ -110,21 +377,115 @@ def process_input(feature_ranks, sample_metadata, biom_table,
     # Assuming each feature ID is preserved in the new ID this should never be
     # the case, but in case we modify the above code this will still ensure
     # that something isn't going horribly wrong somehow.
-    assert_df_indices_unique(labelled_feature_ranks)
+    assert_df_indices_unique(V)
+
+    if feature_budget is not None:
+        # apply_feature_budget() expects the ranks to be in the same order as
+        # the table's features. (Features to keep are given by their
+        # original IDs, so we pass those along too.)
+        with _profiling.stage("apply_feature_budget"):
+            V, table = apply_feature_budget(
+                V.loc[table.ids(axis="observation")], table,
+                feature_ids=original_ids, **feature_budget
+            )
+    return V, table
+
+
+def gen_rank_sort_orders(rank_data, rank_cols):
+    """Computes the order in which features are plotted for each rank.
+
+    Arguments:
+
+    rank_data: the rank plot's data (sorted by the first rank column)
+    rank_cols: the names of the rank columns in rank_data
+
+    Returns:
+
+    A dict mapping each rank column to an int32 array of the row indices of
+    rank_data, in ascending order of that column's ranks (so the feature in
+    row order[x] is plotted at x when this rank is shown). Features with
+    missing ranks are placed at the end.
+    """
+
+    sort_orders = {}
+    for i, col in enumerate(rank_cols):
+        if i == 0:
+            # rank_data is already sorted by the first rank column
+            order = np.arange(rank_data.shape[0])
+        else:
+            vals = pd.to_numeric(rank_data[col]).to_numpy(dtype=np.float64)
+            order = np.argsort(vals, kind="stable")
+        sort_orders[col] = order.astype(np.int32)
+    return sort_orders
+
+
+def gen_rank_lod(rank_data, sort_orders, max_bars):
+    """Picks out a "zoomed-out" subset of the features in the rank plot.
+
+    For each rank column, the features (sorted by that column) are split into
+    max_bars // 2 bins of consecutive features. We keep the features with the
+    minimum and maximum rank in each bin (along with the first and last
+    feature overall, so the x-axis still spans every feature). Drawing just
+    these features still shows the full extent of the rank plot, since every
+    other feature's bar is covered by the bars of the features at the
+    extremes of its bin.
+
+    Arguments:
+
+    rank_data: the rank plot's data (one row per feature)
+    sort_orders: the output of gen_rank_sort_orders() for rank_data
+    max_bars: the maximum number of features to draw at once
+
+    Returns:
+
+    A dict containing max_bars and a dict mapping each rank column to a
+    sorted array of the row indices (in rank_data) of the features to draw
+    for that column when zoomed out.
+    """
 
-    return labelled_feature_ranks, table
+    num_features = rank_data.shape[0]
+    num_bins = max(max_bars // 2, 1)
+    bin_size = -(-num_features // num_bins)
+    num_bins = -(-num_features // bin_size)
+    padding = num_bins * bin_size - num_features
+    bin_starts = np.arange(num_bins) * bin_size
+    rows = {}
+    for col, order in sort_orders.items():
+        vals = pd.to_numeric(rank_data[col]).to_numpy(dtype=np.float64)[order]
+        # Pad out the last bin, and make sure missing ranks (and padding)
+        # are never picked as a minimum or maximum
+        vals_for_min = np.append(np.where(np.isnan(vals), np.inf, vals),
+                                 np.full(padding, np.inf))
+        vals_for_max = np.append(np.where(np.isnan(vals), -np.inf, vals),
+                                 np.full(padding, -np.inf))
+        bin_mins = vals_for_min.reshape(num_bins, bin_size).argmin(axis=1)
+        bin_maxs = vals_for_max.reshape(num_bins, bin_size).argmax(axis=1)
+        positions = np.concatenate([
+            [0, num_features - 1], bin_starts + bin_mins, bin_starts + bin_maxs
+        ])
+        positions = positions[positions < num_features]
+        rows[col] = np.unique(order[positions]).astype(np.int32)
+    return {"max_bars": max_bars, "rows": rows}
 
 
-def gen_rank_plot(V):
+def gen_rank_plot(V, max_bars=None):
     """Generates altair.Chart object describing the rank plot.
 
     Arguments:
 
     V: feature ranks
+    max_bars: if this is not None and there are more than this many
+              features, the rank plot will only draw at most (about) this
+              many features at once: when zoomed out, it'll draw a subset
+              of the features that preserves the shape of the plot (see
+              gen_rank_lod()), and it'll only draw every feature in the
+              visible range once few enough features are visible.
 
     Returns:
 
-    JSON describing altair.Chart for the rank plot.
+    JSON describing altair.Chart for the rank plot. (Its large datasets are
+    stored as ColumnarRecords objects, so this should be written out using
+    rankratioviz._json_writer.dump() rather than json.dump().)
     """
 
     # TODO make a copy of V first, just to be extra safe
@@ -155,7 +516,7 @@ def gen_rank_plot(V):
     # (This value will be updated when a taxon is selected in the rank plot as
     # part of the numerator, denominator, or both parts of the current log
     # ratio.)
-    classification = pd.Series(index=rank_vals.index).fillna("None")
+    classification = pd.Series("None", index=rank_vals.index, dtype=object)
 
     # Start populating the DataFrame we'll pass into Altair as the main source
     # of data for the rank plot.
@@ -177,44 +538,224 @@ def gen_rank_plot(V):
     # Setting size to 1.0 fixes this; using mark_rule() also fixes this,
     # probably because the lines in rule charts are just lines with a width
     # of 1.0.
+    #
+    # We only give Altair the *name* of the dataset to use, rather than the
+    # DataFrame itself: this way Altair just builds (and validates) the spec
+    # describing the chart's encodings, which is fast regardless of how many
+    # features there are. We then attach the actual data to the spec
+    # ourselves (as a ColumnarRecords object, which is streamed out when the
+    # JSON is written). Since Altair can't infer the types of
+    # fields without the data, we specify all of them explicitly.
+    # (Altair takes a while to import, so we only import it when we're
+    # actually building a chart's spec.)
+    import altair as alt
+    rank_data_name = "rankratioviz_rank_data"
     rank_chart = alt.Chart(
-        rank_data,
+        alt.NamedData(name=rank_data_name),
         title="Feature Ranks"
     ).mark_bar().encode(
         x=alt.X('x', title="Features", type="quantitative"),
         y=alt.Y(default_rank_col, type="quantitative"),
         color=alt.Color(
             "Classification",
+            type="nominal",
             scale=alt.Scale(
                 domain=["None", "Numerator", "Denominator", "Both"],
                 range=["#e0e0e0", "#f00", "#00f", "#949"]
             )
         ),
         size=alt.value(1.0),
-        tooltip=["x", "Classification", "Feature ID"]
+        tooltip=["x:Q", "Classification:N", "Feature ID:N"]
     ).configure_axis(
         # Done in order to differentiate "None"-classification taxa from grid
         # lines
         gridOpacity=0.35
-    ).interactive()
+    ).add_selection(
+        # This is what .interactive() does, but we name the selection
+        # ourselves: otherwise, Altair numbers it using a global counter, so
+        # the JSON would differ between otherwise-identical runs.
+        alt.selection_interval(bind="scales", encodings=["x", "y"],
+                               name="rankratioviz_rank_zoom")
+    )
 
     rank_chart_json = rank_chart.to_dict()
+    rank_chart_json["datasets"] = {rank_data_name: ColumnarRecords(rank_data)}
     rank_ordering = "rankratioviz_rank_ordering"
     rank_chart_json["datasets"][rank_ordering] = list(V.columns)
+    # The features are initially plotted in order of the first rank column;
+    # the JS code uses these to re-order them when the rank shown changes.
+    sort_orders = gen_rank_sort_orders(rank_data, V.columns)
+    rank_chart_json["datasets"]["rankratioviz_rank_sort_orders"] = sort_orders
+    if max_bars is not None and rank_data.shape[0] > max_bars:
+        rank_chart_json["datasets"]["rankratioviz_rank_lod"] = gen_rank_lod(
+            rank_data, sort_orders, max_bars
+        )
     return rank_chart_json
 
 
-def gen_sample_plot(table, metadata):
+def gen_search_index(feature_ids):
+    """Precomputes an index for searching through features' taxonomic ranks.
+
+    Each feature ID is split into its "ranks" the same way the JS code
+    interprets rank searches: we take the part of the ID before the first |
+    character (if any) and split that on semicolons. Each distinct rank
+    ("token") is then assigned an integer ID.
+
+    Arguments:
+
+    feature_ids: an array of feature IDs, in the order of their integer
+                 column indices.
+
+    Returns:
+
+    A dict containing:
+    -tokens: a list of all distinct tokens (the token with ID t is tokens[t])
+    -token_indptr, token_features: an inverted index from tokens to features,
+     in CSR form: the (sorted) column indices of the features that contain
+     token t are token_features[token_indptr[t]:token_indptr[t + 1]].
+    -lineage_indptr, lineage_tokens: the IDs of the tokens of each feature
+     (i.e. the pre-split lineage of each feature), in order, in CSR form.
+    """
+
+    lineages = pd.Series(feature_ids).str.split("|").str[0].str.split(";")
+    lineage_lengths = lineages.str.len().to_numpy()
+    lineage_indptr = np.concatenate([[0], np.cumsum(lineage_lengths)])
+    exploded = lineages.explode()
+    lineage_tokens, tokens = pd.factorize(exploded, sort=False)
+
+    # For the inverted index, each feature should only be listed once for a
+    # given token (even if that token occurs multiple times in its lineage).
+    pairs = pd.DataFrame({
+        "token": lineage_tokens,
+        "feature": np.repeat(np.arange(len(feature_ids)), lineage_lengths)
+    }).drop_duplicates()
+    pairs.sort_values(by=["token", "feature"], inplace=True)
+    token_counts = np.bincount(pairs["token"], minlength=len(tokens))
+    token_indptr = np.concatenate([[0], np.cumsum(token_counts)])
+    return {
+        "tokens": list(tokens),
+        "token_indptr": token_indptr,
+        "token_features": pairs["feature"].to_numpy(),
+        "lineage_indptr": lineage_indptr,
+        "lineage_tokens": lineage_tokens
+    }
+
+
+def write_binary_counts(counts, counts_loc):
+    """Writes a sparse (CSR) count matrix to a little-endian binary file.
+
+    The indptr, indices, and data arrays of the matrix are written one after
+    another, each starting at an offset that is a multiple of 8 bytes (so
+    that the JS code can view each of them directly as a typed array).
+
+    Arguments:
+
+    counts: scipy.sparse.csr_matrix of feature counts (features x samples).
+    counts_loc: location to which the binary file will be written.
+
+    Returns:
+
+    A dict describing the layout of the binary file: its shape, the dtype of
+    its counts, and the dtype/offset/length of each of its arrays.
+    """
+
+    # JS doesn't have a 64-bit integer typed array that is convenient to
+    # index with, so we store the sparse index arrays as uint32s.
+    if counts.nnz >= 2**32 or counts.shape[1] >= 2**32:
+        raise ValueError("Too many nonzero counts to store in binary form.")
+    # Counts are usually integers, in which case float32 can represent them
+    # exactly (up to 2^24) using half the space. If that isn't the case for
+    # these counts, we fall back to float64.
+    data_dtype = np.dtype("<f4")
+    if not np.array_equal(counts.data.astype(data_dtype), counts.data):
+        data_dtype = np.dtype("<f8")
+    arrays = [
+        ("indptr", counts.indptr.astype("<u4")),
+        ("indices", counts.indices.astype("<u4")),
+        ("data", counts.data.astype(data_dtype))
+    ]
+    layout = {}
+    offset = 0
+    with open(counts_loc, "wb") as bf:
+        for name, arr in arrays:
+            padding = -offset % 8
+            bf.write(b"\0" * padding)
+            offset += padding
+            layout[name] = {
+                "dtype": arr.dtype.name,
+                "offset": offset,
+                "length": len(arr)
+            }
+            bf.write(arr.tobytes())
+            offset += arr.nbytes
+    return {
+        "file": os.path.basename(counts_loc),
+        "shape": list(counts.shape),
+        "dtype": data_dtype.name,
+        "arrays": layout
+    }
+
+
+def write_count_chunks(counts, chunks_dir, chunk_size):
+    """Writes a sparse (CSR) count matrix to binary files, each containing
+    the counts of (at most) chunk_size features.
+
+    Each file is written using write_binary_counts(), and contains the rows
+    of the matrix for features [i * chunk_size, (i + 1) * chunk_size) for
+    some i. This way the JS code can load just the counts of the features it
+    needs.
+
+    Any existing files in chunks_dir are removed first.
+
+    Returns:
+
+    A dict describing the chunks: the matrix's shape, chunk_size, and the
+    header returned by write_binary_counts() for each chunk (in order). The
+    "file" of each of these headers includes the name of chunks_dir.
+    """
+
+    if os.path.isdir(chunks_dir):
+        shutil.rmtree(chunks_dir)
+    os.makedirs(chunks_dir)
+    dir_name = os.path.basename(os.path.normpath(chunks_dir))
+    chunks = []
+    for i, start in enumerate(range(0, counts.shape[0], chunk_size)):
+        chunk_name = "{}.bin".format(i)
+        chunk = write_binary_counts(counts[start:start + chunk_size],
+                                    os.path.join(chunks_dir, chunk_name))
+        chunk["file"] = "{}/{}".format(dir_name, chunk_name)
+        chunks.append(chunk)
+    return {
+        "shape": list(counts.shape),
+        "chunk_size": chunk_size,
+        "chunks": chunks
+    }
+
+
+def gen_sample_plot(table, metadata, counts_loc=None, chunk_size=None):
     """Generates altair.Chart object describing the sample scatterplot.
 
     Arguments:
 
-    table: pandas DataFrame describing taxon abundances for each sample.
+    table: biom.Table describing taxon abundances for each sample (as
+           output by process_input()).
     metadata: pandas DataFrame describing metadata for each sample.
+    counts_loc: if this is not None, the feature counts will be written to
+                this location as a binary file (see write_binary_counts())
+                instead of being included in the JSON. The JSON will just
+                include a header describing this file.
+    chunk_size: if this is not None (and counts_loc isn't either), the
+                counts will instead be split up into files of chunk_size
+                features each in the directory counts_loc (see
+                write_count_chunks()). The JSON will just include a
+                manifest describing these files.
 
     Returns:
 
-    JSON describing altair.Chart for the sample plot.
+    JSON describing altair.Chart for the sample plot. (Its large datasets are
+    stored as ColumnarRecords objects and numpy arrays, so this should be
+    written out using rankratioviz._json_writer.dump() rather than
+    json.dump().)
     """
 
     # Used to set x-axis and color
@@ -223,7 +764,8 @@ def gen_sample_plot(table, metadata):
     # Since we don't bother setting a default log ratio, we set the balance for
     # every sample to NaN so that Altair will filter them out (producing an
     # empty scatterplot by default, which makes sense).
-    balance = pd.Series(index=table.index).fillna(float('nan'))
+    balance = pd.Series(float('nan'), index=table.ids(axis="sample"),
+                        dtype=float)
     df_balance = pd.DataFrame({'rankratioviz_balance': balance})
     # At this point, "data" is a DataFrame with its index as sample IDs and
     # one column ("balance", which is solely NaNs).
@@ -242,39 +784,75 @@ def gen_sample_plot(table, metadata):
     sample_metadata.rename_axis("Sample ID", axis="index", inplace=True)
     sample_metadata.reset_index(inplace=True)
 
-    # Make note of the column IDs in the "table" DataFrame.
-    # This constructs a dictionary mapping the feature (column) IDs to their
+    # Make note of the feature (observation) IDs in the table.
+    # This constructs a dictionary mapping the feature IDs to their
     # integer indices (just the range of [0, f), where f is the number of
     # features in the BIOM table).
     # We'll preserve this mapping in the sample plot JSON.
-    sample_features = table.copy()
-    feature_ids = sample_features.columns
+    feature_ids = table.ids(axis="observation")
     feature_cn2si = {}
-    feature_columns_range = range(len(feature_ids))
-    feature_columns_str_range = [str(i) for i in feature_columns_range]
-    for j in feature_columns_range:
-        # (Altair doesn't seem to like accepting ints as column IDs.)
-        feature_cn2si[feature_ids[j]] = feature_columns_str_range[j]
-
-    # Now, we replace column IDs (which could include thousands of taxon
-    # IDs) with just the integer indices from before.
+    for j in range(len(feature_ids)):
+        feature_cn2si[feature_ids[j]] = j
+
+    # Now, we store the feature counts in a sparse, columnar layout: for
+    # each feature (referred to by its integer index from above, rather than
+    # by its ID -- which could be an entire taxonomy), we only store the
+    # integer indices of the samples with a nonzero count of this feature
+    # and the corresponding counts.
     #
-    # This can save *a lot* of space in the JSON file for the sample plot,
-    # since each column name is referenced once for each sample (and
-    # 50 samples * (~3000 taxonomies) * (~50 characters per ID)
-    # comes out to 7.5 MB, which is an underestimate).
-    sample_features.columns = feature_columns_str_range
+    # This is exactly the CSR representation of the (features x samples)
+    # matrix the BIOM table already stores: feature j's sample indices are
+    # indices[indptr[j]:indptr[j + 1]], and its counts are the same slice of
+    # data. Sample indices refer to positions in the sample_ids array, so
+    # each sample ID is only written out once (and zeros aren't written out
+    # at all).
+    counts = table.matrix_data.tocsr(copy=True)
+    counts.sum_duplicates()
+    counts.eliminate_zeros()
+    counts.sort_indices()
+    if counts_loc is None:
+        # (These arrays are written out directly when the JSON is written.)
+        sample_features = {
+            "indptr": counts.indptr,
+            "indices": counts.indices,
+            "data": counts.data
+        }
+    elif chunk_size is None:
+        # Parsing a huge JSON array of numbers is slow in the browser, so we
+        # can instead store these arrays in a binary file. The JS code will
+        # load this file and view its contents as typed arrays.
+        sample_features = write_binary_counts(counts, counts_loc)
+    else:
+        # Most of the time, only the counts of a small fraction of features
+        # are ever used. Splitting the counts up lets the JS code load them
+        # as they're needed, rather than all of them up front.
+        sample_features = write_count_chunks(counts, counts_loc, chunk_size)
+    sample_features["sample_ids"] = table.ids(axis="sample").tolist()
 
     # Create sample plot in Altair.
     # If desired, we can make this interactive by adding .interactive() to the
     # alt.Chart declaration (but we don't do that currently since it makes
     # changing the scale of the chart smoother IIRC)
+    #
+    # As with the rank plot, we only give Altair the name of the dataset to
+    # use (and attach the data to the spec afterwards). Since this means
+    # Altair can't infer the type of the default metadata column, we infer
+    # it ourselves (just from that one column).
+    import altair as alt
+    sample_data_name = "rankratioviz_sample_data"
+    default_metadata_col_type = alt.utils.infer_vegalite_type(
+        sample_metadata[default_metadata_col]
+    )
+    if isinstance(default_metadata_col_type, tuple):
+        # Ordered categorical columns are inferred as ("ordinal", order)
+        default_metadata_col_type = default_metadata_col_type[0]
     sample_chart = alt.Chart(
-        sample_metadata,
+        alt.NamedData(name=sample_data_name),
         title="Log Ratio of Abundances in Samples"
     ).mark_circle().encode(
-        alt.X(default_metadata_col),
-        alt.Y("rankratioviz_balance", title="log(Numerator / Denominator)"),
+        alt.X(default_metadata_col, type=default_metadata_col_type),
+        alt.Y("rankratioviz_balance", title="log(Numerator / Denominator)",
+              type="quantitative"),
         color=alt.Color(
             default_metadata_col,
             # This is a temporary measure. Eventually the type should be
@@ -285,7 +863,7 @@ def gen_sample_plot(table, metadata):
             # of metadata can be passed.
             type="nominal"
         ),
-        tooltip=["Sample ID"]
+        tooltip=["Sample ID:N"]
     )
 
     # Save the sample plot JSON. Some notes:
@@ -300,67 +878,247 @@ def gen_sample_plot(table, metadata):
     #  having to worry about accidentally mixing up metadata and feature
     #  counts.
     # -Since feature IDs can be really long (e.g. in the case where the feature
-    #  ID is an entire taxonomy), we convert each feature ID to a string
-    #  integer and refer to that feature by its string integer ID. We store a
-    #  mapping relating actual feature IDs to their string integer IDs under
-    #  the col_ids_ds dataset, which is how we'll determine what to show to
-    #  the user (and link features on the rank plot with feature counts in
-    #  the sample plot) in the JS code.
+    #  ID is an entire taxonomy), we convert each feature ID to an integer
+    #  and refer to that feature by its integer ID. We store a mapping
+    #  relating actual feature IDs to their integer IDs under the col_ids_ds
+    #  dataset, which is how we'll determine what to show to the user (and
+    #  link features on the rank plot with feature counts in the sample plot)
+    #  in the JS code.
+    # -The feature counts are stored sparsely (see above), so sample_ids,
+    #  indptr, indices, and data are all stored under the features_ds
+    #  dataset. (If counts_loc was specified, then the features_ds dataset
+    #  just contains sample_ids and the header of the binary counts file.)
+    # -An index for searching through the features' taxonomic ranks (see
+    #  gen_search_index()) is stored under the search_index_ds dataset, so
+    #  that the JS code doesn't have to go through every feature ID when
+    #  searching.
     sample_chart_json = sample_chart.to_dict()
+    sample_chart_json["datasets"] = {
+        sample_data_name: ColumnarRecords(sample_metadata)
+    }
     col_ids_ds = "rankratioviz_feature_col_ids"
     features_ds = "rankratioviz_feature_counts"
     sample_chart_json["datasets"][col_ids_ds] = feature_cn2si
-    sample_chart_json["datasets"][features_ds] = sample_features.to_dict()
+    sample_chart_json["datasets"][features_ds] = sample_features
+    search_index_ds = "rankratioviz_feature_search_index"
+    sample_chart_json["datasets"][search_index_ds] = gen_search_index(
+        feature_ids
+    )
     return sample_chart_json
 
 
-def gen_visualization(V, processed_table, df_sample_metadata, output_dir):
+def gen_visualization(V, processed_table, df_sample_metadata, output_dir,
+                      binary_counts=False, max_rank_plot_bars=None,
+                      asset_dir=None, single_file=False,
+                      precompress_data=False, count_chunk_size=None,
+                      inputs_key=None):
     """Creates a rankratioviz visualization. This function should be callable
        from both the QIIME 2 and standalone rankratioviz scripts.
 
+       If binary_counts is True, the feature counts will be written to a
+       separate binary file (counts.bin) rather than to sample_plot.json.
+       If count_chunk_size is not None, the feature counts will instead be
+       split up into binary files of count_chunk_size features each, in the
+       counts/ subdirectory of output_dir (see write_count_chunks()), which
+       are only loaded as they're needed; this implies binary_counts.
+
+       max_rank_plot_bars is passed to gen_rank_plot() as max_bars.
+
+       By default, all of the support files (rankratioviz.js, the vendored
+       Vega libraries, etc.) are copied into output_dir. If asset_dir is not
+       None, these are instead stored once in asset_dir (under
+       content-addressed names) and linked into output_dir; see
+       rankratioviz._assets.link_shared_assets(). Either way, generating a
+       visualization in an existing output directory just updates it.
+
+       If single_file is True, the only file written to output_dir is a
+       self-contained index.html, with the support files and the
+       visualization's data (compressed) embedded in it; see
+       rankratioviz._assets.write_single_file(). asset_dir is ignored in
+       this case. Any files from a previous (non-single-file) visualization
+       in output_dir are removed.
+
+       If precompress_data is True, gzipped (and, if the brotli package is
+       installed, brotli-compressed) versions of the visualization's data
+       files are also written, e.g. rank_plot.json.gz; see
+       rankratioviz._compression.precompress(). index.html then tells
+       rankratioviz.js to request the gzipped versions first; web servers
+       that support precompressed files (e.g. rankratioviz-serve) can also
+       send them in place of the originals.
+
+       inputs_key, if given, should be a string identifying all of the
+       inputs to (and options for) generating this visualization, e.g. as
+       returned by rankratioviz._cache.inputs_key(). If output_dir already
+       contains a visualization generated from the same inputs (see
+       visualization_is_current()), nothing is regenerated.
+
        Returns:
 
        index_path: a path to the index.html file for the output visualization.
                    This is needed when calling q2templates.render().
     """
-    rank_plot_json = gen_rank_plot(V)
-    sample_plot_json = gen_sample_plot(processed_table, df_sample_metadata)
     os.makedirs(output_dir, exist_ok=True)
-    # copy files for the visualization
-    loc_ = os.path.dirname(os.path.realpath(__file__))
-    # NOTE: We can just join loc_ with support_files/, since support_files/ is
-    # located within the same directory as generate.py. Previously (when this
-    # code was contained in q2/_method.py and scripts/_plot.py), I joined loc_
-    # with .. and then with support_files since we had to first navigate up to
-    # the directory containing generate.py and support_files/. Now, we don't
-    # have to do that any more.
-    support_files_loc = os.path.join(loc_, 'support_files')
-    index_path = None
-    for file_ in os.listdir(support_files_loc):
-        if file_ != '.DS_Store':
-            copy_func = copyfile
-            # If we hit a directory in support_files/, just copy the entire
-            # directory to our destination using shutil.copytree()
-            if os.path.isdir(os.path.join(support_files_loc, file_)):
-                copy_func = copytree
-            copy_func(
-                os.path.join(support_files_loc, file_),
-                os.path.join(output_dir, file_)
-            )
-        if 'index.html' in file_:
-            index_path = os.path.join(output_dir, file_)
-
-    if index_path is None:
+    if not os.path.isfile(os.path.join(SUPPORT_FILES_DIR, INDEX_FILE)):
         # This should never happen -- assuming rankratioviz has been installed
         # fully, i.e. with a complete set of support_files/ -- but we handle it
         # here just in case.
         raise FileNotFoundError("Couldn't find index.html in support_files/")
+    if inputs_key is not None and visualization_is_current(output_dir,
+                                                           inputs_key):
+        return os.path.join(output_dir, INDEX_FILE)
+    # If we fail partway through, the output directory shouldn't look like
+    # it's up to date
+    inputs_loc = os.path.join(output_dir, INPUTS_FILE)
+    if os.path.exists(inputs_loc):
+        os.remove(inputs_loc)
+    if single_file:
+        index_path = _gen_single_file_visualization(
+            V, processed_table, df_sample_metadata, output_dir,
+            binary_counts, max_rank_plot_bars, count_chunk_size
+        )
+        _remove_multi_file_outputs(output_dir)
+        _write_inputs_file(output_dir, inputs_key, [INDEX_FILE])
+        return index_path
+    counts_loc = _counts_loc(output_dir, binary_counts, count_chunk_size)
+    with _profiling.stage("gen_rank_plot"):
+        rank_plot_json = gen_rank_plot(V, max_bars=max_rank_plot_bars)
+    with _profiling.stage("gen_sample_plot"):
+        sample_plot_json = gen_sample_plot(processed_table,
+                                           df_sample_metadata, counts_loc,
+                                           count_chunk_size)
+    # put the support files for the visualization in place
+    with _profiling.stage("write_support_files"):
+        if asset_dir is None:
+            index_path = copy_support_files(output_dir, precompress_data)
+        else:
+            index_path = link_shared_assets(output_dir, asset_dir,
+                                            precompress_data)
     # write new files
     rank_plot_loc = os.path.join(output_dir, 'rank_plot.json')
     sample_plot_loc = os.path.join(output_dir, 'sample_plot.json')
     # For reference: https://stackoverflow.com/a/12309296
-    with open(rank_plot_loc, "w") as jf:
-        json.dump(rank_plot_json, jf)
-    with open(sample_plot_loc, "w") as jf2:
-        json.dump(sample_plot_json, jf2)
+    # (We use our own dump() function, which streams the large datasets in
+    # the JSON out in chunks.)
+    with _profiling.stage("write_json"):
+        with open(rank_plot_loc, "w") as jf:
+            dump(rank_plot_json, jf)
+        with open(sample_plot_loc, "w") as jf2:
+            dump(sample_plot_json, jf2)
+    data_locs = [rank_plot_loc, sample_plot_loc]
+    for counts_file in _counts_files(sample_plot_json):
+        data_locs.append(os.path.join(output_dir, *counts_file.split("/")))
+    with _profiling.stage("precompress"):
+        if precompress_data:
+            precompress(data_locs)
+        else:
+            remove_precompressed(data_locs)
+    _profiling.note(output_bytes={
+        os.path.relpath(loc, output_dir): os.path.getsize(loc)
+        for loc in data_locs
+    })
+    _write_inputs_file(
+        output_dir, inputs_key,
+        [INDEX_FILE] + [os.path.relpath(loc, output_dir) for loc in data_locs]
+    )
+    return index_path
+
+
+def visualization_is_current(output_dir, inputs_key):
+    """Returns True if output_dir contains a visualization generated (by
+       gen_visualization()) from the inputs identified by inputs_key, whose
+       files are all still present.
+    """
+    try:
+        with open(os.path.join(output_dir, INPUTS_FILE), "r") as f:
+            inputs = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return inputs.get("inputs_key") == inputs_key and all(
+        os.path.isfile(os.path.join(output_dir, rel_path))
+        for rel_path in inputs.get("files", [])
+    )
+
+
+def _write_inputs_file(output_dir, inputs_key, files):
+    """Records the inputs a visualization was generated from, and the
+       files (relative to output_dir) generated.
+    """
+    if inputs_key is None:
+        return
+    with open(os.path.join(output_dir, INPUTS_FILE), "w") as f:
+        json.dump({"inputs_key": inputs_key, "files": files}, f)
+
+
+def _counts_loc(output_dir, binary_counts, count_chunk_size):
+    """Returns the counts_loc to pass to gen_sample_plot()."""
+    if count_chunk_size is not None:
+        return os.path.join(output_dir, 'counts')
+    if binary_counts:
+        return os.path.join(output_dir, 'counts.bin')
+    return None
+
+
+def _remove_multi_file_outputs(output_dir):
+    """Removes the files that gen_visualization() writes next to index.html
+       when single_file is False (the plot JSON, counts files, support
+       files, and any precompressed versions of these) from output_dir.
+    """
+    data_locs = [os.path.join(output_dir, name) for name in
+                 ("rank_plot.json", "sample_plot.json", "counts.bin")]
+    remove_precompressed(data_locs)
+    for loc in data_locs:
+        if os.path.isfile(loc):
+            os.remove(loc)
+    shutil.rmtree(os.path.join(output_dir, "counts"), ignore_errors=True)
+    remove_support_files(output_dir)
+
+
+def _counts_files(sample_plot_json):
+    """Returns the names (relative to the output directory) of the binary
+       counts files referred to by a sample plot's JSON.
+    """
+    counts = sample_plot_json["datasets"]["rankratioviz_feature_counts"]
+    if "chunks" in counts:
+        return [chunk["file"] for chunk in counts["chunks"]]
+    if "file" in counts:
+        return [counts["file"]]
+    return []
+
+
+def _gen_single_file_visualization(V, processed_table, df_sample_metadata,
+                                   output_dir, binary_counts,
+                                   max_rank_plot_bars, count_chunk_size):
+    """Does the work of gen_visualization() when single_file is True.
+
+    The files that would normally be written next to index.html are written
+    to memory (or, for binary counts files, to a temporary directory)
+    instead, and then embedded in index.html.
+    """
+    embedded_files = {}
+    with tempfile.TemporaryDirectory(prefix="rankratioviz-") as tmp_dir:
+        counts_loc = _counts_loc(tmp_dir, binary_counts, count_chunk_size)
+        with _profiling.stage("gen_rank_plot"):
+            rank_plot_json = gen_rank_plot(V, max_bars=max_rank_plot_bars)
+        with _profiling.stage("gen_sample_plot"):
+            sample_plot_json = gen_sample_plot(processed_table,
+                                               df_sample_metadata, counts_loc,
+                                               count_chunk_size)
+        with _profiling.stage("write_json"):
+            for name, plot_json in (("rank_plot.json", rank_plot_json),
+                                    ("sample_plot.json", sample_plot_json)):
+                buf = io.StringIO()
+                dump(plot_json, buf)
+                embedded_files[name] = buf.getvalue().encode("utf-8")
+        for counts_file in _counts_files(sample_plot_json):
+            with open(os.path.join(tmp_dir, *counts_file.split("/")),
+                      "rb") as bf:
+                embedded_files[counts_file] = bf.read()
+    with _profiling.stage("write_single_file"):
+        index_path = write_single_file(os.path.join(output_dir, INDEX_FILE),
+                                       embedded_files)
+    _profiling.note(
+        output_bytes={INDEX_FILE: os.path.getsize(index_path)},
+        embedded_bytes={name: len(data)
+                        for name, data in embedded_files.items()}
+    )
     return index_path
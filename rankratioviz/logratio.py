@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+#
+# Computes log ratios ("balances") of feature abundances in samples, the same
+# way that the visualization does (see ssmv.balanceWorkerMain() in
+# support_files/rankratioviz.js). This is vectorized, so lots of log ratios
+# can be computed at once (e.g. for analyses of many selections of features).
+# ----------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+def feature_selection_matrix(feature_sets, feature_ids):
+    """Returns a matrix describing which features are in each of a list of
+       sets of features.
+
+       Arguments:
+
+       feature_sets: a list of collections of feature IDs.
+       feature_ids: the IDs of all of the features (e.g. of a BIOM table's
+                    observations).
+
+       Returns:
+
+       A scipy.sparse.csr_matrix with shape (len(feature_sets),
+       len(feature_ids)), where entry (i, j) is 1 if the feature with ID
+       feature_ids[j] is in feature_sets[i] and 0 otherwise. (Repeated IDs
+       in a set are only counted once.)
+
+       Raises:
+
+       ValueError: if a set contains an ID that isn't in feature_ids.
+    """
+    feature_index = pd.Index(feature_ids)
+    indptr = [0]
+    indices = []
+    for feature_set in feature_sets:
+        set_ids = pd.Index(list(feature_set), dtype=object).unique()
+        positions = feature_index.get_indexer(set_ids)
+        if (positions < 0).any():
+            missing = set_ids[positions < 0]
+            raise ValueError(
+                "{} feature(s) in a log ratio aren't present in the table, "
+                "including {}".format(len(missing), missing[0])
+            )
+        indices.append(np.sort(positions))
+        indptr.append(indptr[-1] + len(positions))
+    if len(indices) > 0:
+        indices = np.concatenate(indices)
+    else:
+        indices = np.zeros(0, dtype=np.int64)
+    return csr_matrix((np.ones(len(indices)), indices, indptr),
+                      shape=(len(indptr) - 1, len(feature_index)))
+
+
+def log_ratios_of_counts(counts, numerator_matrix, denominator_matrix,
+                         zero_fill=0):
+    """Computes log ratios of feature abundances, given a matrix of counts.
+
+       Arguments:
+
+       counts: scipy.sparse matrix of feature counts (features x samples).
+       numerator_matrix: scipy.sparse matrix (log ratios x features), as
+                         returned by feature_selection_matrix(), describing
+                         the numerator features of each log ratio.
+       denominator_matrix: same, for the denominator features.
+       zero_fill: if this isn't 0, then each zero count of a feature in a
+                  numerator or denominator is replaced by zero_fill.
+
+       Returns:
+
+       A numpy array (log ratios x samples) of the log ratios. As in the
+       visualization, a log ratio is the natural log of the summed counts of
+       its numerator features minus that of its denominator features; and
+       it's NaN in samples where either of these sums is <= 0 (including when
+       the numerator or denominator is empty).
+    """
+    counts = csr_matrix(counts, dtype=np.float64)
+    # Like the JS code, treat every nonzero count as "present" (this ignores
+    # explicitly stored zeros)
+    present = csr_matrix(counts != 0, dtype=np.float64)
+
+    def abundances(selection):
+        # The sums over each selection are just a matrix product; so are the
+        # numbers of features present in each sample.
+        sums = (selection @ counts).toarray()
+        if zero_fill != 0:
+            num_present = (selection @ present).toarray()
+            num_features = np.asarray(selection.sum(axis=1))
+            sums += zero_fill * (num_features - num_present)
+        return sums
+
+    top = abundances(csr_matrix(numerator_matrix))
+    bot = abundances(csr_matrix(denominator_matrix))
+    valid = (top > 0) & (bot > 0)
+    ratios = np.full(top.shape, np.nan)
+    ratios[valid] = np.log(top[valid]) - np.log(bot[valid])
+    return ratios
+
+
+def log_ratios(table, numerators, denominators, zero_fill=0):
+    """Computes many log ratios of feature abundances in a BIOM table's
+       samples at once.
+
+       Arguments:
+
+       table: biom.Table of feature counts.
+       numerators: a list of collections of feature IDs: the numerator of
+                   each log ratio.
+       denominators: a list of collections of feature IDs (of the same
+                     length as numerators): the denominator of each log
+                     ratio.
+       zero_fill: see log_ratios_of_counts().
+
+       Returns:
+
+       A pandas DataFrame with one row per log ratio (in the order given) and
+       one column per sample (labelled by sample ID).
+    """
+    if len(numerators) != len(denominators):
+        raise ValueError("There must be as many numerators as denominators.")
+    feature_ids = table.ids(axis="observation")
+    ratios = log_ratios_of_counts(
+        table.matrix_data,
+        feature_selection_matrix(numerators, feature_ids),
+        feature_selection_matrix(denominators, feature_ids),
+        zero_fill=zero_fill
+    )
+    return pd.DataFrame(ratios, columns=table.ids(axis="sample"))
+
+
+def log_ratio(table, numerator, denominator, zero_fill=0):
+    """Computes a single log ratio of feature abundances in a BIOM table's
+       samples.
+
+       numerator and denominator are collections of feature IDs; see
+       log_ratios() for details.
+
+       Returns:
+
+       A pandas Series of the log ratio in each sample, indexed by sample ID.
+    """
+    return log_ratios(table, [numerator], [denominator],
+                      zero_fill=zero_fill).iloc[0].rename(None)
@@ -7,19 +7,25 @@
 # ----------------------------------------------------------------------------
 import q2templates
 from rankratioviz.generate import process_input, gen_visualization
+from rankratioviz import _profiling
 
 
 def create_q2_visualization(output_dir, feature_ranks, table, sample_metadata,
-                            feature_metadata):
+                            feature_metadata, profile=False):
 
-    df_feature_metadata = feature_metadata.to_dataframe()
-    df_sample_metadata = sample_metadata.to_dataframe()
-    V, processed_table = process_input(feature_ranks, df_sample_metadata,
-                                       table, df_feature_metadata)
-    # We can't "subscript" Q2 Metadata types, so we have to convert this to a
-    # dataframe before working with it
-    index_path = gen_visualization(V, processed_table, df_sample_metadata,
-                                   output_dir)
+    with _profiling.profiling(output_dir, enabled=profile):
+        # We can't "subscript" Q2 Metadata types, so we have to convert this
+        # to a dataframe before working with it
+        with _profiling.stage("read_metadata"):
+            df_feature_metadata = feature_metadata.to_dataframe()
+            df_sample_metadata = sample_metadata.to_dataframe()
+        with _profiling.stage("process_input"):
+            V, processed_table = process_input(feature_ranks,
+                                               df_sample_metadata, table,
+                                               df_feature_metadata)
+        with _profiling.stage("gen_visualization"):
+            index_path = gen_visualization(V, processed_table,
+                                           df_sample_metadata, output_dir)
     # render the visualization using q2templates.render().
     # TODO: do we need to specify plot_name in the context in this way? I'm not
     # sure where it is being used in the first place, honestly.
@@ -14,7 +14,8 @@ from ._actually_do_stuff import create_q2_visualization
 
 def supervised_rank_plot(output_dir: str, ranks: pd.DataFrame,
                          table: biom.Table, sample_metadata: qiime2.Metadata,
-                         feature_metadata: qiime2.Metadata) -> None:
+                         feature_metadata: qiime2.Metadata,
+                         profile: bool = False) -> None:
     """Generates a .qzv file of a RRV visualization from songbird data.
 
        (...Also, the reason the order of parameters here differs from
@@ -27,13 +28,14 @@ def supervised_rank_plot(output_dir: str, ranks: pd.DataFrame,
     # script, but I don't think Q2 is using it.
     feature_ranks = ranks.set_index(ranks.columns[0])
     create_q2_visualization(output_dir, feature_ranks, table, sample_metadata,
-                            feature_metadata)
+                            feature_metadata, profile=profile)
 
 
 def unsupervised_rank_plot(output_dir: str, ranks: skbio.OrdinationResults,
                            table: biom.Table, sample_metadata: qiime2.Metadata,
-                           feature_metadata: qiime2.Metadata) -> None:
+                           feature_metadata: qiime2.Metadata,
+                           profile: bool = False) -> None:
     """Generates a .qzv file of a RRV visualization from DEICODE data."""
 
     create_q2_visualization(output_dir, ranks.features, table, sample_metadata,
-                            feature_metadata)
+                            feature_metadata, profile=profile)
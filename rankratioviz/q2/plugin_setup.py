@@ -11,7 +11,7 @@ import qiime2.plugin
 import qiime2.sdk
 from rankratioviz import __version__
 from ._method import supervised_rank_plot, unsupervised_rank_plot
-from qiime2.plugin import (Metadata, Properties)
+from qiime2.plugin import (Metadata, Properties, Bool)
 from q2_types.feature_table import (FeatureTable, Frequency)
 from q2_types.feature_data import FeatureData
 from q2_types.ordination import PCoAResults
@@ -38,7 +38,13 @@ plugin = qiime2.plugin.Plugin(
 )
 
 # Shared stuff between the two plot options
-params = {'sample_metadata': Metadata, 'feature_metadata': Metadata}
+params = {'sample_metadata': Metadata, 'feature_metadata': Metadata,
+          'profile': Bool}
+param_descs = {
+    'profile': ("Record how long each stage of generating the visualization"
+                + " takes (and how much memory it uses), and include this"
+                + " in the visualization as rankratioviz_profile.json.")
+}
 
 ranks_desc = "A {} file describing ranks produced by {}"
 table_desc = ("A BIOM table describing the abundances of the ranked features"
@@ -55,6 +61,7 @@ if songbird_accessible:
         inputs={'ranks': FeatureData[Differential],
                 'table': FeatureTable[Frequency]},
         parameters=params,
+        parameter_descriptions=param_descs,
         input_descriptions={
             'ranks': ranks_desc.format("differentials", "songbird"),
             'table': table_desc
@@ -68,6 +75,7 @@ plugin.visualizers.register_function(
     inputs={'ranks': PCoAResults % Properties("biplot"),
             'table': FeatureTable[Frequency]},
     parameters=params,
+    parameter_descriptions=param_descs,
     input_descriptions={
         'ranks': ranks_desc.format("ordination", "DEICODE"),
         'table': table_desc
@@ -0,0 +1,318 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import click
+from rankratioviz.scripts._plot import feature_budget_options
+
+# (Like rankratioviz/scripts/_plot.py, the heavier dependencies used here --
+# numpy, pandas, biom, etc. -- are imported in the functions that use them, so
+# that "rankratioviz-batch --help" starts up quickly.)
+
+# The names of the arrays making up a CSR matrix.
+_CSR_ARRAYS = ("data", "indices", "indptr")
+
+# State shared by all of the jobs run in a worker process. This is set up
+# once per process by _init_worker().
+_shared = {}
+
+
+def read_manifest(manifest_loc, output_dir):
+    """Reads a batch manifest file.
+
+    Each (non-blank, non-#-prefixed) line of the manifest should contain the
+    path to a ranks file, optionally followed by a tab and the path to the
+    output directory to use for it. If no output directory is given, the
+    output directory is a subdirectory of output_dir named after the ranks
+    file.
+
+    Returns a list of (ranks file, output directory) tuples.
+    """
+
+    jobs = []
+    with open(manifest_loc, "r") as mf:
+        for line in mf:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) > 1:
+                jobs.append((fields[0], fields[1]))
+            else:
+                jobs.append((fields[0], default_output_dir(fields[0],
+                                                           output_dir)))
+    return jobs
+
+
+def default_output_dir(ranks_loc, output_dir):
+    """Returns output_dir/<name of the ranks file, minus its extension>."""
+
+    if output_dir is None:
+        raise click.UsageError(
+            "--output-dir is required unless every job's output directory "
+            "is given in the manifest."
+        )
+    name = os.path.splitext(os.path.basename(ranks_loc))[0]
+    return os.path.join(output_dir, name)
+
+
+def share_table(table, shared_dir):
+    """Writes the matrix of a biom.Table to .npy files in shared_dir.
+
+    Worker processes then memory-map these files (see _init_worker()), so
+    the table's counts are shared between all of the workers instead of
+    being copied into each of them.
+
+    Returns a dict of the arguments needed to reconstruct the table.
+    """
+
+    import numpy as np
+    matrix = table.matrix_data.tocsr()
+    for name in _CSR_ARRAYS:
+        np.save(os.path.join(shared_dir, name + ".npy"), getattr(matrix, name))
+    return {
+        "shared_dir": shared_dir,
+        "shape": matrix.shape,
+        "observation_ids": table.ids(axis="observation"),
+        "sample_ids": table.ids(axis="sample")
+    }
+
+
+def _init_worker(shared_table, sample_metadata, feature_metadata):
+    """Sets up the state shared by the jobs run in a worker process."""
+
+    import numpy as np
+    import pandas as pd
+    from scipy.sparse import csr_matrix
+    arrays = [
+        np.load(os.path.join(shared_table["shared_dir"], name + ".npy"),
+                mmap_mode="r")
+        for name in _CSR_ARRAYS
+    ]
+    _shared["matrix"] = csr_matrix(tuple(arrays),
+                                   shape=shared_table["shape"], copy=False)
+    _shared["observation_index"] = pd.Index(shared_table["observation_ids"])
+    _shared["sample_ids"] = shared_table["sample_ids"]
+    _shared["sample_metadata"] = sample_metadata
+    _shared["feature_metadata"] = feature_metadata
+
+
+def _subset_shared_table(feature_ids):
+    """Returns a biom.Table of just the given features in the shared table.
+
+    Only the rows of these features are read from the memory-mapped matrix.
+    (The features keep their order from the original table, so the output is
+    the same as if the entire table was used. Features that aren't in the
+    table are left out, and reported as such by process_input().)
+    """
+
+    import numpy as np
+    from biom import Table
+    positions = _shared["observation_index"].get_indexer(feature_ids)
+    positions = np.sort(positions[positions >= 0])
+    return Table(_shared["matrix"][positions],
+                 _shared["observation_index"][positions],
+                 _shared["sample_ids"], validate=False)
+
+
+def _run_job(ranks_loc, output_dir, cache_dir, feature_budget, gen_kwargs):
+    """Generates a single visualization in a worker process.
+
+    Returns a dict of how long each step of generating the visualization
+    took, in seconds.
+    """
+
+    from rankratioviz.generate import process_input, gen_visualization
+    from rankratioviz._rank_processing import rank_file_to_df
+    timings = {}
+    start = time.perf_counter()
+    feature_ranks = rank_file_to_df(ranks_loc, cache_dir=cache_dir)
+    timings["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    table = _subset_shared_table(feature_ranks.index)
+    V, processed_table = process_input(feature_ranks,
+                                       _shared["sample_metadata"], table,
+                                       _shared["feature_metadata"],
+                                       feature_budget=feature_budget)
+    timings["match"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gen_visualization(V, processed_table, _shared["sample_metadata"],
+                      output_dir, **gen_kwargs)
+    timings["write"] = time.perf_counter() - start
+    return timings
+
+
+@click.command()
+@click.option('-r', '--ranks', multiple=True,
+              help="Differentials output from songbird or Ordination output"
+                   + " from DEICODE. Can be given multiple times.")
+@click.option('-m', '--manifest', default=None,
+              help="File listing ranks files to plot, one per line"
+                   + " (optionally followed by a tab and the output"
+                   + " directory to use for that file).")
+@click.option('-t', '--table', required=True,
+              help="BIOM table describing taxon/metabolite sample abundances.")
+@click.option('-fm', '--feature-metadata', default=None,
+              help="Feature metadata file.")
+@click.option('-sm', '--sample-metadata', required=True,
+              help="Sample metadata file.")
+@click.option('-o', '--output-dir', default=None,
+              help="Directory in which to create an output directory for each"
+                   + " ranks file (named after the ranks file).")
+@click.option('-j', '--jobs', default=None, type=click.IntRange(min=1),
+              help="Number of visualizations to generate in parallel."
+                   + " Defaults to the number of CPUs.")
+@click.option('--binary-counts', is_flag=True, default=False,
+              help="Write feature counts to a separate binary file instead"
+                   + " of to the sample plot JSON.")
+@click.option('--cache-dir', default=None,
+              help="Directory in which to cache parsed ranks files.")
+@click.option('--max-rank-plot-bars', default=None, type=click.IntRange(min=2),
+              help="If there are more than this many features, only draw"
+                   + " (about) this many bars in the rank plot at once.")
+@click.option('--asset-dir', default=None,
+              help="Directory in which to store shared copies of the"
+                   + " visualization's JavaScript/CSS files. Output"
+                   + " directories then link to these instead of each"
+                   + " getting their own copies.")
+@click.option('--single-file', is_flag=True, default=False,
+              help="Write the visualization as a single, self-contained HTML"
+                   + " file (with its data compressed and embedded in it)"
+                   + " that can be opened without a web server.")
+@click.option('--precompress', is_flag=True, default=False,
+              help="Also write gzipped (and, if the brotli package is"
+                   + " installed, brotli-compressed) versions of the"
+                   + " visualization's data files, for web servers to send.")
+@click.option('--count-chunk-size', default=None, type=click.IntRange(min=1),
+              help="Split the feature counts into binary files of this many"
+                   + " features each, which are only loaded as they're"
+                   + " needed. Implies --binary-counts.")
+@click.option('--feature-budget', default=None, type=click.IntRange(min=1),
+              help="Only include the N highest- and N lowest-ranked features"
+                   + " for each rank column (plus any --keep-features). The"
+                   + " other features are collapsed into a single \"Other\""
+                   + " feature.")
+@click.option('--keep-features', default=None,
+              help="File of feature IDs (one per line) to include regardless"
+                   + " of --feature-budget, --min-prevalence, and"
+                   + " --min-abundance.")
+@click.option('--min-prevalence', default=None,
+              type=click.FloatRange(min=0, max=1),
+              help="Collapse features present in less than this fraction of"
+                   + " samples into the \"Other\" feature.")
+@click.option('--min-abundance', default=None, type=click.FloatRange(min=0),
+              help="Collapse features whose total count (across all"
+                   + " samples) is less than this into the \"Other\""
+                   + " feature.")
+def batch(ranks: tuple, manifest: str, table: str, sample_metadata: str,
+          feature_metadata: str, output_dir: str, jobs: int,
+          binary_counts: bool, cache_dir: str,
+          max_rank_plot_bars: int, asset_dir: str,
+          single_file: bool, precompress: bool,
+          count_chunk_size: int, feature_budget: int, keep_features: str,
+          min_prevalence: float, min_abundance: float) -> None:
+    """Generates plots for many ranks files that share a table.
+
+    The BIOM table and metadata are only loaded (and matched up) once. Each
+    visualization is then generated in parallel, by a pool of processes that
+    share the table's counts through memory-mapped files.
+    """
+
+    job_list = [(r, default_output_dir(r, output_dir)) for r in ranks]
+    if manifest is not None:
+        job_list += read_manifest(manifest, output_dir)
+    if len(job_list) == 0:
+        raise click.UsageError("Specify at least one ranks file (using"
+                               " --ranks or --manifest).")
+    out_dirs = [os.path.abspath(j[1]) for j in job_list]
+    if len(set(out_dirs)) < len(out_dirs):
+        raise click.UsageError("Multiple ranks files would be written to the"
+                               " same output directory.")
+    budget = feature_budget_options(feature_budget, keep_features,
+                                    min_prevalence, min_abundance)
+
+    from biom import load_table
+    import pandas as pd
+    from rankratioviz.generate import matchdf
+
+    def read_metadata(md_file_loc):
+        return pd.read_csv(md_file_loc, index_col=0, sep='\t')
+
+    start = time.perf_counter()
+    loaded_biom = load_table(table)
+    df_sample_metadata = read_metadata(sample_metadata)
+    df_feature_metadata = None
+    if feature_metadata is not None:
+        df_feature_metadata = read_metadata(feature_metadata)
+    # Match the table's samples to the sample metadata now, rather than in
+    # every job.
+    matched_biom, _, _, dropped_samples = matchdf(
+        loaded_biom, df_sample_metadata, axis="sample", return_dropped=True
+    )
+    if len(dropped_samples) > 0:
+        raise click.ClickException(
+            "{} sample(s) in the sample metadata are not present in the BIOM "
+            "table, including {}".format(len(dropped_samples),
+                                         dropped_samples[0])
+        )
+    click.echo("Loaded the table and metadata in {:.2f} s.".format(
+        time.perf_counter() - start
+    ))
+
+    gen_kwargs = {"binary_counts": binary_counts,
+                  "max_rank_plot_bars": max_rank_plot_bars,
+                  "asset_dir": asset_dir,
+                  "single_file": single_file,
+                  "precompress_data": precompress,
+                  "count_chunk_size": count_chunk_size}
+    failures = []
+    shared_dir = tempfile.mkdtemp(prefix="rankratioviz-batch-")
+    try:
+        shared_table = share_table(matched_biom, shared_dir)
+        del loaded_biom, matched_biom
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=_init_worker,
+            initargs=(shared_table, df_sample_metadata, df_feature_metadata)
+        ) as executor:
+            futures = {
+                executor.submit(_run_job, ranks_loc, job_out_dir, cache_dir,
+                                budget, gen_kwargs): ranks_loc
+                for ranks_loc, job_out_dir in job_list
+            }
+            for future in as_completed(futures):
+                ranks_loc = futures[future]
+                try:
+                    timings = future.result()
+                except Exception as e:
+                    failures.append(ranks_loc)
+                    click.echo("{}: failed ({!r})".format(ranks_loc, e),
+                               err=True)
+                    continue
+                click.echo(
+                    "{}: load {:.2f} s, match {:.2f} s, write {:.2f} s, "
+                    "total {:.2f} s".format(ranks_loc, timings["load"],
+                                            timings["match"],
+                                            timings["write"],
+                                            sum(timings.values()))
+                )
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    if len(failures) > 0:
+        raise click.ClickException("{} of {} job(s) failed.".format(
+            len(failures), len(job_list)
+        ))
+
+
+if __name__ == '__main__':
+    batch()
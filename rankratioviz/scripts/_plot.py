@@ -5,11 +5,32 @@
 #
 # The full license is in the file LICENSE.txt, distributed with this software.
 # ----------------------------------------------------------------------------
-from biom import load_table
-import pandas as pd
+import os
 import click
-from rankratioviz.generate import process_input, gen_visualization
-from rankratioviz._rank_processing import rank_file_to_df
+from rankratioviz import _profiling
+
+
+def feature_budget_options(feature_budget, keep_features, min_prevalence,
+                           min_abundance):
+    """Returns the feature_budget argument to pass to process_input(), given
+    the values of the feature budget options.
+    """
+
+    if feature_budget is None and min_prevalence is None and \
+            min_abundance is None:
+        if keep_features is not None:
+            raise click.UsageError(
+                "--keep-features requires --feature-budget, --min-prevalence,"
+                " or --min-abundance."
+            )
+        return None
+    from rankratioviz.generate import read_feature_list
+    if keep_features is not None:
+        keep_features = read_feature_list(keep_features)
+    return {"tail_features": feature_budget,
+            "keep_features": keep_features,
+            "min_prevalence": min_prevalence,
+            "min_abundance": min_abundance}
 
 
 @click.command()
@@ -24,24 +45,194 @@ from rankratioviz._rank_processing import rank_file_to_df
               help="Sample metadata file.")
 @click.option('-o', '--output-dir', required=True,
               help="Location of output files.")
+@click.option('--binary-counts', is_flag=True, default=False,
+              help="Write feature counts to a separate binary file instead"
+                   + " of to the sample plot JSON. This makes large"
+                   + " visualizations load faster.")
+@click.option('--cache-dir', default=None,
+              help="Directory in which to cache parsed input files (and the"
+                   + " BIOM table matched up with the other inputs), so that"
+                   + " later runs on the same inputs can skip parsing and"
+                   + " matching them. If nothing has changed since the"
+                   + " output directory was last generated, it isn't"
+                   + " regenerated.")
+@click.option('--max-cache-size', default=1024, type=click.IntRange(min=0),
+              help="Maximum size of the cache directory, in MB. The least"
+                   + " recently used cached files are deleted once it gets"
+                   + " bigger than this.")
+@click.option('--max-rank-plot-bars', default=None, type=click.IntRange(min=2),
+              help="If there are more than this many features, only draw"
+                   + " (about) this many bars in the rank plot at once:"
+                   + " a shape-preserving subset of the features is shown"
+                   + " when zoomed out.")
+@click.option('--asset-dir', default=None,
+              help="Directory in which to store shared copies of the"
+                   + " visualization's JavaScript/CSS files. Output"
+                   + " directories then link to these instead of each"
+                   + " getting their own copies.")
+@click.option('--single-file', is_flag=True, default=False,
+              help="Write the visualization as a single, self-contained HTML"
+                   + " file (with its data compressed and embedded in it)"
+                   + " that can be opened without a web server.")
+@click.option('--precompress', is_flag=True, default=False,
+              help="Also write gzipped (and, if the brotli package is"
+                   + " installed, brotli-compressed) versions of the"
+                   + " visualization's data files, for web servers to send.")
+@click.option('--count-chunk-size', default=None, type=click.IntRange(min=1),
+              help="Split the feature counts into binary files of this many"
+                   + " features each, which are only loaded as they're"
+                   + " needed. Implies --binary-counts.")
+@click.option('--feature-budget', default=None, type=click.IntRange(min=1),
+              help="Only include the N highest- and N lowest-ranked features"
+                   + " for each rank column (plus any --keep-features). The"
+                   + " other features are collapsed into a single \"Other\""
+                   + " feature.")
+@click.option('--keep-features', default=None,
+              help="File of feature IDs (one per line) to include regardless"
+                   + " of --feature-budget, --min-prevalence, and"
+                   + " --min-abundance.")
+@click.option('--min-prevalence', default=None,
+              type=click.FloatRange(min=0, max=1),
+              help="Collapse features present in less than this fraction of"
+                   + " samples into the \"Other\" feature.")
+@click.option('--min-abundance', default=None, type=click.FloatRange(min=0),
+              help="Collapse features whose total count (across all"
+                   + " samples) is less than this into the \"Other\""
+                   + " feature.")
+@click.option('--profile', is_flag=True, default=False,
+              help="Record how long each stage of generating the"
+                   + " visualization takes (and how much memory it uses),"
+                   + " and write this to rankratioviz_profile.json in the"
+                   + " output directory.")
+@click.option('--profile-cprofile', is_flag=True, default=False,
+              help="Also run each stage under cProfile, and write the"
+                   + " slowest stage's profile to the output directory."
+                   + " Implies --profile.")
 def plot(ranks: str, table: str, sample_metadata: str, feature_metadata: str,
-         output_dir: str) -> None:
+         output_dir: str, binary_counts: bool, cache_dir: str,
+         max_cache_size: int, max_rank_plot_bars: int, asset_dir: str,
+         single_file: bool, precompress: bool,
+         count_chunk_size: int, feature_budget: int, keep_features: str,
+         min_prevalence: float, min_abundance: float, profile: bool,
+         profile_cprofile: bool) -> None:
     """Generates a plot of ranked taxa/metabolites and their abundances."""
 
+    budget = feature_budget_options(feature_budget, keep_features,
+                                    min_prevalence, min_abundance)
+    # These are imported here, rather than at the top of this file, so that
+    # "rankratioviz --help" (and rankratioviz with invalid arguments) doesn't
+    # have to wait for them to be imported.
+    from biom import load_table
+    import pandas as pd
+    from rankratioviz.generate import (match_inputs, finish_input,
+                                       gen_visualization,
+                                       visualization_is_current)
+    from rankratioviz._rank_processing import rank_file_to_df
+    from rankratioviz import _cache
+
     def read_metadata(md_file_loc):
         return pd.read_csv(md_file_loc, index_col=0, sep='\t')
 
-    loaded_biom = load_table(table)
-    df_sample_metadata = read_metadata(sample_metadata)
-    feature_ranks = rank_file_to_df(ranks)
+    # (The cache is kept within its size limit even if nothing had to be
+    # regenerated, or if generating the visualization failed.)
+    try:
+        with _profiling.profiling(output_dir,
+                                  enabled=(profile or profile_cprofile),
+                                  use_cprofile=profile_cprofile) as profiler:
+            inputs_key = None
+            if cache_dir is not None:
+                # If the output directory was generated from exactly the same
+                # inputs and options, there's nothing to do. (Each input file's
+                # key is computed once here, and reused below.)
+                with _profiling.stage("check_inputs"):
+                    file_keys = {
+                        name: (None if loc is None
+                               else _cache.file_key(loc, cache_dir))
+                        for name, loc in (
+                            ("ranks", ranks), ("table", table),
+                            ("sample_metadata", sample_metadata),
+                            ("feature_metadata", feature_metadata),
+                            ("keep_features", keep_features)
+                        )
+                    }
+                    inputs_key = _cache.inputs_key(
+                        file_keys,
+                        {"binary_counts": binary_counts,
+                         "max_rank_plot_bars": max_rank_plot_bars,
+                         "asset_dir": (None if asset_dir is None
+                                       else os.path.abspath(asset_dir)),
+                         "single_file": single_file,
+                         "precompress": precompress,
+                         "count_chunk_size": count_chunk_size,
+                         "feature_budget": feature_budget,
+                         "min_prevalence": min_prevalence,
+                         "min_abundance": min_abundance}
+                    )
+                    up_to_date = visualization_is_current(output_dir,
+                                                          inputs_key)
+                if up_to_date:
+                    click.echo("{} is already up to date.".format(output_dir))
+                    # Keep the report from when the output was generated
+                    # (if any), rather than replacing it with one of just
+                    # this check
+                    if profiler is not None:
+                        profiler.discard()
+                    return
 
-    df_feature_metadata = None
-    if feature_metadata is not None:
-        df_feature_metadata = read_metadata(feature_metadata)
+            with _profiling.stage("read_sample_metadata"):
+                df_sample_metadata = read_metadata(sample_metadata)
+                _profiling.note(shape=list(df_sample_metadata.shape))
+            with _profiling.stage("read_ranks"):
+                feature_ranks = rank_file_to_df(
+                    ranks, cache_dir=cache_dir,
+                    key=(None if cache_dir is None else file_keys["ranks"])
+                )
+                _profiling.note(shape=list(feature_ranks.shape))
 
-    V, processed_table = process_input(feature_ranks, df_sample_metadata,
-                                       loaded_biom, df_feature_metadata)
-    gen_visualization(V, processed_table, df_sample_metadata, output_dir)
+            # The table matched up with the other inputs only depends on the
+            # feature IDs in the ranks file (not the ranks themselves), so it
+            # can be reused when just the ranks change.
+            matched = None
+            if cache_dir is not None:
+                with _profiling.stage("load_matched_table"):
+                    matched_key = _cache.matched_table_key(
+                        file_keys["table"], file_keys["sample_metadata"],
+                        file_keys["feature_metadata"], feature_ranks.index
+                    )
+                    matched = _cache.load_matched_table(cache_dir, matched_key)
+            if matched is None:
+                with _profiling.stage("load_table"):
+                    loaded_biom = load_table(table)
+                    _profiling.note(shape=list(loaded_biom.shape),
+                                    nonzero_counts=loaded_biom.matrix_data.nnz)
+                df_feature_metadata = None
+                if feature_metadata is not None:
+                    with _profiling.stage("read_feature_metadata"):
+                        df_feature_metadata = read_metadata(feature_metadata)
+                        _profiling.note(shape=list(df_feature_metadata.shape))
+                with _profiling.stage("match_inputs"):
+                    matched = match_inputs(feature_ranks, df_sample_metadata,
+                                           loaded_biom, df_feature_metadata)
+                del loaded_biom
+                if cache_dir is not None:
+                    with _profiling.stage("save_matched_table"):
+                        _cache.save_matched_table(cache_dir, matched_key,
+                                                  *matched)
+            with _profiling.stage("finish_input"):
+                V, processed_table = finish_input(feature_ranks, matched[0],
+                                                  matched[1],
+                                                  feature_budget=budget)
+            with _profiling.stage("gen_visualization"):
+                gen_visualization(V, processed_table, df_sample_metadata,
+                                  output_dir, binary_counts=binary_counts,
+                                  max_rank_plot_bars=max_rank_plot_bars,
+                                  asset_dir=asset_dir, single_file=single_file,
+                                  precompress_data=precompress,
+                                  count_chunk_size=count_chunk_size,
+                                  inputs_key=inputs_key)
+    finally:
+        if cache_dir is not None:
+            _cache.evict(cache_dir, max_cache_size * 2**20)
 
 
 if __name__ == '__main__':
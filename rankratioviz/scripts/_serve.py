@@ -0,0 +1,143 @@
+# ----------------------------------------------------------------------------
+# Copyright (c) 2018--, rankratioviz development team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file LICENSE.txt, distributed with this software.
+# ----------------------------------------------------------------------------
+import os
+import socketserver
+from email.utils import formatdate
+from http.server import HTTPServer, SimpleHTTPRequestHandler
+import click
+from rankratioviz._compression import PRECOMPRESSED_EXTENSIONS
+
+
+def accepted_encodings(accept_encoding):
+    """Returns the set of content codings allowed by an Accept-Encoding
+    header (ignoring any with a quality value of 0).
+    """
+
+    encodings = set()
+    for item in accept_encoding.split(","):
+        params = item.strip().split(";")
+        coding = params[0].strip().lower()
+        if coding == "":
+            continue
+        refused = False
+        for param in params[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    refused = float(value) == 0
+                except ValueError:
+                    pass
+        if not refused:
+            encodings.add(coding)
+    return encodings
+
+
+class PrecompressedRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files from root_dir, sending precompressed versions of them
+    (e.g. rank_plot.json.br or rank_plot.json.gz for rank_plot.json) when
+    they exist and the client accepts their encoding.
+
+    Precompressed files requested directly (e.g. rank_plot.json.gz) are sent
+    as-is, without a Content-Encoding, so the client gets the compressed
+    bytes.
+    """
+
+    root_dir = os.getcwd()
+
+    extensions_map = dict(SimpleHTTPRequestHandler.extensions_map)
+    extensions_map.update({".gz": "application/gzip",
+                           ".br": "application/octet-stream",
+                           ".json": "application/json",
+                           ".bin": "application/octet-stream"})
+
+    def translate_path(self, path):
+        # SimpleHTTPRequestHandler serves files relative to the current
+        # working directory (its directory argument is only available in
+        # Python 3.7+), so we swap that out for root_dir.
+        cwd_path = super().translate_path(path)
+        rel_path = os.path.relpath(cwd_path, os.getcwd())
+        return os.path.join(self.root_dir, rel_path)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if os.path.isfile(path):
+            accepted = accepted_encodings(
+                self.headers.get("Accept-Encoding", "")
+            )
+            for encoding, ext in PRECOMPRESSED_EXTENSIONS:
+                if encoding in accepted and os.path.isfile(path + ext):
+                    return self.send_precompressed(path, path + ext, encoding)
+        return super().send_head()
+
+    def send_precompressed(self, path, compressed_path, encoding):
+        """Sends the headers for a precompressed version of path, and returns
+        the opened compressed file (for do_GET() to send).
+        """
+
+        f = open(compressed_path, "rb")
+        try:
+            stat = os.fstat(f.fileno())
+            self.send_response(200)
+            self.send_header("Content-Type", self.guess_type(path))
+            self.send_header("Content-Encoding", encoding)
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("Last-Modified",
+                             formatdate(stat.st_mtime, usegmt=True))
+            self.send_header("Vary", "Accept-Encoding")
+            self.end_headers()
+            return f
+        except BaseException:
+            f.close()
+            raise
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(directory, host, port):
+    """Returns an HTTP server serving directory, using
+    PrecompressedRequestHandler. (Use port 0 to pick any free port.)
+    """
+
+    handler = type("Handler", (PrecompressedRequestHandler,),
+                   {"root_dir": os.path.abspath(directory)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+@click.command()
+@click.option('-d', '--directory', default=".",
+              type=click.Path(exists=True, file_okay=False),
+              help="Directory to serve (e.g. a visualization's output"
+                   + " directory). Defaults to the current directory.")
+@click.option('-p', '--port', default=8000, type=click.IntRange(min=0),
+              help="Port to serve on.")
+@click.option('--host', default="127.0.0.1",
+              help="Address to serve on.")
+def serve(directory: str, port: int, host: str) -> None:
+    """Serves a visualization locally, with precompressed data files.
+
+    This works like "python3 -m http.server", except that if a client
+    accepts gzip or brotli encoding, the .gz or .br version of a file (as
+    written by rankratioviz --precompress) is sent in its place.
+    """
+
+    server = make_server(directory, host, port)
+    click.echo("Serving {} at http://{}:{}/ (press Ctrl-C to stop)".format(
+        os.path.abspath(directory), host, server.server_address[1]
+    ))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    serve()
@@ -33,17 +33,93 @@ ssmv.botTaxa = undefined;
 // We set ssmv.selectMicrobes to undefined when no select microbes file has
 // been provided yet.
 ssmv.selectMicrobes = undefined;
-// Used when looking up a feature's count.
+// ssmv.feature_col_ids maps feature IDs to their integer column indices.
+// ssmv.feature_cts is the sample plot JSON's feature counts dataset: it stores
+// the counts of each feature in a sparse (CSR) layout, in which sample indices
+// refer to positions in ssmv.feature_cts["sample_ids"]. Once the sample plot
+// has been made, the counts themselves are handed off to ssmv.balanceWorker.
+// (If the counts are split into chunks, ssmv.feature_cts just describes the
+// chunks, which are loaded when the worker needs them.)
 ssmv.feature_col_ids = undefined;
 ssmv.feature_cts = undefined;
+// The (Web) Worker that computes log ratios for the sample plot; see
+// ssmv.balanceWorkerMain().
+ssmv.balanceWorker = undefined;
+// Used to keep track of requests made to ssmv.balanceWorker. At most one
+// request is sent to the worker at a time: if another request is made while
+// the worker is busy, it's queued (replacing any older queued request, since
+// the older request's results would just be overwritten anyway).
+ssmv.balanceRequestCount = 0;
+ssmv.balanceRequestInFlight = undefined;
+ssmv.queuedBalanceRequest = undefined;
+// If the feature counts are split into chunks, at most this many chunks are
+// kept in memory by ssmv.balanceWorker at once.
+ssmv.maxCachedCountChunks = 64;
+// Whether the visualization's data files have gzipped versions (written by
+// rankratioviz --precompress) that ssmv.fetchFile() can request. index.html
+// sets this to true if so.
+ssmv.precompressed = false;
+// Describes which features are in the log ratio currently shown: for the
+// feature with column index c, ssmv.selectionMask[c] is 1 if the feature is
+// only in the numerator, 2 if it's only in the denominator, 3 if it's in both,
+// and 0 otherwise. This is an index into ssmv.classifications.
+ssmv.selectionMask = undefined;
+ssmv.classifications = ["None", "Numerator", "Denominator", "Both"];
+// The column indices of the numerator and denominator features of the log
+// ratio currently shown, and the balances (indexed by sample index) shown in
+// the sample plot. Used to figure out what needs to change in the plots when
+// a new log ratio is selected.
+ssmv.numeratorCols = [];
+ssmv.denominatorCols = [];
+ssmv.balances = undefined;
+// The data tuples of the sample plot (indexed by sample index) and of the
+// rank plot (indexed by feature column index). Populated on the first
+// update of the plots; see ssmv.getPlotTuples().
+ssmv.sampleTuples = undefined;
+ssmv.rankTuples = undefined;
+// Maps sample IDs to their integer indices in the feature count data.
+ssmv.sampleIDToIndex = undefined;
 // Used when searching through features. This will be created from
-// ssmv.feature_col_ids.
+// ssmv.feature_col_ids: ssmv.feature_ids[c] is the ID of the feature with
+// column index c.
 ssmv.feature_ids = undefined;
+// The precomputed search index from the sample plot JSON (see
+// gen_search_index() in generate.py), along with a Map of each token in it to
+// its integer token ID.
+ssmv.searchIndex = undefined;
+ssmv.tokenIDs = undefined;
+// All feature IDs, lowercased and concatenated together (separated by
+// newlines, which can't occur in feature IDs), and the offset at which each
+// feature ID starts in this string. Used for (case-insensitive) text
+// searches.
+ssmv.featureIDText = undefined;
+ssmv.featureIDOffsets = undefined;
 // Set when the sample plot JSON is loaded. Used to populate possible sample
 // plot x-axis/colorization options.
 ssmv.metadataCols = undefined;
 // Ordered list of all ranks
 ssmv.rankOrdering = undefined;
+// The rank plot JSON's "rankratioviz_rank_sort_orders" dataset: for each
+// rank, the row indices of the rank plot's data in the order in which they're
+// plotted when that rank is shown (see gen_rank_sort_orders() in
+// generate.py). ssmv.rankXs caches, for each rank, the x position of each row
+// when that rank is shown. ssmv.rankRowIndex maps feature IDs to row indices.
+ssmv.rankSortOrders = undefined;
+ssmv.rankXs = {};
+ssmv.rankRowIndex = undefined;
+// Used if the rank plot only draws some of the features at once (see
+// gen_rank_lod() in generate.py). ssmv.rankLOD is the
+// "rankratioviz_rank_lod" dataset in the rank plot JSON (or undefined if the
+// rank plot draws every feature). ssmv.rankLODState describes which features
+// are currently drawn: either {"rank": r} (the zoomed-out subset of features
+// for rank r) or {"rank": r, "start": s, "end": e} (the features with x in
+// [s, e) when rank r is shown).
+// ssmv.rankXSignal is the name of the signal holding the rank plot's zoomed
+// x-axis domain.
+ssmv.rankLOD = undefined;
+ssmv.rankLODState = undefined;
+ssmv.rankXSignal = undefined;
+ssmv.rankLODTimeout = undefined;
 // Abstracted frequently used long string(s)
 ssmv.balance_col = "rankratioviz_balance";
 
@@ -156,9 +232,37 @@ ssmv.addSignalsToRankPlot = function(vegaSpec) {
 
 ssmv.makeRankPlot = function(spec) {
     ssmv.rankOrdering = spec["datasets"]["rankratioviz_rank_ordering"];
+    ssmv.rankSortOrders = spec["datasets"]["rankratioviz_rank_sort_orders"];
+    ssmv.rankLOD = spec["datasets"]["rankratioviz_rank_lod"];
+    var rankData = ssmv.getRankData();
+    ssmv.rankRowIndex = new Map();
+    for (var r = 0; r < rankData.length; r++) {
+        ssmv.rankRowIndex.set(rankData[r]["Feature ID"], r);
+    }
+    var embedSpec = spec;
+    if (ssmv.rankLOD !== undefined) {
+        // Start off zoomed out. We leave the full rank data in
+        // ssmv.rankPlotJSON, and just draw a subset of it.
+        var dataName = spec["data"]["name"];
+        embedSpec = Object.assign({}, spec);
+        embedSpec["datasets"] = Object.assign({}, spec["datasets"]);
+        embedSpec["datasets"][dataName] = ssmv.rankLODRows(
+            ssmv.rankOrdering[0]
+        );
+        ssmv.rankLODState = {"rank": ssmv.rankOrdering[0]};
+    }
     var embedParams = {"actions": false, "patch": ssmv.addSignalsToRankPlot};
-    vegaEmbed("#rankPlot", spec, embedParams).then(function(result) {
+    vegaEmbed("#rankPlot", embedSpec, embedParams).then(function(result) {
         ssmv.rankPlotView = result.view;
+        if (ssmv.rankLOD !== undefined) {
+            ssmv.addRankLODListeners(spec);
+        }
+        else {
+            // Re-order the features when the rank shown changes
+            ssmv.rankPlotView.addSignalListener("rank", function(name, rank) {
+                ssmv.reorderRankPlot(rank);
+            });
+        }
         // Set callbacks to let users make selections in the ranks plot
         ssmv.rankPlotView.addEventListener("click", function(e, i) {
             if (i !== null && i !== undefined) {
@@ -180,11 +284,163 @@ ssmv.makeRankPlot = function(spec) {
                 }
             }
         });
-        // NOTE We can add a signal listener for the "rank" signal here if we
-        // want to re-sort the features upon changing the rank in effect
     });
 };
 
+// Returns all of the rows of the rank plot's data (sorted by the first rank).
+ssmv.getRankData = function() {
+    return ssmv.rankPlotJSON["datasets"][ssmv.rankPlotJSON["data"]["name"]];
+};
+
+/* Returns an array of the x position of each row of the rank plot's data
+ * when the given rank is shown. This is just the inverse of the rank's sort
+ * order, so no sorting is needed.
+ */
+ssmv.getRankX = function(rank) {
+    if (ssmv.rankXs[rank] === undefined) {
+        var order = ssmv.rankSortOrders[rank];
+        var rankX = new Int32Array(order.length);
+        for (var x = 0; x < order.length; x++) {
+            rankX[order[x]] = x;
+        }
+        ssmv.rankXs[rank] = rankX;
+    }
+    return ssmv.rankXs[rank];
+};
+
+/* Moves every feature in the rank plot to its x position for the given
+ * rank.
+ */
+ssmv.reorderRankPlot = function(rank) {
+    var rankX = ssmv.getRankX(rank);
+    var dataName = ssmv.rankPlotJSON["data"]["name"];
+    ssmv.rankPlotView.change(dataName, vega.changeset().modify(
+        vega.truthy,
+        "x",
+        function(rankRow) {
+            return rankX[ssmv.rankRowIndex.get(rankRow["Feature ID"])];
+        }
+    )).run();
+};
+
+/* Returns copies of the rows of the rank plot's data at the given row
+ * indices, positioned for the given rank.
+ *
+ * The rows are copied since Vega modifies the objects it's given; this way
+ * the rows in ssmv.rankPlotJSON can be drawn again later without any
+ * confusion. Each row's classification is set based on the log ratio
+ * currently shown.
+ */
+ssmv.copyRankRows = function(rowIndices, rank) {
+    var rankData = ssmv.getRankData();
+    var rankX = ssmv.getRankX(rank);
+    var rows = new Array(rowIndices.length);
+    for (var p = 0; p < rowIndices.length; p++) {
+        rows[p] = Object.assign({}, rankData[rowIndices[p]]);
+        rows[p]["x"] = rankX[rowIndices[p]];
+        if (ssmv.selectionMask !== undefined) {
+            rows[p]["Classification"] = ssmv.classifications[
+                ssmv.selectionMask[ssmv.feature_col_ids[rows[p]["Feature ID"]]]
+            ];
+        }
+    }
+    return rows;
+};
+
+// Returns (copies of) the rows in the zoomed-out subset of features for rank.
+ssmv.rankLODRows = function(rank) {
+    return ssmv.copyRankRows(ssmv.rankLOD["rows"][rank], rank);
+};
+
+/* Sets up the rank plot to switch between drawing the zoomed-out subset of
+ * features and drawing all of the features in the visible range, depending
+ * on how far the plot is zoomed in.
+ *
+ * This watches the signal that Vega-Lite uses to store the zoomed x-axis
+ * domain for the rank plot's (scale-bound) interval selection, as well as
+ * the rank signal.
+ */
+ssmv.addRankLODListeners = function(spec) {
+    var selections = Object.keys(spec["selection"] || {});
+    for (var s = 0; s < selections.length; s++) {
+        if (spec["selection"][selections[s]]["bind"] === "scales") {
+            ssmv.rankXSignal = selections[s] + "_x";
+        }
+    }
+    var onChange = function() {
+        // Wait until the user's stopped zooming/panning for a moment
+        clearTimeout(ssmv.rankLODTimeout);
+        ssmv.rankLODTimeout = setTimeout(ssmv.updateRankPlotLOD, 50);
+    };
+    try {
+        ssmv.rankPlotView.addSignalListener(ssmv.rankXSignal, onChange);
+    }
+    catch (e) {
+        console.log("Couldn't find the rank plot's x-axis domain signal: "
+            + "only the zoomed-out rank plot will be drawn.");
+        ssmv.rankXSignal = undefined;
+    }
+    ssmv.rankPlotView.addSignalListener("rank", onChange);
+};
+
+/* Updates the features drawn in the rank plot (if needed) based on its
+ * current zoom level and rank.
+ *
+ * If at most ssmv.rankLOD["max_bars"] features are in the visible x range,
+ * we draw all of them (along with some features on either side, so that
+ * small pans don't require redrawing). Otherwise, we draw the zoomed-out
+ * subset of features for the current rank.
+ */
+ssmv.updateRankPlotLOD = function() {
+    var rankData = ssmv.getRankData();
+    var maxBars = ssmv.rankLOD["max_bars"];
+    var domain = null;
+    if (ssmv.rankXSignal !== undefined) {
+        domain = ssmv.rankPlotView.signal(ssmv.rankXSignal);
+    }
+    var state = ssmv.rankLODState;
+    var rank = ssmv.rankPlotView.signal("rank");
+    var newState, rows;
+    var lo, hi;
+    if (domain !== null && domain !== undefined) {
+        lo = Math.max(0, Math.floor(Math.min(domain[0], domain[1])));
+        hi = Math.min(rankData.length,
+                      Math.ceil(Math.max(domain[0], domain[1])) + 1);
+    }
+    if (lo !== undefined && hi - lo <= maxBars) {
+        if (state["rank"] === rank && state["start"] !== undefined &&
+                state["start"] <= lo && hi <= state["end"]) {
+            return;
+        }
+        var extra = maxBars - (hi - lo);
+        var start = Math.max(0, lo - Math.floor(extra / 2));
+        var end = Math.min(rankData.length, start + maxBars);
+        newState = {"rank": rank, "start": start, "end": end};
+        rows = ssmv.copyRankRows(
+            ssmv.rankSortOrders[rank].slice(start, end), rank
+        );
+    }
+    else {
+        if (state["rank"] === rank && state["start"] === undefined) {
+            return;
+        }
+        newState = {"rank": rank};
+        rows = ssmv.rankLODRows(rank);
+    }
+    ssmv.rankLODState = newState;
+    var dataName = ssmv.rankPlotJSON["data"]["name"];
+    ssmv.rankPlotView.change(dataName,
+        vega.changeset().remove(vega.truthy).insert(rows)
+    ).run();
+    if (ssmv.rankTuples !== undefined) {
+        ssmv.rankTuples = new Array(ssmv.feature_ids.length);
+        for (var r = 0; r < rows.length; r++) {
+            ssmv.rankTuples[ssmv.feature_col_ids[rows[r]["Feature ID"]]] =
+                rows[r];
+        }
+    }
+};
+
 ssmv.identifyMetadataColumns = function(samplePlotSpec) {
     // Given a Vega sample plot specification, find all the metadata columns.
     // Just uses whatever the first available sample's keys are as a
@@ -211,8 +467,135 @@ ssmv.makeSamplePlot = function(spec) {
     var rfci = "rankratioviz_feature_col_ids";
     var rfct = "rankratioviz_feature_counts";
     ssmv.feature_col_ids = ssmv.samplePlotJSON["datasets"][rfci];
-    ssmv.feature_ids = Object.keys(ssmv.feature_col_ids);
     ssmv.feature_cts = ssmv.samplePlotJSON["datasets"][rfct];
+    ssmv.sampleIDToIndex = {};
+    var sampleIDs = ssmv.feature_cts["sample_ids"];
+    for (var si = 0; si < sampleIDs.length; si++) {
+        ssmv.sampleIDToIndex[sampleIDs[si]] = si;
+    }
+    ssmv.buildSearchIndex(
+        ssmv.samplePlotJSON["datasets"]["rankratioviz_feature_search_index"]
+    );
+    ssmv.startBalanceWorker(ssmv.feature_cts);
+};
+
+/* Prepares the structures used by ssmv.filterTaxa(). This is done once, when
+ * the sample plot JSON is loaded, so that searches don't have to go through
+ * every feature.
+ */
+ssmv.buildSearchIndex = function(searchIndex) {
+    var featureIDs = Object.keys(ssmv.feature_col_ids);
+    ssmv.feature_ids = new Array(featureIDs.length);
+    for (var f = 0; f < featureIDs.length; f++) {
+        ssmv.feature_ids[ssmv.feature_col_ids[featureIDs[f]]] = featureIDs[f];
+    }
+    ssmv.searchIndex = searchIndex;
+    ssmv.tokenIDs = new Map();
+    for (var t = 0; t < searchIndex["tokens"].length; t++) {
+        ssmv.tokenIDs.set(searchIndex["tokens"][t], t);
+    }
+    // (Lowercasing can change the length of some strings, so the offsets
+    // are computed from the lowercased IDs.)
+    var lowercaseIDs = ssmv.feature_ids.map(function(featureID) {
+        return featureID.toLowerCase();
+    });
+    ssmv.featureIDText = lowercaseIDs.join("\n");
+    ssmv.featureIDOffsets = new Array(lowercaseIDs.length);
+    var offset = 0;
+    for (var c = 0; c < lowercaseIDs.length; c++) {
+        ssmv.featureIDOffsets[c] = offset;
+        offset += lowercaseIDs[c].length + 1;
+    }
+};
+
+/* Returns the column index of the feature whose ID contains the character at
+ * the given offset in ssmv.featureIDText (via binary search).
+ */
+ssmv.featureAtTextOffset = function(offset) {
+    var lo = 0;
+    var hi = ssmv.featureIDOffsets.length - 1;
+    var mid;
+    while (lo < hi) {
+        mid = (lo + hi + 1) >>> 1;
+        if (ssmv.featureIDOffsets[mid] <= offset) {
+            lo = mid;
+        }
+        else {
+            hi = mid - 1;
+        }
+    }
+    return lo;
+};
+
+/* Returns a sorted array of the column indices of all features containing
+ * at least one of the given ranks, using the inverted index.
+ *
+ * If restrictTo (a Set of column indices) is given, only features in it are
+ * considered. When restrictTo is smaller than the inverted index lists we'd
+ * otherwise go through, we just check the pre-split lineages of the features
+ * in restrictTo instead.
+ */
+ssmv.featuresWithRanks = function(rankArray, restrictTo) {
+    var index = ssmv.searchIndex;
+    var tokenIDs = [];
+    var listsSize = 0;
+    var tid;
+    for (var r = 0; r < rankArray.length; r++) {
+        tid = ssmv.tokenIDs.get(rankArray[r]);
+        if (tid !== undefined) {
+            tokenIDs.push(tid);
+            listsSize += index["token_indptr"][tid + 1] -
+                index["token_indptr"][tid];
+        }
+    }
+    var matches = new Set();
+    if (restrictTo !== undefined && restrictTo.size < listsSize) {
+        var queryTokens = new Set(tokenIDs);
+        restrictTo.forEach(function(col) {
+            var end = index["lineage_indptr"][col + 1];
+            for (var i = index["lineage_indptr"][col]; i < end; i++) {
+                if (queryTokens.has(index["lineage_tokens"][i])) {
+                    matches.add(col);
+                    break;
+                }
+            }
+        });
+    }
+    else {
+        // Union the lists of features containing each rank.
+        var col, end;
+        for (var ti = 0; ti < tokenIDs.length; ti++) {
+            end = index["token_indptr"][tokenIDs[ti] + 1];
+            for (var i = index["token_indptr"][tokenIDs[ti]]; i < end; i++) {
+                col = index["token_features"][i];
+                if (restrictTo === undefined || restrictTo.has(col)) {
+                    matches.add(col);
+                }
+            }
+        }
+    }
+    return Array.from(matches).sort(function(a, b) { return a - b; });
+};
+
+/* Returns an array of the column indices of all features whose IDs contain
+ * inputText, ignoring case (in order), using ssmv.featureIDText.
+ */
+ssmv.featuresWithText = function(inputText) {
+    var matches = [];
+    var query = inputText.toLowerCase();
+    var pos = ssmv.featureIDText.indexOf(query);
+    var col;
+    while (pos >= 0) {
+        col = ssmv.featureAtTextOffset(pos);
+        matches.push(col);
+        // Move on to the next feature (so we don't list this one twice)
+        if (col + 1 >= ssmv.featureIDOffsets.length) {
+            break;
+        }
+        pos = ssmv.featureIDText.indexOf(query,
+                                         ssmv.featureIDOffsets[col + 1]);
+    }
+    return matches;
 };
 
 /* Returns list of taxa names based on a match with the inputText.
@@ -226,9 +609,9 @@ ssmv.makeSamplePlot = function(spec) {
  * semicolons.)
  *
  * If searchType is "text" then this will filter to taxa where the inputText is
- * contained somewhere within their name. (This search includes characters like
- * semicolons separating the ranks of a taxon, so those can be used in the
- * inputText to control exactly what is being filtered.)
+ * contained somewhere within their name, ignoring case. (This search includes
+ * characters like semicolons separating the ranks of a taxon, so those can be
+ * used in the inputText to control exactly what is being filtered.)
  *
  * Also: if ssmv.selectMicrobes is not undefined, this will only search for
  * microbes within that list. Otherwise, it searches through all microbes
@@ -236,6 +619,13 @@ ssmv.makeSamplePlot = function(spec) {
  * entries for.
  */
 ssmv.filterTaxa = function(inputText, searchType) {
+    return ssmv.featureIDsOf(ssmv.filterFeatureCols(inputText, searchType));
+};
+
+/* Like ssmv.filterTaxa(), but returns the (sorted) column indices of the
+ * matching taxa instead of their names.
+ */
+ssmv.filterFeatureCols = function(inputText, searchType) {
     if (searchType === "rank") {
         // Prepare input array of ranks to use for searching
         var initialRankArray = inputText.trim().replace(/[,;]/g, " ").split(" ");
@@ -252,211 +642,653 @@ ssmv.filterTaxa = function(inputText, searchType) {
         }
     }
 
-    // Prepare array of taxa (we'll split up each taxon's lineage during the
-    // below for loop)
-    var taxa;
+    var filteredCols;
     if (ssmv.selectMicrobes !== undefined) {
         // If a "select microbes" list is available, just search through that.
-        taxa = ssmv.selectMicrobes;
+        // (We ignore any microbes in this list that aren't present in the
+        // BIOM table, since we don't have any counts for them.)
+        var selectCols = new Set();
+        var col;
+        for (var si = 0; si < ssmv.selectMicrobes.length; si++) {
+            col = ssmv.feature_col_ids[ssmv.selectMicrobes[si]];
+            if (col !== undefined) {
+                selectCols.add(col);
+            }
+        }
+        if (searchType === "text") {
+            // This list is usually short, so we just check each of its
+            // microbes directly.
+            filteredCols = [];
+            var query = inputText.toLowerCase();
+            selectCols.forEach(function(c) {
+                if (ssmv.feature_ids[c].toLowerCase().includes(query)) {
+                    filteredCols.push(c);
+                }
+            });
+            filteredCols.sort(function(a, b) { return a - b; });
+        }
+        else {
+            filteredCols = ssmv.featuresWithRanks(rankArray, selectCols);
+        }
+    }
+    else if (searchType === "text") {
+        // Just use the input text to literally search through taxa for
+        // matches (including semicolons corresponding to rank
+        // separators, e.g. "Bacteria;Proteobacteria;").
+        // Note that this can lead to some weird results if you're not
+        // careful -- e.g. just searching on "Staphylococcus" will
+        // include Staph phages in the filtering (since their names
+        // contain the text "Staphylococcus").
+        filteredCols = ssmv.featuresWithText(inputText);
     }
     else {
-        // If that sort of list isn't available, then search through every
-        // microbe mentioned in the BIOM table.
-        taxa = ssmv.feature_ids;
-    }
-    var filteredTaxa = [];
-    var taxonomyPart;
-    var ranksOfTaxon;
-    for (var ti = 0; ti < taxa.length; ti++) {
-        if (searchType === "text") {
-            // Just use the input text to literally search through taxa for
-            // matches (including semicolons corresponding to rank
-            // separators, e.g. "Bacteria;Proteobacteria;").
-            // Note that this can lead to some weird results if you're not
-            // careful -- e.g. just searching on "Staphylococcus" will
-            // include Staph phages in the filtering (since their names
-            // contain the text "Staphylococcus").
-            if (taxa[ti].includes(inputText)) {
-                filteredTaxa.push(taxa[ti]);
+        // Search against individual ranks (separated by semicolons).
+        // This only searches against ranks that are indicated in the
+        // file, so if there are missing steps (e.g. no genus given)
+        // then this can't rectify that.
+        //
+        // This prevents some of the problems with searching by text --
+        // entering "Staphyloccoccus" here will have the intended
+        // result. However, the ability to search by text can be
+        // powerful, so these functionalities are both provided here
+        // for convenience.
+        //
+        // We make the assumption that each rank for the taxon is
+        // separated by a single semicolon, with no trailing or leading
+        // whitespace or semicolons. Since as far as I'm aware these
+        // files are usually automatically generated, this should be ok
+        //
+        // If this taxon name includes a | character (used to separate
+        // its taxonomy information from things like confidence value
+        // or sequence), just the part before the | is searched. (This is
+        // all taken care of when generating the search index.)
+        filteredCols = ssmv.featuresWithRanks(rankArray);
+    }
+    return filteredCols;
+};
+
+/* Returns an array of the IDs of the features at the given column indices. */
+ssmv.featureIDsOf = function(cols) {
+    var featureIDs = new Array(cols.length);
+    for (var c = 0; c < cols.length; c++) {
+        featureIDs[c] = ssmv.feature_ids[cols[c]];
+    }
+    return featureIDs;
+};
+
+/* The code run by ssmv.balanceWorker, which computes the log ratios
+ * ("balances") shown in the sample plot off of the main thread.
+ *
+ * This is never called directly on the page: its source code is used to
+ * create a Web Worker (see ssmv.startBalanceWorker()), so it can't refer to
+ * anything outside of itself. scope is the worker's global scope (or a
+ * stand-in for it; see ssmv.PseudoWorker).
+ *
+ * The worker stores the feature counts in "chunks", each of which contains
+ * the counts (indptr, indices, and data typed arrays, in the same CSR layout
+ * as the sample plot JSON) of chunkSize consecutive features. It accepts
+ * four types of messages:
+ * -"init": gives the worker the number of samples and features, and either
+ *  all of the feature counts (as indptr, indices, and data) or, if the counts
+ *  are split into chunks that are loaded as needed, chunkSize and the
+ *  maximum number of chunks to keep around (maxChunks).
+ * -"balances": asks the worker to compute the balance of every sample, given
+ *  typed arrays of the column indices of the numerator and denominator
+ *  features. If zeroFill is nonzero, each zero count in either of these is
+ *  replaced by zeroFill. The worker responds with a Float64Array of the
+ *  balances (indexed by sample index) and the ID of the request -- or, if it
+ *  doesn't have all of the chunks it needs to do this, with the indices of
+ *  the chunks it's missing (missingChunks) and the ID of the request.
+ * -"chunks": gives the worker some chunks of counts (each with its index,
+ *  indptr, indices, and data), after which it finishes the request that was
+ *  missing them.
+ * -"cancel": tells the worker to drop the request that's waiting on chunks
+ *  (e.g. because they couldn't be loaded).
+ *
+ * Chunks are cached in least-recently-used order: once a request is done,
+ * the least recently used chunks beyond the first maxChunks are dropped.
+ *
+ * The worker keeps the per-sample sums of the numerator and denominator
+ * around between requests. Since selections are usually refined a few
+ * features at a time, it then just adds the counts of features that were
+ * added to each side and subtracts the counts of features that were removed.
+ */
+ssmv.balanceWorkerMain = function(scope) {
+    var numSamples, numFeatures, chunkSize, maxChunks;
+    // Maps chunk indices to chunks. (Maps iterate in insertion order, so
+    // we re-insert a chunk whenever it's used to keep this in LRU order.)
+    var chunks = new Map();
+    // A "balances" request that's waiting on chunks
+    var pendingRequest;
+    // The current state of each side of the log ratio: see makeSide()
+    var numerator, denominator;
+    // Used when diffing selections: seen[c] === seenStamp iff column c is in
+    // the selection currently being looked at
+    var seen, seenStamp = 0;
+
+    /* Creates an (empty) side of the log ratio. For every sample, sums
+     * contains the summed counts of the side's features and nonzeroCounts
+     * contains the number of these features with a nonzero count. inSide[c]
+     * is 1 if the feature with column index c is in this side.
+     */
+    var makeSide = function() {
+        return {
+            "cols": new Uint32Array(0),
+            "inSide": new Uint8Array(numFeatures),
+            "sums": new Float64Array(numSamples),
+            "nonzeroCounts": new Int32Array(numSamples)
+        };
+    };
+
+    /* Adds the counts of the feature at column index c to side's sums (or
+     * subtracts them, if sign is -1).
+     *
+     * Rather than looking up the feature's count in each sample, this goes
+     * through just its nonzero counts.
+     */
+    var addColumn = function(side, c, sign) {
+        var chunk = chunks.get(Math.floor(c / chunkSize));
+        var row = c % chunkSize;
+        var end = chunk.indptr[row + 1];
+        var s;
+        for (var i = chunk.indptr[row]; i < end; i++) {
+            s = chunk.indices[i];
+            side.sums[s] += sign * chunk.data[i];
+            side.nonzeroCounts[s] += sign;
+            if (side.nonzeroCounts[s] === 0) {
+                // Subtracting non-integer counts can leave a tiny residue
+                // (e.g. 0.1 + 0.2 - 0.1 - 0.2 is 2.8e-17), which would give
+                // a finite log ratio instead of NaN. With no nonzero counts
+                // left, the sum is exactly 0.
+                side.sums[s] = 0;
             }
         }
-        else {
-            // Search against individual ranks (separated by semicolons).
-            // This only searches against ranks that are indicated in the
-            // file, so if there are missing steps (e.g. no genus given)
-            // then this can't rectify that.
-            //
-            // This prevents some of the problems with searching by text --
-            // entering "Staphyloccoccus" here will have the intended
-            // result. However, the ability to search by text can be
-            // powerful, so these functionalities are both provided here
-            // for convenience.
-            //
-            // We make the assumption that each rank for the taxon is
-            // separated by a single semicolon, with no trailing or leading
-            // whitespace or semicolons. Since as far as I'm aware these
-            // files are usually automatically generated, this should be ok
-            //
-            // If this taxon name includes a | character (used to separate
-            // its taxonomy information from things like confidence value
-            // or sequence), just get the part before the | and search
-            // that. (If there is no | in the taxon name, then this will
-            // just search the entire string:
-            // "abcdefg".split("|")[0] === "abcdefg")
-            taxonomyPart = taxa[ti].split("|")[0];
-            ranksOfTaxon = taxonomyPart.split(";");
-            // Loop over ranks
-            for (var ri2 = 0; ri2 < rankArray.length; ri2++) {
-                if (ranksOfTaxon.includes(rankArray[ri2])) {
-                    filteredTaxa.push(taxa[ti]);
+    };
+
+    /* Figures out how to update side to contain exactly the features at
+     * column indices cols: returns the columns whose counts need to be added
+     * to side's sums, the columns whose counts need to be subtracted from
+     * them, and whether or not the sums need to be recomputed from scratch
+     * first.
+     */
+    var planSide = function(side, cols) {
+        var added = [];
+        var removed = [];
+        var i;
+        seenStamp++;
+        for (i = 0; i < cols.length; i++) {
+            seen[cols[i]] = seenStamp;
+            if (side.inSide[cols[i]] === 0) {
+                added.push(cols[i]);
+            }
+        }
+        for (i = 0; i < side.cols.length; i++) {
+            if (seen[side.cols[i]] !== seenStamp) {
+                removed.push(side.cols[i]);
+            }
+        }
+        if (added.length + removed.length >= cols.length) {
+            // Most of the selection changed, so it's at least as fast to
+            // recompute the sums from scratch (and doing so avoids
+            // accumulating floating-point error from repeated subtraction).
+            return {"reset": true, "added": cols, "removed": []};
+        }
+        return {"reset": false, "added": added, "removed": removed};
+    };
+
+    /* Updates side to contain exactly the features at column indices cols,
+     * following plan (from planSide()).
+     */
+    var updateSide = function(side, cols, plan) {
+        var i;
+        if (plan.reset) {
+            side.sums.fill(0);
+            side.nonzeroCounts.fill(0);
+        }
+        for (i = 0; i < plan.added.length; i++) {
+            addColumn(side, plan.added[i], 1);
+        }
+        for (i = 0; i < plan.removed.length; i++) {
+            addColumn(side, plan.removed[i], -1);
+        }
+        for (i = 0; i < side.cols.length; i++) {
+            side.inSide[side.cols[i]] = 0;
+        }
+        for (i = 0; i < cols.length; i++) {
+            side.inSide[cols[i]] = 1;
+        }
+        side.cols = cols;
+    };
+
+    /* Returns the indices of the chunks containing the columns the plans
+     * use, marking each of them as recently used.
+     */
+    var chunksUsedBy = function(plans) {
+        var used = new Set();
+        var cols, ci;
+        for (var p = 0; p < plans.length; p++) {
+            cols = [plans[p].added, plans[p].removed];
+            for (var l = 0; l < cols.length; l++) {
+                for (var i = 0; i < cols[l].length; i++) {
+                    ci = Math.floor(cols[l][i] / chunkSize);
+                    if (!used.has(ci)) {
+                        used.add(ci);
+                        if (chunks.has(ci)) {
+                            var chunk = chunks.get(ci);
+                            chunks.delete(ci);
+                            chunks.set(ci, chunk);
+                        }
+                    }
                 }
             }
         }
-    }
-    return filteredTaxa;
+        return used;
+    };
+
+    /* Returns the total abundance of side's features in sample s, with each
+     * zero count replaced by zeroFill.
+     */
+    var abundance = function(side, s, zeroFill) {
+        if (zeroFill === 0) {
+            return side.sums[s];
+        }
+        return side.sums[s] +
+            zeroFill * (side.cols.length - side.nonzeroCounts[s]);
+    };
+
+    /* Vega-Lite doesn't filter out infinities (caused by taking log(0)
+     * or of log(0)/log(0), etc.) by default. If left unchecked, this leads to
+     * weird and not-useful charts due to the presence of infinities.
+     *
+     * To get around this, we preemptively set the balance for samples with
+     * an abundance of <= 0 in either the top or bottom of the log ratio as
+     * NaN.
+     *
+     * (Vega-Lite does filter out NaNs and nulls if the invalidValues config
+     * property is true [which is default]).
+     */
+    var computeBalance = function(top, bot) {
+        if (top <= 0 || bot <= 0) {
+            return NaN;
+        }
+        return Math.log(top) - Math.log(bot);
+    };
+
+    /* Computes the balances for a "balances" request, or asks for the
+     * chunks needed to do so.
+     */
+    var handleBalances = function(msg) {
+        var numPlan = planSide(numerator, msg["numerator"]);
+        var denPlan = planSide(denominator, msg["denominator"]);
+        var missing = [];
+        chunksUsedBy([numPlan, denPlan]).forEach(function(ci) {
+            if (!chunks.has(ci)) {
+                missing.push(ci);
+            }
+        });
+        if (missing.length > 0) {
+            pendingRequest = msg;
+            scope.postMessage({"id": msg["id"], "missingChunks": missing});
+            return;
+        }
+        updateSide(numerator, msg["numerator"], numPlan);
+        updateSide(denominator, msg["denominator"], denPlan);
+        var zeroFill = msg["zeroFill"];
+        var balances = new Float64Array(numSamples);
+        for (var s = 0; s < numSamples; s++) {
+            balances[s] = computeBalance(
+                abundance(numerator, s, zeroFill),
+                abundance(denominator, s, zeroFill)
+            );
+        }
+        // Drop the least recently used chunks we don't have room for
+        var lru = chunks.keys();
+        while (chunks.size > maxChunks) {
+            chunks.delete(lru.next().value);
+        }
+        scope.postMessage({"id": msg["id"], "balances": balances},
+                          [balances.buffer]);
+    };
+
+    scope.onmessage = function(e) {
+        var msg = e.data;
+        if (msg["type"] === "init") {
+            numSamples = msg["numSamples"];
+            numFeatures = msg["numFeatures"];
+            if (msg["chunkSize"] === undefined) {
+                // All of the counts are given up front, as one big chunk
+                chunkSize = Math.max(numFeatures, 1);
+                maxChunks = 1;
+                chunks.set(0, {
+                    "indptr": msg["indptr"],
+                    "indices": msg["indices"],
+                    "data": msg["data"]
+                });
+            }
+            else {
+                chunkSize = msg["chunkSize"];
+                maxChunks = msg["maxChunks"];
+            }
+            numerator = makeSide();
+            denominator = makeSide();
+            seen = new Uint32Array(numFeatures);
+        }
+        else if (msg["type"] === "balances") {
+            handleBalances(msg);
+        }
+        else if (msg["type"] === "chunks") {
+            for (var i = 0; i < msg["chunks"].length; i++) {
+                chunks.set(msg["chunks"][i]["index"], msg["chunks"][i]);
+            }
+            var request = pendingRequest;
+            pendingRequest = undefined;
+            handleBalances(request);
+        }
+        else if (msg["type"] === "cancel") {
+            pendingRequest = undefined;
+        }
+    };
 };
 
-/* Given a "row" of the sample plot's JSON for a sample, and given an array of
- * taxa, return the sum of the sample's abundances for those particular taxa.
- * TODO: add option to do log geometric means
+/* Runs the code of a worker (e.g. ssmv.balanceWorkerMain()) on the main
+ * thread, behind the same postMessage()/onmessage interface as a Worker.
+ * Used if we can't create an actual Web Worker.
  */
-ssmv.sumAbundancesForSampleTaxa = function(sampleRow, taxa) {
-    var sampleID = sampleRow["Sample ID"];
-    var abundance = 0;
-    // Figure this out now, so we don't have to do it every step of the loop
-    // ALSO: for some reason, getting the value of an input explicitly marked
-    // as having type="number" still gives you the number encased in a string.
-    // So if you add this value to something without calling parseInt() on it
-    // first... then instead of adding 0, you'll add "0", and thereby increase
-    // it by an order of magnitude... which is uh yeah that's a thing that I
-    // just spent an hour debugging.
-    var zfi = parseFloat(document.getElementById("zeroFillInput").value);
-    for (var t = 0; t < taxa.length; t++) {
-        var colIndex = ssmv.feature_col_ids[taxa[t]];
-        var count = ssmv.feature_cts[colIndex][sampleID];
-        if (count === 0) {
-            abundance += zfi;
+ssmv.PseudoWorker = function(workerMain) {
+    var pseudoWorker = this;
+    var scope = {
+        "postMessage": function(msg) {
+            setTimeout(function() {
+                pseudoWorker.onmessage({"data": msg});
+            }, 0);
         }
-        else {
-            abundance += count;
+    };
+    workerMain(scope);
+    this.postMessage = function(msg) {
+        setTimeout(function() {
+            scope.onmessage({"data": msg});
+        }, 0);
+    };
+};
+
+/* Creates ssmv.balanceWorker and hands the feature counts over to it.
+ *
+ * The counts are converted to typed arrays if needed (they already are if
+ * they were loaded from a binary counts file), and their ArrayBuffers are
+ * transferred to the worker rather than copied. Since the main thread can't
+ * use these arrays after that point, we remove them from featureCounts.
+ *
+ * If the counts are split into chunks, we don't have any of them yet: the
+ * worker asks for chunks as it needs them (see ssmv.loadCountChunks()).
+ */
+ssmv.startBalanceWorker = function(featureCounts) {
+    var workerSource = "(" + ssmv.balanceWorkerMain.toString() + ")(self);";
+    try {
+        var workerURL = URL.createObjectURL(
+            new Blob([workerSource], {"type": "application/javascript"})
+        );
+        ssmv.balanceWorker = new Worker(workerURL);
+    }
+    catch (e) {
+        // This environment doesn't support Web Workers (or at least doesn't
+        // let us create one from a blob URL).
+        ssmv.balanceWorker = new ssmv.PseudoWorker(ssmv.balanceWorkerMain);
+    }
+    ssmv.balanceWorker.onmessage = ssmv.onBalanceWorkerMessage;
+    var arrayTypes = {
+        "indptr": Uint32Array,
+        "indices": Uint32Array,
+        "data": Float64Array
+    };
+    var initMsg = {
+        "type": "init",
+        "numSamples": featureCounts["sample_ids"].length,
+        "numFeatures": ssmv.feature_ids.length
+    };
+    if (featureCounts["chunks"] !== undefined) {
+        initMsg["chunkSize"] = featureCounts["chunk_size"];
+        initMsg["maxChunks"] = ssmv.maxCachedCountChunks;
+        ssmv.balanceWorker.postMessage(initMsg);
+        return;
+    }
+    var buffers = [];
+    var arrayNames = Object.keys(arrayTypes);
+    var arr;
+    for (var a = 0; a < arrayNames.length; a++) {
+        arr = featureCounts[arrayNames[a]];
+        if (!ArrayBuffer.isView(arr)) {
+            arr = arrayTypes[arrayNames[a]].from(arr);
+        }
+        initMsg[arrayNames[a]] = arr;
+        // The arrays from a binary counts file all share one buffer
+        if (buffers.indexOf(arr.buffer) < 0) {
+            buffers.push(arr.buffer);
         }
+        delete featureCounts[arrayNames[a]];
     }
-    return abundance;
-}
+    ssmv.balanceWorker.postMessage(initMsg, buffers);
+};
 
-/* Vega-Lite doesn't filter out infinities (caused by taking log(0)
- * or of log(0)/log(0), etc.) by default. If left unchecked, this leads to
- * weird and not-useful charts due to the presence of infinities.
+/* Asks ssmv.balanceWorker to compute new balances, and calls onDone with a
+ * Float64Array of these balances (indexed by sample index) once it's done.
  *
- * To get around this, we preemptively set the balance for samples with an
- * abundance of <= 0 in either the top or bottom of the log ratio as NaN.
- *
- * (Vega-Lite does filter out NaNs and nulls if the invalidValues config
- * property is true [which is default]).
+ * numeratorCols and denominatorCols are arrays of feature column indices.
+ * Only the most recent request's onDone will be called: if this is called
+ * again before the worker finishes with this request, this request is dropped
+ * (and if the worker's already working on it, its results are ignored).
  */
-ssmv.computeBalance = function(firstTop, firstBot) {
-    if (firstTop <= 0 || firstBot <= 0) {
-        return NaN;
+ssmv.requestBalances = function(numeratorCols, denominatorCols, zeroFill,
+                                onDone) {
+    ssmv.balanceRequestCount++;
+    var numerator = Uint32Array.from(numeratorCols);
+    var denominator = Uint32Array.from(denominatorCols);
+    var request = {
+        "msg": {
+            "type": "balances",
+            "id": ssmv.balanceRequestCount,
+            "numerator": numerator,
+            "denominator": denominator,
+            "zeroFill": zeroFill
+        },
+        "transfer": [numerator.buffer, denominator.buffer],
+        "onDone": onDone
+    };
+    if (ssmv.balanceRequestInFlight !== undefined) {
+        ssmv.queuedBalanceRequest = request;
     }
-    return Math.log(firstTop) - Math.log(firstBot);
-}
+    else {
+        ssmv.sendBalanceRequest(request);
+    }
+};
+
+ssmv.sendBalanceRequest = function(request) {
+    ssmv.balanceRequestInFlight = request;
+    ssmv.balanceWorker.postMessage(request["msg"], request["transfer"]);
+};
 
-/* Use abundance data to compute the new log ratio ("balance") values of
- * log(high taxon abundance) - log(low taxon abundance) for a given sample.
+/* Loads the chunks of feature counts with the given indices (see
+ * ssmv.balanceWorkerMain()), and gives them to ssmv.balanceWorker.
  *
- * This particular function is for log ratios of two individual taxa that were
- * selected via the rank plot.
+ * If any of the chunks can't be loaded, the rest are discarded (so the
+ * worker's cache of chunks is left as it was), and the request waiting on
+ * them is cancelled; see ssmv.onCountChunksFailed().
  */
-ssmv.updateBalanceSingle = function(sampleRow) {
-    var sampleID = sampleRow["Sample ID"];
-    var topCt = ssmv.feature_cts[ssmv.taxonHighCol][sampleID];
-    var botCt = ssmv.feature_cts[ssmv.taxonLowCol][sampleID];
-    return ssmv.computeBalance(topCt, botCt);
+ssmv.loadCountChunks = function(chunkIndices) {
+    var chunkHeaders = ssmv.feature_cts["chunks"];
+    var loaded = [];
+    var buffers = [];
+    var failed = false;
+    var loadChunk = function(index) {
+        var header = chunkHeaders[index];
+        ssmv.fetchFile(header["file"], "arraybuffer", function(buf) {
+            if (failed) {
+                return;
+            }
+            var chunk = {"index": index, "arrays": header["arrays"]};
+            ssmv.readBinaryCounts(chunk, buf);
+            delete chunk["arrays"];
+            loaded.push(chunk);
+            buffers.push(buf);
+            if (loaded.length === chunkIndices.length) {
+                ssmv.balanceWorker.postMessage(
+                    {"type": "chunks", "chunks": loaded}, buffers
+                );
+            }
+        }, function() {
+            if (!failed) {
+                failed = true;
+                ssmv.onCountChunksFailed(header["file"]);
+            }
+        });
+    };
+    for (var i = 0; i < chunkIndices.length; i++) {
+        loadChunk(chunkIndices[i]);
+    }
 };
 
-/* Like ssmv.updateBalanceSingle, but considers potentially many taxa in the
- * numerator and denominator of the log ratio (based on ssmv.topTaxa and
- * ssmv.botTaxa). For log ratios generated by textual queries.
+/* Gives up on the balance request in flight, since a chunk of feature
+ * counts it needs (fileName) couldn't be loaded, and tells the user.
+ * Otherwise, ssmv.balanceRequestInFlight would stay set, and no further
+ * requests would ever be sent to the worker.
  */
-ssmv.updateBalanceMulti = function(sampleRow) {
-    // NOTE: For multiple taxa Virus/Staphylococcus:
-    // test cases in comparison to first scatterplot in Jupyter
-    // Notebook: 1517, 1302.
-    var firstTop = ssmv.sumAbundancesForSampleTaxa(sampleRow, ssmv.topTaxa);
-    var firstBot = ssmv.sumAbundancesForSampleTaxa(sampleRow, ssmv.botTaxa);
-    return ssmv.computeBalance(firstTop, firstBot);
-};
-
-// Given a "row" of data about a rank, return its new classification depending
-// on the new selection that just got made.
-ssmv.updateRankColorSingle = function(rankRow) {
-    if (rankRow["Feature ID"] === ssmv.newTaxonHigh) {
-        if (rankRow["Feature ID"] === ssmv.newTaxonLow) {
-            return "Both";
-        }
-        else {
-            return "Numerator";
-        }
+ssmv.onCountChunksFailed = function(fileName) {
+    ssmv.balanceWorker.postMessage({"type": "cancel"});
+    ssmv.balanceRequestInFlight = undefined;
+    if (ssmv.queuedBalanceRequest !== undefined) {
+        var nextRequest = ssmv.queuedBalanceRequest;
+        ssmv.queuedBalanceRequest = undefined;
+        ssmv.sendBalanceRequest(nextRequest);
     }
-    else if (rankRow["Feature ID"] === ssmv.newTaxonLow) {
-        return "Denominator";
+    ssmv.reportLoadFailure(fileName);
+};
+
+ssmv.onBalanceWorkerMessage = function(e) {
+    if (e.data["missingChunks"] !== undefined) {
+        // The worker will finish the request once it has these chunks
+        ssmv.loadCountChunks(e.data["missingChunks"]);
+        return;
     }
-    else {
-        return "None";
+    var request = ssmv.balanceRequestInFlight;
+    ssmv.balanceRequestInFlight = undefined;
+    if (ssmv.queuedBalanceRequest !== undefined) {
+        // These results are already stale, so just move on to the newest
+        // request
+        var nextRequest = ssmv.queuedBalanceRequest;
+        ssmv.queuedBalanceRequest = undefined;
+        ssmv.sendBalanceRequest(nextRequest);
     }
-}
-
-ssmv.updateRankColorMulti = function(rankRow) {
-    var inTop = false;
-    var inBot = false;
-    if (ssmv.topTaxa.indexOf(rankRow["Feature ID"]) >= 0) {
-        inTop = true;
+    else if (e.data["id"] === request["msg"]["id"]) {
+        request["onDone"](e.data["balances"]);
     }
-    if (ssmv.botTaxa.indexOf(rankRow["Feature ID"]) >= 0) {
-        inBot = true;
+};
+
+/* Returns a selection mask (see ssmv.selectionMask) for a log ratio of the
+ * features at the given column indices.
+ */
+ssmv.makeSelectionMask = function(numeratorCols, denominatorCols) {
+    var mask = new Uint8Array(ssmv.feature_ids.length);
+    for (var n = 0; n < numeratorCols.length; n++) {
+        mask[numeratorCols[n]] |= 1;
     }
-    if (inTop) {
-        if (inBot) {
-            return "Both";
-        }
-        else {
-            return "Numerator";
-        }
+    for (var d = 0; d < denominatorCols.length; d++) {
+        mask[denominatorCols[d]] |= 2;
     }
-    else if (inBot) {
-        return "Denominator";
+    return mask;
+};
+
+// Like ===, but considers NaN to be the same as NaN.
+ssmv.sameNumber = function(a, b) {
+    return a === b || (a !== a && b !== b);
+};
+
+/* Sets ssmv.sampleTuples and ssmv.rankTuples based on the data in the plots.
+ *
+ * Holding on to these tuples lets us modify just the tuples that change when
+ * a new log ratio is selected (rather than passing a predicate to
+ * vega.changeset().modify(), which would check every tuple).
+ */
+ssmv.getPlotTuples = function() {
+    var sampleData = ssmv.samplePlotView.data(
+        ssmv.samplePlotJSON["data"]["name"]
+    );
+    ssmv.sampleTuples = new Array(ssmv.feature_cts["sample_ids"].length);
+    for (var s = 0; s < sampleData.length; s++) {
+        ssmv.sampleTuples[ssmv.sampleIDToIndex[sampleData[s]["Sample ID"]]] =
+            sampleData[s];
     }
-    else {
-        return "None";
+    var rankData = ssmv.rankPlotView.data(ssmv.rankPlotJSON["data"]["name"]);
+    ssmv.rankTuples = new Array(ssmv.feature_ids.length);
+    for (var r = 0; r < rankData.length; r++) {
+        ssmv.rankTuples[ssmv.feature_col_ids[rankData[r]["Feature ID"]]] =
+            rankData[r];
     }
-}
+};
 
-ssmv.changeSamplePlot = function(updateBalanceFunc, updateRankColorFunc) {
-    var dataName = ssmv.samplePlotJSON["data"]["name"];
-    ssmv.samplePlotView.change(dataName, vega.changeset().modify(
-        /* Calculate the new balance for each sample.
-         *
-         * For reference, the use of modify() here is based on this comment:
-         * https://github.com/vega/vega/issues/1028#issuecomment-334295328
-         * (This is where I learned that vega.changeset().modify() existed.)
-         * Also, vega.truthy is a utility function: it just returns true.
-         */
-        vega.truthy,
-        ssmv.balance_col,
-        // function to run to determine what the new balances are
-        updateBalanceFunc
-    )).run();
-    // Update rank plot based on the new log ratio
-    // Storing this within changeSamplePlot() is a (weak) safeguard that
-    // changes to the state of the sample plot (at least enacted using the UI
-    // controls on the page, not the dev console) also propagate to the rank
-    // plot.
-    var rankDataName = ssmv.rankPlotJSON["data"]["name"];
-    ssmv.rankPlotView.change(rankDataName, vega.changeset().modify(
-        vega.truthy,
-        "Classification",
-        updateRankColorFunc
-    )).run();
+/* Updates the sample plot to show the log ratio of the features at the given
+ * column indices, and updates the rank plot's classifications accordingly.
+ *
+ * The balances are computed by ssmv.balanceWorker, so this returns
+ * immediately; both plots are updated once the worker's finished.
+ */
+ssmv.changeSamplePlot = function(numeratorCols, denominatorCols, zeroFill) {
+    ssmv.requestBalances(numeratorCols, denominatorCols, zeroFill,
+                         function(balances) {
+        if (ssmv.sampleTuples === undefined) {
+            ssmv.getPlotTuples();
+        }
+        // Set the new balance of each sample whose balance changed.
+        //
+        // For reference, the use of modify() here is based on this comment:
+        // https://github.com/vega/vega/issues/1028#issuecomment-334295328
+        // (This is where I learned that vega.changeset().modify() existed.)
+        var sampleChanges = vega.changeset();
+        var tuple;
+        for (var s = 0; s < balances.length; s++) {
+            tuple = ssmv.sampleTuples[s];
+            if (tuple !== undefined && (ssmv.balances === undefined ||
+                    !ssmv.sameNumber(ssmv.balances[s], balances[s]))) {
+                sampleChanges.modify(tuple, ssmv.balance_col, balances[s]);
+            }
+        }
+        ssmv.balances = balances;
+        var dataName = ssmv.samplePlotJSON["data"]["name"];
+        ssmv.samplePlotView.change(dataName, sampleChanges).run();
+
+        // Update rank plot based on the new log ratio
+        // Storing this within changeSamplePlot() is a (weak) safeguard that
+        // changes to the state of the sample plot (at least enacted using the
+        // UI controls on the page, not the dev console) also propagate to the
+        // rank plot.
+        //
+        // Only features in the old or new log ratio can have had their
+        // classification change, so we just check these.
+        var oldMask = ssmv.selectionMask;
+        if (oldMask === undefined) {
+            oldMask = new Uint8Array(ssmv.feature_ids.length);
+        }
+        var newMask = ssmv.makeSelectionMask(numeratorCols, denominatorCols);
+        var rankChanges = vega.changeset();
+        var colLists = [ssmv.numeratorCols, ssmv.denominatorCols,
+                        numeratorCols, denominatorCols];
+        var c;
+        for (var l = 0; l < colLists.length; l++) {
+            for (var i = 0; i < colLists[l].length; i++) {
+                c = colLists[l][i];
+                if (oldMask[c] !== newMask[c] &&
+                        ssmv.rankTuples[c] !== undefined) {
+                    rankChanges.modify(ssmv.rankTuples[c], "Classification",
+                                       ssmv.classifications[newMask[c]]);
+                    // Don't modify this tuple again if c is in another list
+                    oldMask[c] = newMask[c];
+                }
+            }
+        }
+        ssmv.selectionMask = newMask;
+        ssmv.numeratorCols = numeratorCols;
+        ssmv.denominatorCols = denominatorCols;
+        var rankDataName = ssmv.rankPlotJSON["data"]["name"];
+        ssmv.rankPlotView.change(rankDataName, rankChanges).run();
+    });
 };
 
 ssmv.updateSamplePlotMulti = function() {
@@ -466,9 +1298,18 @@ ssmv.updateSamplePlotMulti = function() {
     var topEnteredText = document.getElementById("topText").value;
     var botEnteredText = document.getElementById("botText").value;
     // Now use these "types" to filter taxa for both parts of the log ratio
-    ssmv.topTaxa = ssmv.filterTaxa(topEnteredText, topType);
-    ssmv.botTaxa = ssmv.filterTaxa(botEnteredText, botType);
-    ssmv.changeSamplePlot(ssmv.updateBalanceMulti, ssmv.updateRankColorMulti);
+    var topCols = ssmv.filterFeatureCols(topEnteredText, topType);
+    var botCols = ssmv.filterFeatureCols(botEnteredText, botType);
+    ssmv.topTaxa = ssmv.featureIDsOf(topCols);
+    ssmv.botTaxa = ssmv.featureIDsOf(botCols);
+    // For some reason, getting the value of an input explicitly marked as
+    // having type="number" still gives you the number encased in a string.
+    // So if you add this value to something without calling parseFloat() on
+    // it first... then instead of adding 0, you'll add "0", and thereby
+    // increase it by an order of magnitude... which is uh yeah that's a thing
+    // that I just spent an hour debugging.
+    var zeroFill = parseFloat(document.getElementById("zeroFillInput").value);
+    ssmv.changeSamplePlot(topCols, botCols, zeroFill);
     // Update taxa text displays
     ssmv.updateTaxaTextDisplays();
 };
@@ -483,9 +1324,11 @@ ssmv.updateSamplePlotSingle = function() {
                 // microbes.
                 ssmv.taxonLowCol = ssmv.feature_col_ids[ssmv.newTaxonLow];
                 ssmv.taxonHighCol = ssmv.feature_col_ids[ssmv.newTaxonHigh];
+                // Zero counts aren't filled in for these log ratios
                 ssmv.changeSamplePlot(
-                    ssmv.updateBalanceSingle,
-                    ssmv.updateRankColorSingle
+                    [ssmv.taxonHighCol],
+                    [ssmv.taxonLowCol],
+                    0
                 );
                 ssmv.updateTaxaTextDisplays(true);
             }
@@ -560,31 +1403,172 @@ ssmv.uploadSelectMicrobesFile = function() {
     }
 };
 
+/* Reads a stream (or anything else a Response can be made from), calling
+ * onLoad with its contents: parsed JSON if responseType is "json", and an
+ * ArrayBuffer otherwise. If gzipped is true, the stream is decompressed first.
+ * If reading (or decompressing) the stream fails, onFail is called instead,
+ * if given.
+ */
+ssmv.readBody = function(body, responseType, gzipped, onLoad, onFail) {
+    if (gzipped) {
+        body = new Response(body).body.pipeThrough(
+            new DecompressionStream("gzip")
+        );
+    }
+    var response = new Response(body);
+    if (responseType === "json") {
+        response.json().then(onLoad, onFail);
+    } else {
+        response.arrayBuffer().then(onLoad, onFail);
+    }
+};
+
+/* Decompresses a file embedded in a single-file visualization (as a gzipped
+ * base64 string), and calls onLoad with its contents.
+ */
+ssmv.readEmbeddedFile = function(base64Text, responseType, onLoad) {
+    fetch("data:application/octet-stream;base64," + base64Text).then(
+        function(response) {
+            ssmv.readBody(response.body, responseType, true, onLoad);
+        }
+    );
+};
+
+/* Requests a file (relative to the page) using an XMLHttpRequest, and calls
+ * onLoad with the response if the request succeeds (or onFail, if given, if
+ * it doesn't). responseType is passed along to the XMLHttpRequest (e.g.
+ * "json" or "arraybuffer").
+ *
+ * We use XMLHttpRequests to get the JSON for both plots, since we want to
+ * hang on to that instead of just passing it to vegaEmbed. See
+ * http://www.henryalgus.com/reading-binary-files-using-jquery-ajax/.
+ */
+ssmv.requestFile = function(fileName, responseType, onLoad, onFail) {
+    var xhr = new XMLHttpRequest();
+    xhr.open("GET", fileName);
+    xhr.responseType = responseType;
+    xhr.onload = function(e) {
+        if (this.status === 200) {
+            onLoad(this.response);
+        } else if (onFail !== undefined) {
+            onFail();
+        }
+    };
+    if (onFail !== undefined) {
+        xhr.onerror = onFail;
+    }
+    xhr.send();
+};
+
+/* Loads one of the visualization's data files, and calls onLoad with its
+ * contents (or onFail, if given, if it can't be loaded; see
+ * ssmv.requestFile()).
+ *
+ * If the file is embedded in the page (i.e. this is a single-file
+ * visualization), it's read from there. Otherwise, if the data files were
+ * precompressed (see ssmv.precompressed) and the browser can decompress
+ * gzipped data, we first try to get the file's precompressed version (e.g.
+ * rank_plot.json.gz), falling back to the file itself if that isn't
+ * available; if not, we just request the file. (Servers that
+ * handle precompressed files themselves will send these compressed, and the
+ * browser will decompress them before we see them; in that case, requesting
+ * the .gz file just gets us its compressed bytes, which we decompress here.)
+ */
+ssmv.fetchFile = function(fileName, responseType, onLoad, onFail) {
+    var embedded = document.querySelector(
+        'script[data-rrv-file="' + fileName + '"]'
+    );
+    if (embedded !== null) {
+        ssmv.readEmbeddedFile(embedded.textContent, responseType, onLoad);
+        return;
+    }
+    if (!ssmv.precompressed || typeof DecompressionStream === "undefined") {
+        ssmv.requestFile(fileName, responseType, onLoad, onFail);
+        return;
+    }
+    ssmv.requestFile(
+        fileName + ".gz",
+        "arraybuffer",
+        function(buffer) {
+            // Check for the gzip magic number, in case something along the
+            // way already decompressed the file
+            var header = new Uint8Array(buffer.slice(0, 2));
+            var gzipped = header[0] === 0x1f && header[1] === 0x8b;
+            ssmv.readBody(buffer, responseType, gzipped, onLoad, onFail);
+        },
+        function() {
+            ssmv.requestFile(fileName, responseType, onLoad, onFail);
+        }
+    );
+};
+
+// Maps the dtypes used in a binary counts file header to typed arrays.
+ssmv.typedArrays = {
+    "uint32": Uint32Array,
+    "float32": Float32Array,
+    "float64": Float64Array
+};
+
+/* Replaces the header of a binary counts file (stored in the sample plot
+ * JSON's feature counts dataset) with typed array views of the file's
+ * contents, given an ArrayBuffer of the file. After this, the feature counts
+ * dataset has the same indptr, indices, and data properties as it does when
+ * the counts are stored directly in the JSON.
+ */
+ssmv.readBinaryCounts = function(featureCounts, buffer) {
+    var arrayNames = ["indptr", "indices", "data"];
+    var arrayName, layout;
+    for (var a = 0; a < arrayNames.length; a++) {
+        arrayName = arrayNames[a];
+        layout = featureCounts["arrays"][arrayName];
+        featureCounts[arrayName] = new ssmv.typedArrays[layout["dtype"]](
+            buffer, layout["offset"], layout["length"]
+        );
+    }
+};
+
+/* Makes sure the sample plot JSON's feature counts are available, then calls
+ * callback. If the counts are stored in a separate binary file, this loads
+ * that file first; otherwise (including if the counts are split into chunks,
+ * which are loaded later as needed), this just calls callback immediately.
+ */
+ssmv.loadFeatureCounts = function(samplePlotSpec, callback) {
+    var featureCounts = samplePlotSpec["datasets"]["rankratioviz_feature_counts"];
+    if (featureCounts["file"] === undefined) {
+        callback();
+    }
+    else {
+        ssmv.fetchFile(featureCounts["file"], "arraybuffer", function(buf) {
+            ssmv.readBinaryCounts(featureCounts, buf);
+            callback();
+        }, function() {
+            ssmv.reportLoadFailure(featureCounts["file"]);
+        });
+    }
+};
+
+// Tells the user that one of the visualization's data files couldn't be
+// loaded.
+ssmv.reportLoadFailure = function(fileName) {
+    alert("Couldn't load " + fileName + ". If this visualization isn't being "
+        + "served by a web server, try viewing it through one (e.g. "
+        + "rankratioviz-serve).");
+};
+
 // Run on page startup: load and save JSON files, and make plots accordingly
 ssmv.loadJSONFiles = function() {
-    var jsonsToLoad = ["rank_plot.json", "sample_plot.json"];
-    for (var ji = 0; ji < 2; ji++) {
-        // Use an XMLHTTPRequest to get JSON for both plots, since we want to
-        // hang on to that instead of just passing it to vegaEmbed. See
-        // http://www.henryalgus.com/reading-binary-files-using-jquery-ajax/.
-        var xhr = new XMLHttpRequest();
-        xhr.open("GET", jsonsToLoad[ji]);
-        xhr.responseType = "json";
-        xhr.onload = function(e) {
-            if (this.status === 200) {
-                // By the time this function is called, ji is (probably)
-                // already 2. So we can't rely on it to figure out the JSON
-                // this XHR is for, which is why we check the response URL.
-                if (this.responseURL.endsWith("rank_plot.json")) {
-                    ssmv.rankPlotJSON = this.response;
-                    ssmv.makeRankPlot(this.response);
-                }
-                else {
-                    ssmv.samplePlotJSON = this.response;
-                    ssmv.makeSamplePlot(this.response);
-                }
-            }
-        };
-        xhr.send();
-    }
+    ssmv.fetchFile("rank_plot.json", "json", function(rankPlotSpec) {
+        ssmv.rankPlotJSON = rankPlotSpec;
+        ssmv.makeRankPlot(rankPlotSpec);
+    }, function() {
+        ssmv.reportLoadFailure("rank_plot.json");
+    });
+    ssmv.fetchFile("sample_plot.json", "json", function(samplePlotSpec) {
+        ssmv.samplePlotJSON = samplePlotSpec;
+        ssmv.loadFeatureCounts(samplePlotSpec, function() {
+            ssmv.makeSamplePlot(samplePlotSpec);
+        });
+    }, function() {
+        ssmv.reportLoadFailure("sample_plot.json");
+    });
 }
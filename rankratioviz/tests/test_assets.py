@@ -0,0 +1,119 @@
+import base64
+import gzip
+import os
+import re
+import shutil
+from rankratioviz import _assets
+
+
+def test_copy_support_files_is_incremental():
+    """Tests that copying the support files into an existing output directory
+       works, and only rewrites files that changed.
+    """
+
+    out_dir = os.path.join("rankratioviz", "tests", "output", "copy_assets")
+    index_loc = _assets.copy_support_files(out_dir)
+    assert index_loc == os.path.join(out_dir, "index.html")
+    vega_loc = os.path.join(out_dir, "vendor", "vega.min.js")
+    js_loc = os.path.join(out_dir, "rankratioviz.js")
+    vega_inode = os.stat(vega_loc).st_ino
+    with open(js_loc, "w") as f:
+        f.write("outdated")
+    # This used to fail, since the vendor/ directory already existed
+    _assets.copy_support_files(out_dir)
+    # Unchanged files shouldn't have been rewritten, but changed ones should
+    assert os.stat(vega_loc).st_ino == vega_inode
+    with open(js_loc, "r") as f:
+        assert f.read() != "outdated"
+
+
+def test_precompressed_flag():
+    """Tests that index.html only tells rankratioviz.js to request gzipped
+       data files if they were written.
+    """
+
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "precompressed_flag")
+    index_loc = _assets.copy_support_files(out_dir, precompressed=True)
+    with open(index_loc, "r") as f:
+        index_html = f.read()
+    assert (index_html.index("ssmv.precompressed = true;")
+            < index_html.index("ssmv.loadJSONFiles();"))
+    # Regenerating without precompression turns the flag back off
+    _assets.copy_support_files(out_dir)
+    with open(index_loc, "r") as f:
+        assert "ssmv.precompressed" not in f.read()
+    index_loc = _assets.link_shared_assets(
+        out_dir, os.path.join(out_dir, "shared"), precompressed=True
+    )
+    with open(index_loc, "r") as f:
+        assert "ssmv.precompressed = true;" in f.read()
+
+
+def test_link_shared_assets(tmpdir):
+    """Tests that shared assets are content-addressed and linked to."""
+
+    base_dir = str(tmpdir)
+    asset_dir = os.path.join(base_dir, "assets")
+    out_dirs = [os.path.join(base_dir, "plot1"),
+                os.path.join(base_dir, "plot2")]
+    for out_dir in out_dirs:
+        _assets.link_shared_assets(out_dir, asset_dir)
+
+    vega_name = _assets.hashed_name("vendor/vega.min.js")
+    assert vega_name.startswith("vega.min.") and vega_name.endswith(".js")
+    shared_vega = os.path.join(asset_dir, vega_name)
+    assert os.path.isfile(shared_vega)
+    for out_dir in out_dirs:
+        out_vega = os.path.join(out_dir, "assets", vega_name)
+        assert os.path.samefile(out_vega, shared_vega)
+        with open(os.path.join(out_dir, "index.html"), "r") as f:
+            index_html = f.read()
+        assert '"assets/{}"'.format(vega_name) in index_html
+        assert '"vendor/vega.min.js"' not in index_html
+        # Every asset that index.html refers to should be present
+        for name in os.listdir(os.path.join(out_dir, "assets")):
+            assert '"assets/{}"'.format(name) in index_html
+
+    # Outdated assets should be removed when the directory is updated
+    stale_loc = os.path.join(out_dirs[0], "assets", "vega.min.0123.js")
+    with open(stale_loc, "w") as f:
+        f.write("old")
+    _assets.link_shared_assets(out_dirs[0], asset_dir)
+    assert not os.path.exists(stale_loc)
+
+    # An asset that's a separate copy (e.g. from before the output directory
+    # was moved) should be replaced with a link
+    out_vega = os.path.join(out_dirs[1], "assets", vega_name)
+    os.remove(out_vega)
+    shutil.copyfile(shared_vega, out_vega)
+    _assets.link_shared_assets(out_dirs[1], asset_dir)
+    assert os.path.samefile(out_vega, shared_vega)
+
+
+def test_write_single_file():
+    """Tests that single-file visualizations don't refer to any other files,
+       and that the files embedded in them can be recovered.
+    """
+
+    out_dir = os.path.join("rankratioviz", "tests", "output", "single_file")
+    os.makedirs(out_dir, exist_ok=True)
+    embedded = {"rank_plot.json": b'{"a": 1}', "counts.bin": bytes(range(256))}
+    index_loc = _assets.write_single_file(os.path.join(out_dir, "index.html"),
+                                          embedded)
+    with open(index_loc, "r") as f:
+        index_html = f.read()
+    # The only link left should be the (inlined) icon
+    assert re.search(r'\bsrc="', index_html) is None
+    assert re.findall(r'\bhref="([a-z]+):', index_html) == ["data"]
+    assert "ssmv.loadJSONFiles" in index_html
+    blobs = dict(re.findall(
+        r'<script type="application/octet-stream" data-rrv-file="([^"]+)">'
+        r'([^<]*)</script>', index_html
+    ))
+    assert sorted(blobs) == sorted(embedded)
+    for name, contents in embedded.items():
+        assert gzip.decompress(base64.b64decode(blobs[name])) == contents
+    # The data has to be on the page before it's loaded
+    assert (index_html.index("data-rrv-file=\"counts.bin\"")
+            < index_html.index("ssmv.loadJSONFiles();"))
@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import subprocess
+import numpy as np
+import pytest
+from biom import Table
+from rankratioviz import logratio
+
+JS_LOC = os.path.join("rankratioviz", "support_files", "rankratioviz.js")
+
+# Runs ssmv.balanceWorkerMain() in Node.js on the counts and "balances"
+# requests given as JSON on stdin, and prints the balances it computes (with
+# NaNs as nulls).
+WORKER_SCRIPT = """
+var fs = require("fs");
+var vm = require("vm");
+var context = {};
+vm.createContext(context);
+vm.runInContext(fs.readFileSync(process.argv[1], "utf8") +
+                ";this.ssmv = ssmv;", context);
+var input = JSON.parse(fs.readFileSync(0, "utf8"));
+var results = [];
+var scope = {"postMessage": function(msg) { results.push(msg); }};
+context.ssmv.balanceWorkerMain(scope);
+scope.onmessage({"data": {
+    "type": "init",
+    "numSamples": input["numSamples"],
+    "numFeatures": input["indptr"].length - 1,
+    "indptr": Uint32Array.from(input["indptr"]),
+    "indices": Uint32Array.from(input["indices"]),
+    "data": Float64Array.from(input["data"])
+}});
+input["requests"].forEach(function(request, i) {
+    scope.onmessage({"data": {
+        "type": "balances",
+        "id": i,
+        "numerator": Uint32Array.from(request[0]),
+        "denominator": Uint32Array.from(request[1]),
+        "zeroFill": request[2]
+    }});
+});
+console.log(JSON.stringify(results.map(function(msg) {
+    return Array.from(msg["balances"], function(b) {
+        return isNaN(b) ? null : b;
+    });
+})));
+"""
+
+
+@pytest.mark.skipif(shutil.which("node") is None,
+                    reason="Node.js isn't installed")
+def test_incremental_balances_match_log_ratio():
+    """Tests that the balance worker's incrementally updated log ratios match
+       logratio.log_ratio(), even after subtracting fractional counts.
+    """
+
+    # In S1, only F1 and F2 of F1-F5 have nonzero counts
+    table = Table(np.array([[0.1, 1.5],
+                            [0.2, 0.0],
+                            [0.0, 2.25],
+                            [0.0, 0.0],
+                            [0.0, 0.7],
+                            [3.0, 4.0]]),
+                  ["F1", "F2", "F3", "F4", "F5", "F6"], ["S1", "S2"])
+    feature_ids = list(table.ids(axis="observation"))
+    counts = table.matrix_data.tocsr()
+    counts.sort_indices()
+    # Each selection is only partly different from the one before it, so the
+    # worker updates its sums rather than recomputing them
+    selections = [(["F1", "F2", "F3", "F4", "F5"], ["F6"], 0),
+                  (["F3", "F4", "F5"], ["F6"], 0),
+                  (["F1", "F2", "F3", "F4", "F5"], ["F6"], 0.5),
+                  (["F3", "F4", "F5"], ["F6"], 0.5)]
+    requests = [([feature_ids.index(f) for f in num],
+                 [feature_ids.index(f) for f in den], zero_fill)
+                for num, den, zero_fill in selections]
+    output = subprocess.run(
+        ["node", "-e", WORKER_SCRIPT, JS_LOC],
+        input=json.dumps({
+            "numSamples": table.shape[1],
+            "indptr": counts.indptr.tolist(),
+            "indices": counts.indices.tolist(),
+            "data": counts.data.tolist(),
+            "requests": requests
+        }),
+        stdout=subprocess.PIPE, universal_newlines=True, check=True
+    ).stdout
+    balances = json.loads(output)
+    assert len(balances) == len(selections)
+    for (num, den, zero_fill), worker_balances in zip(selections, balances):
+        expected = logratio.log_ratio(table, num, den, zero_fill=zero_fill)
+        worker_balances = np.array(worker_balances, dtype=float)
+        np.testing.assert_allclose(worker_balances, expected.values)
+    # With no zero filling, S1's numerator is empty after F1 and F2 are
+    # removed
+    assert balances[1][0] is None
@@ -0,0 +1,63 @@
+import os
+import filecmp
+from click.testing import CliRunner
+import rankratioviz.scripts._batch as rrvb
+import rankratioviz.scripts._plot as rrvp
+
+
+def test_batch_matches_plot(tmpdir):
+    """Tests that rankratioviz-batch produces the same output as running
+       rankratioviz separately for each ranks file.
+    """
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+    rloc = os.path.join(in_dir, "ordination.txt")
+    tloc = os.path.join(in_dir, "qiita_10422_table.biom")
+    sloc = os.path.join(in_dir, "qiita_10422_metadata.tsv")
+    floc = os.path.join(in_dir, "taxonomy.tsv")
+    out_dir = str(tmpdir.join("batch"))
+    manifest_loc = str(tmpdir.join("manifest.txt"))
+    with open(manifest_loc, "w") as mf:
+        mf.write("# comment\n\n{}\t{}\n".format(
+            rloc, os.path.join(out_dir, "from_manifest")
+        ))
+
+    runner = CliRunner()
+    result = runner.invoke(rrvb.batch, [
+        "--ranks", rloc, "--manifest", manifest_loc, "--table", tloc,
+        "--sample-metadata", sloc, "--feature-metadata", floc,
+        "--output-dir", out_dir, "--jobs", "2"
+    ])
+    assert result.exit_code == 0
+    # Each job's timing should be reported
+    assert result.output.count("total") == 2
+
+    single_out_dir = str(tmpdir.join("single"))
+    result = runner.invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--feature-metadata", floc, "--output-dir", single_out_dir
+    ])
+    assert result.exit_code == 0
+    for batch_out_dir in ("ordination", "from_manifest"):
+        for json_file in ("rank_plot.json", "sample_plot.json"):
+            assert filecmp.cmp(
+                os.path.join(out_dir, batch_out_dir, json_file),
+                os.path.join(single_out_dir, json_file),
+                shallow=False
+            )
+
+
+def test_batch_duplicate_output_dirs(tmpdir):
+    """Tests that jobs can't be written to the same output directory."""
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+    rloc = os.path.join(in_dir, "ordination.txt")
+    runner = CliRunner()
+    result = runner.invoke(rrvb.batch, [
+        "--ranks", rloc, "--ranks", rloc,
+        "--table", os.path.join(in_dir, "qiita_10422_table.biom"),
+        "--sample-metadata", os.path.join(in_dir, "qiita_10422_metadata.tsv"),
+        "--output-dir", str(tmpdir.join("output"))
+    ])
+    assert result.exit_code != 0
+    assert "same output directory" in result.output
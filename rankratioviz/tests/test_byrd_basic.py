@@ -11,7 +11,7 @@ def test_byrd():
     out_dir = os.path.join("rankratioviz", "tests", "output", "byrd")
 
     rank_json_loc = os.path.join(out_dir, "rank_plot.json")
-    # sample_json_loc = os.path.join(out_dir, "sample_logratio_plot.json")
+    sample_json_loc = os.path.join(out_dir, "sample_plot.json")
 
     rloc = os.path.join(byrd_input_dir, "byrd_differentials.tsv")
     tloc = os.path.join(byrd_input_dir, "byrd_skin_table.biom")
@@ -27,4 +27,29 @@ def test_byrd():
     assert result.exit_code == 0
     # Validate rank plot JSON
     testing_utilities.validate_rank_plot_json(rloc, rank_json_loc)
-    # TODO call testing_utilities.validate_sample_plot_json() here
+    # Validate sample plot JSON
+    testing_utilities.validate_sample_plot_json(tloc, sloc, sample_json_loc)
+
+
+def test_byrd_single_file_replaces_directory():
+    """Tests that regenerating a visualization as a single file removes the
+       files of the visualization that was there before.
+    """
+
+    byrd_input_dir = os.path.join("rankratioviz", "tests", "input", "byrd")
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "byrd_single_file")
+    args = [
+        "--ranks", os.path.join(byrd_input_dir, "byrd_differentials.tsv"),
+        "--table", os.path.join(byrd_input_dir, "byrd_skin_table.biom"),
+        "--sample-metadata", os.path.join(byrd_input_dir, "byrd_metadata.txt"),
+        "--output-dir", out_dir
+    ]
+    runner = CliRunner()
+    result = runner.invoke(rrvp.plot, args + ["--count-chunk-size", "100",
+                                              "--precompress"])
+    assert result.exit_code == 0
+    assert os.path.isdir(os.path.join(out_dir, "counts"))
+    result = runner.invoke(rrvp.plot, args + ["--single-file"])
+    assert result.exit_code == 0
+    assert os.listdir(out_dir) == ["index.html"]
@@ -0,0 +1,140 @@
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+from biom import load_table
+from click.testing import CliRunner
+from rankratioviz import _cache, _profiling
+from rankratioviz.generate import match_inputs
+from rankratioviz._rank_processing import rank_file_to_df
+import rankratioviz.scripts._plot as rrvp
+
+in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+rloc = os.path.join(in_dir, "ordination.txt")
+tloc = os.path.join(in_dir, "qiita_10422_table.biom")
+sloc = os.path.join(in_dir, "qiita_10422_metadata.tsv")
+floc = os.path.join(in_dir, "taxonomy.tsv")
+
+
+def read_metadata(md_file_loc):
+    return pd.read_csv(md_file_loc, index_col=0, sep='\t')
+
+
+def test_matched_table_cache(tmpdir):
+    """Tests that a cached matched table is the same as the original."""
+
+    cache_dir = str(tmpdir.mkdir("cache"))
+    feature_ranks = rank_file_to_df(rloc)
+    tkey, skey, fkey = [_cache.file_key(loc) for loc in (tloc, sloc, floc)]
+    key = _cache.matched_table_key(tkey, skey, fkey, feature_ranks.index)
+    # The key doesn't depend on the order of the ranked features
+    assert key == _cache.matched_table_key(tkey, skey, fkey,
+                                           feature_ranks.index[::-1])
+    assert key != _cache.matched_table_key(tkey, skey, None,
+                                           feature_ranks.index)
+    assert _cache.load_matched_table(cache_dir, key) is None
+
+    table, original_ids = match_inputs(feature_ranks, read_metadata(sloc),
+                                       load_table(tloc), read_metadata(floc))
+    _cache.save_matched_table(cache_dir, key, table, original_ids)
+    cached_table, cached_ids = _cache.load_matched_table(cache_dir, key)
+    assert list(cached_ids) == list(original_ids)
+    for axis in ("observation", "sample"):
+        assert list(cached_table.ids(axis=axis)) == list(table.ids(axis=axis))
+    assert (cached_table.matrix_data != table.matrix_data).nnz == 0
+
+
+def test_file_key_cache(tmpdir):
+    """Tests that a file's key is only recomputed once the file changes."""
+
+    cache_dir = str(tmpdir.mkdir("cache"))
+    loc = str(tmpdir.join("ranks.tsv"))
+    with open(loc, "w") as f:
+        f.write("a")
+    key = _cache.file_key(loc, cache_dir)
+    assert key == _cache.file_key(loc)
+    assert _cache.file_key(loc, cache_dir) == key
+    assert len(os.listdir(os.path.join(cache_dir, "file_keys"))) == 1
+    # Touching the file doesn't change its key
+    os.utime(loc, ns=(0, 0))
+    assert _cache.file_key(loc, cache_dir) == key
+    with open(loc, "w") as f:
+        f.write("bb")
+    assert _cache.file_key(loc, cache_dir) == _cache.file_key(loc) != key
+
+
+def test_evict(tmpdir):
+    cache_dir = str(tmpdir.mkdir("cache"))
+    df = pd.DataFrame({"a": np.arange(1000, dtype=float)},
+                      index=["F{}".format(i) for i in range(1000)])
+    for key in ("k1", "k2", "k3"):
+        _cache.save_df(cache_dir, "ranks", key, df)
+        # (So that the entries' last-used times differ)
+        time.sleep(0.05)
+    # Using an entry makes it the most recently used one
+    _cache.load_df(cache_dir, "ranks", "k1")
+    entry_dir = os.path.join(cache_dir, "ranks")
+    entry_size = _cache._dir_size(entry_dir) // 3
+    assert _cache.evict(cache_dir, entry_size * 2) == 1
+    assert _cache.load_df(cache_dir, "ranks", "k2") is None
+    assert _cache.load_df(cache_dir, "ranks", "k1") is not None
+    assert _cache.evict(cache_dir, 0) == 2
+    assert os.listdir(entry_dir) == []
+
+
+def test_plot_skips_unchanged_inputs(tmpdir):
+    """Tests that rankratioviz --cache-dir doesn't regenerate an output
+       directory if nothing has changed since it was generated.
+    """
+
+    cache_dir = str(tmpdir.join("cache"))
+    # (This has to start out empty, so it's not under tests/output/)
+    out_dir = str(tmpdir.join("output"))
+    args = ["--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+            "--feature-metadata", floc, "--output-dir", out_dir,
+            "--binary-counts", "--cache-dir", cache_dir]
+    runner = CliRunner()
+    result = runner.invoke(rrvp.plot, args)
+    assert result.exit_code == 0
+    assert "up to date" not in result.output
+    assert len(os.listdir(os.path.join(cache_dir, "matched"))) == 1
+
+    result = runner.invoke(rrvp.plot, args)
+    assert result.exit_code == 0
+    assert "up to date" in result.output
+
+    # Profiling a run that doesn't regenerate anything keeps the report of
+    # the run that did
+    result = runner.invoke(rrvp.plot, args + ["--max-rank-plot-bars", "100",
+                                              "--profile"])
+    assert result.exit_code == 0
+    assert "up to date" not in result.output
+    report_loc = os.path.join(out_dir, _profiling.REPORT_FILE)
+    with open(report_loc) as f:
+        report = f.read()
+    assert "gen_visualization" in [s["name"]
+                                   for s in json.loads(report)["stages"]]
+    result = runner.invoke(rrvp.plot, args + ["--max-rank-plot-bars", "100",
+                                              "--profile"])
+    assert result.exit_code == 0
+    assert "up to date" in result.output
+    with open(report_loc) as f:
+        assert f.read() == report
+
+    # Changing an option (or deleting an output file) means the output has
+    # to be regenerated
+    result = runner.invoke(rrvp.plot, args + ["--max-rank-plot-bars", "50"])
+    assert result.exit_code == 0
+    assert "up to date" not in result.output
+    os.remove(os.path.join(out_dir, "counts.bin"))
+    result = runner.invoke(rrvp.plot, args)
+    assert result.exit_code == 0
+    assert "up to date" not in result.output
+    assert os.path.isfile(os.path.join(out_dir, "counts.bin"))
+
+    # The cache's size limit is enforced even if nothing is regenerated
+    result = runner.invoke(rrvp.plot, args + ["--max-cache-size", "0"])
+    assert result.exit_code == 0
+    assert "up to date" in result.output
+    assert _cache._dir_size(cache_dir) == 0
@@ -0,0 +1,110 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from biom import Table, load_table
+from click.testing import CliRunner
+from rankratioviz.generate import process_input, select_budget_features
+from rankratioviz._rank_processing import rank_file_to_df
+from rankratioviz.tests import testing_utilities
+import rankratioviz.scripts._plot as rrvp
+
+
+def make_inputs():
+    # 6 features, ranked from F1 (lowest) to F6 (highest). F3 is only in one
+    # sample, and F4 has a low total count.
+    table = Table(np.array([[1, 2, 3],
+                            [4, 0, 5],
+                            [0, 9, 0],
+                            [1, 0, 0],
+                            [2, 2, 2],
+                            [5, 0, 1]]),
+                  ["F1", "F2", "F3", "F4", "F5", "F6"], ["S1", "S2", "S3"])
+    ranks = pd.DataFrame({"r": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0],
+                          "s": [6.0, 1.0, 2.0, 3.0, 4.0, 5.0]},
+                         index=["F1", "F2", "F3", "F4", "F5", "F6"])
+    metadata = pd.DataFrame({"m": ["a", "b", "c"]}, index=["S1", "S2", "S3"])
+    return ranks, table, metadata
+
+
+def test_select_budget_features():
+    ranks, table, _ = make_inputs()
+
+    def selected(**kwargs):
+        keep = select_budget_features(ranks, table, **kwargs)
+        return list(ranks.index[keep])
+
+    # The lowest- and highest-ranked feature for each rank column
+    assert selected(tail_features=1) == ["F1", "F2", "F6"]
+    assert selected(tail_features=1, keep_features=["F4"]) == [
+        "F1", "F2", "F4", "F6"
+    ]
+    assert selected(min_prevalence=0.5) == ["F1", "F2", "F5", "F6"]
+    assert selected(min_abundance=5) == ["F1", "F2", "F3", "F5", "F6"]
+    # Thresholds are applied before the tails are picked
+    assert selected(tail_features=1, min_prevalence=0.5) == [
+        "F1", "F2", "F6"
+    ]
+    assert selected(tail_features=1, min_abundance=7) == ["F2", "F3"]
+    with pytest.raises(ValueError):
+        selected(tail_features=1, keep_features=["F7"])
+
+
+def test_process_input_feature_budget():
+    """Tests that features left out by a feature budget are collapsed into
+       one "Other" feature, with their summed counts and mean ranks.
+    """
+
+    ranks, table, metadata = make_inputs()
+    V, processed_table = process_input(ranks, metadata, table,
+                                       feature_budget={"tail_features": 1})
+    assert list(V.index) == ["F1", "F2", "F6", "Other (3 features)"]
+    assert list(processed_table.ids(axis="observation")) == list(V.index)
+    assert list(V.loc["Other (3 features)"]) == [4.0, 3.0]
+    counts = processed_table.matrix_data.toarray()
+    assert list(counts[-1]) == [3, 11, 2]
+    # No counts are lost
+    assert list(counts.sum(axis=0)) == list(
+        table.matrix_data.toarray().sum(axis=0)
+    )
+    # If nothing is left out, there's no "Other" feature
+    V, processed_table = process_input(ranks, metadata, table,
+                                       feature_budget={"tail_features": 3})
+    assert list(V.index) == list(ranks.index)
+
+
+def test_sleep_apnea_feature_budget():
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+    rloc = os.path.join(in_dir, "ordination.txt")
+    tloc = os.path.join(in_dir, "qiita_10422_table.biom")
+    sloc = os.path.join(in_dir, "qiita_10422_metadata.tsv")
+    floc = os.path.join(in_dir, "taxonomy.tsv")
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "sleep_apnea_budget")
+    result = CliRunner().invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--feature-metadata", floc, "--output-dir", out_dir,
+        "--feature-budget", "5", "--binary-counts"
+    ])
+    assert result.exit_code == 0
+    sample_ids, counts = testing_utilities.load_feature_counts(
+        os.path.join(out_dir, "sample_plot.json")
+    )
+    # At most 5 features from each end of each of the 3 rank columns, plus
+    # "Other"
+    assert counts.shape[0] <= 5 * 2 * 3 + 1
+    # The total count in each sample is unchanged
+    table = load_table(tloc).sort_order(sample_ids, axis="sample")
+    ranked_ids = rank_file_to_df(rloc).index
+    table = table.filter(ranked_ids, axis="observation", inplace=False)
+    np.testing.assert_allclose(
+        np.asarray(counts.sum(axis=0)).ravel(),
+        np.asarray(table.matrix_data.sum(axis=0)).ravel()
+    )
+
+    # --keep-features on its own doesn't do anything, so it's an error
+    result = CliRunner().invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--output-dir", out_dir, "--keep-features", floc
+    ])
+    assert result.exit_code != 0
@@ -0,0 +1,82 @@
+import io
+import json
+import numpy as np
+import pandas as pd
+from rankratioviz._json_writer import ColumnarRecords, dump
+
+
+def test_dump_streams_valid_json():
+    """Tests that dump() writes the same JSON json.dump() would (modulo
+       the handling of numpy arrays and ColumnarRecords), even when it has to
+       split things into multiple chunks.
+    """
+
+    df = pd.DataFrame({
+        "Sample ID": ["S1", "S2", "S3", "S\"4"],
+        "balance": [np.nan, 1.5, np.inf, -2.0],
+        "count": [1, 2, 3, 4],
+        "when": pd.to_datetime(["2019-01-02", None, "2019-03-04",
+                                "2019-05-06"])
+    })
+    obj = {
+        "data": {"name": "x"},
+        "datasets": {
+            "x": ColumnarRecords(df),
+            "counts": {
+                "indptr": np.array([0, 2, 3, 5, 5], dtype=np.int32),
+                "data": np.array([1.0, 2.5, 3.0, 4.0, 5.0])
+            },
+            "ordering": ["Rank 0", "Rank 1", "Rank 2"]
+        }
+    }
+    fp = io.StringIO()
+    dump(obj, fp, chunk_size=2)
+    text = fp.getvalue()
+    # Compact separators should be used
+    assert ", " not in text and ": " not in text
+    assert json.loads(text) == {
+        "data": {"name": "x"},
+        "datasets": {
+            "x": [
+                {"Sample ID": "S1", "balance": None, "count": 1,
+                 "when": "2019-01-02T00:00:00"},
+                {"Sample ID": "S2", "balance": 1.5, "count": 2,
+                 "when": None},
+                {"Sample ID": "S3", "balance": None, "count": 3,
+                 "when": "2019-03-04T00:00:00"},
+                {"Sample ID": "S\"4", "balance": -2.0, "count": 4,
+                 "when": "2019-05-06T00:00:00"}
+            ],
+            "counts": {
+                "indptr": [0, 2, 3, 5, 5],
+                "data": [1.0, 2.5, 3.0, 4.0, 5.0]
+            },
+            "ordering": ["Rank 0", "Rank 1", "Rank 2"]
+        }
+    }
+
+
+def test_dump_converts_numpy_scalars_and_missing_values():
+    """Tests that numpy scalars in object columns and missing values in
+       nullable columns are written out as plain JSON values.
+    """
+
+    df = pd.DataFrame({
+        "obj": pd.Series([np.int64(1), np.float64(2.5), np.bool_(True),
+                          "x", None], dtype=object),
+        "int": pd.array([1, None, 3, 4, 5], dtype="Int64"),
+        "float": pd.array([0.5, 1.5, None, 2.0, 3.0], dtype="Float64"),
+        "bool": pd.array([True, False, None, True, False],
+                         dtype="boolean"),
+        "str": pd.array(["a", None, "c", "d", "e"], dtype="string"),
+        "cat": pd.Categorical(["u", "v", None, "u", "v"])
+    })
+    fp = io.StringIO()
+    dump({"x": ColumnarRecords(df)}, fp, chunk_size=2)
+    records = json.loads(fp.getvalue())["x"]
+    assert [r["obj"] for r in records] == [1, 2.5, True, "x", None]
+    assert [r["int"] for r in records] == [1, None, 3, 4, 5]
+    assert [r["float"] for r in records] == [0.5, 1.5, None, 2.0, 3.0]
+    assert [r["bool"] for r in records] == [True, False, None, True, False]
+    assert [r["str"] for r in records] == ["a", None, "c", "d", "e"]
+    assert [r["cat"] for r in records] == ["u", "v", None, "u", "v"]
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+from biom import Table
+from rankratioviz import logratio
+
+# Four features (rows) and four samples (columns)
+table = Table(np.array([[1, 0, 4, 0],
+                        [2, 3, 0, 0],
+                        [0, 5, 6, 0],
+                        [7, 0, 0, 0]]),
+              ["F1", "F2", "F3", "F4"], ["S1", "S2", "S3", "S4"])
+
+
+def test_log_ratio():
+    """Tests a simple log ratio, with and without zero filling."""
+
+    balance = logratio.log_ratio(table, ["F1", "F2"], ["F3"])
+    assert list(balance.index) == ["S1", "S2", "S3", "S4"]
+    # S1 and S4 have no counts of F3 (and S4 has no counts of F1 or F2), so
+    # their log ratios are NaN
+    assert np.isnan(balance["S1"]) and np.isnan(balance["S4"])
+    assert balance["S2"] == pytest.approx(np.log(3) - np.log(5))
+    assert balance["S3"] == pytest.approx(np.log(4) - np.log(6))
+
+    # Each zero count is replaced with 0.5
+    filled = logratio.log_ratio(table, ["F1", "F2"], ["F3"], zero_fill=0.5)
+    assert filled["S1"] == pytest.approx(np.log(3) - np.log(0.5))
+    assert filled["S2"] == pytest.approx(np.log(3.5) - np.log(5))
+    assert filled["S4"] == pytest.approx(np.log(1) - np.log(0.5))
+
+
+def test_log_ratios_matches_single():
+    """Tests that computing many log ratios at once gives the same results as
+       computing each of them separately.
+    """
+
+    numerators = [["F1"], ["F1", "F1", "F2"], ["F2", "F3", "F4"], []]
+    denominators = [["F2"], ["F4"], ["F3"], ["F1"]]
+    for zero_fill in (0, 1):
+        ratios = logratio.log_ratios(table, numerators, denominators,
+                                     zero_fill=zero_fill)
+        assert ratios.shape == (4, 4)
+        for i in range(len(numerators)):
+            single = logratio.log_ratio(table, numerators[i], denominators[i],
+                                        zero_fill=zero_fill)
+            pd.testing.assert_series_equal(ratios.iloc[i].rename(None),
+                                           single)
+    # An empty numerator is always NaN, even with zero filling
+    assert ratios.iloc[3].isna().all()
+
+
+def test_log_ratios_unknown_feature():
+    with pytest.raises(ValueError):
+        logratio.log_ratio(table, ["F1", "F5"], ["F2"])
+    with pytest.raises(ValueError):
+        logratio.log_ratios(table, [["F1"]], [])
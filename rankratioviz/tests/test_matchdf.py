@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+from biom import Table
+from rankratioviz.generate import match_inputs, matchdf
+
+
+def test_matchdf_dataframes():
+    """Tests that matchdf() preserves order and reports dropped IDs."""
+
+    df1 = pd.DataFrame({"a": [1, 2, 3, 4]}, index=["d", "b", "a", "c"])
+    df2 = pd.DataFrame({"b": [5, 6, 7]}, index=["a", "e", "d"])
+    m1, m2, dropped1, dropped2 = matchdf(df1, df2, return_dropped=True)
+    # The shared IDs should be in the same order as in df1
+    assert list(m1.index) == ["d", "a"]
+    assert list(m2.index) == ["d", "a"]
+    assert list(m1["a"]) == [1, 3]
+    assert list(m2["b"]) == [7, 5]
+    assert list(dropped1) == ["b", "c"]
+    assert list(dropped2) == ["e"]
+    # Without return_dropped, we should just get the two DataFrames
+    assert len(matchdf(df1, df2)) == 2
+
+
+def test_matchdf_biom_table():
+    """Tests that matchdf() works on sparse biom.Tables."""
+
+    table = Table(np.array([[0, 1, 2], [3, 0, 0], [0, 0, 4]]),
+                  ["F1", "F2", "F3"], ["S1", "S2", "S3"])
+    ranks = pd.DataFrame({"r": [0.5, -0.5]}, index=["F3", "F1"])
+    md = pd.DataFrame({"m": ["x", "y"]}, index=["S3", "S1"])
+
+    t, v, dropped_t, dropped_v = matchdf(table, ranks, axis="observation",
+                                         return_dropped=True)
+    assert list(t.ids(axis="observation")) == ["F1", "F3"]
+    assert list(v.index) == ["F1", "F3"]
+    assert list(dropped_t) == ["F2"]
+    assert len(dropped_v) == 0
+    # The original table shouldn't have been modified
+    assert table.shape == (3, 3)
+
+    t, u = matchdf(t, md, axis="sample")
+    assert list(t.ids(axis="sample")) == ["S1", "S3"]
+    assert list(u.index) == ["S1", "S3"]
+    assert t.matrix_data.toarray().tolist() == [[0, 2], [0, 4]]
+
+
+def test_match_inputs_feature_metadata_labels():
+    """Tests that features are relabelled with their metadata the same way
+       the old per-feature loop did it, including features with missing
+       metadata values and features with no metadata at all.
+    """
+
+    table = Table(np.arange(12).reshape(4, 3), ["F1", "F2", "F3", "F4"],
+                  ["S1", "S2", "S3"])
+    ranks = pd.DataFrame({"r": [1.0, 2.0, 3.0, 4.0]},
+                         index=["F4", "F2", "F1", "F3"])
+    sample_metadata = pd.DataFrame({"m": ["a", "b", "c"]},
+                                   index=["S1", "S2", "S3"])
+    # F3 has no metadata; F1 and F2 have some missing values; F5 isn't
+    # ranked.
+    feature_metadata = pd.DataFrame({
+        "Taxon": ["k__Bacteria;p__Firmicutes", None, "k__Archaea", "k__X"],
+        "Confidence": [0.9, np.nan, 0.75, 0.5],
+        "Count": [1, 2, 3, 4]
+    }, index=["F1", "F2", "F4", "F5"])
+
+    # What the old code did
+    expected = {}
+    for feature_id, row in feature_metadata.loc[["F1", "F2", "F4"]].iterrows():
+        str_vals = [str(v) for v in row.values]
+        expected[feature_id] = feature_id + "|" + "|".join(str_vals)
+    expected["F3"] = "F3"
+
+    matched, original_ids = match_inputs(ranks, sample_metadata, table,
+                                         feature_metadata)
+    assert list(matched.ids(axis="observation")) == [
+        expected[f] for f in original_ids
+    ]
+    assert expected["F2"] == "F2|None|nan|2"
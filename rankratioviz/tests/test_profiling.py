@@ -0,0 +1,70 @@
+import json
+import os
+import pstats
+from click.testing import CliRunner
+from rankratioviz import _profiling
+import rankratioviz.scripts._plot as rrvp
+
+
+def test_stages_are_noops_without_profiling():
+    with _profiling.stage("unprofiled") as info:
+        _profiling.note(x=1)
+    assert info is None
+
+
+def test_nested_stages():
+    out_dir = os.path.join("rankratioviz", "tests", "output", "profiling")
+    with _profiling.profiling(out_dir) as profiler:
+        with _profiling.stage("outer", rows=10):
+            with _profiling.stage("inner"):
+                data = [0] * 100000
+                _profiling.note(length=len(data))
+                del data
+            _profiling.note(done=True)
+    names = [r["name"] for r in profiler.records]
+    assert names == ["outer", "outer/inner"]
+    outer, inner = profiler.records
+    assert outer["info"] == {"rows": 10, "done": True}
+    assert inner["info"] == {"length": 100000}
+    assert outer["wall_seconds"] >= inner["wall_seconds"]
+    # The outer stage's memory peak includes the inner stage's
+    assert inner["tracemalloc_peak_bytes"] >= 100000 * 8
+    assert outer["tracemalloc_peak_bytes"] >= inner["tracemalloc_peak_bytes"]
+    with open(os.path.join(out_dir, _profiling.REPORT_FILE)) as f:
+        report = json.load(f)
+    assert report["slowest_stage"] == "outer"
+    assert [r["name"] for r in report["stages"]] == names
+
+
+def test_plot_profile():
+    """Tests that rankratioviz --profile-cprofile writes a report of the
+       stages run (and a loadable profile of the slowest one).
+    """
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "sleep_apnea_profile")
+    runner = CliRunner()
+    result = runner.invoke(rrvp.plot, [
+        "--ranks", os.path.join(in_dir, "ordination.txt"),
+        "--table", os.path.join(in_dir, "qiita_10422_table.biom"),
+        "--sample-metadata", os.path.join(in_dir, "qiita_10422_metadata.tsv"),
+        "--feature-metadata", os.path.join(in_dir, "taxonomy.tsv"),
+        "--output-dir", out_dir, "--binary-counts", "--profile-cprofile"
+    ])
+    assert result.exit_code == 0
+    with open(os.path.join(out_dir, _profiling.REPORT_FILE)) as f:
+        report = json.load(f)
+    stages = {r["name"]: r for r in report["stages"]}
+    for name in ("load_table", "read_ranks", "match_inputs", "finish_input",
+                 "gen_visualization", "gen_visualization/gen_sample_plot",
+                 "gen_visualization/write_json"):
+        assert stages[name]["wall_seconds"] >= 0
+        assert stages[name]["cpu_seconds"] >= 0
+    assert stages["load_table"]["info"]["shape"][0] > 0
+    output_bytes = stages["gen_visualization"]["info"]["output_bytes"]
+    assert output_bytes["counts.bin"] == os.path.getsize(
+        os.path.join(out_dir, "counts.bin")
+    )
+    assert report["slowest_stage"] in stages
+    pstats.Stats(os.path.join(out_dir, report["cprofile_file"]))
@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pandas as pd
+from click.testing import CliRunner
+from rankratioviz.generate import (gen_rank_plot, gen_rank_lod,
+                                   gen_rank_sort_orders)
+import rankratioviz.scripts._plot as rrvp
+
+
+def test_gen_rank_sort_orders():
+    """Tests that gen_rank_sort_orders() sorts each rank column."""
+
+    rank_data = pd.DataFrame({
+        "Rank 0": [-5, -3, -1, 0, 2, 4, 6],
+        "Rank 1": [1, -8, 3, np.nan, 9, 2, -1]
+    })
+    sort_orders = gen_rank_sort_orders(rank_data, ["Rank 0", "Rank 1"])
+    assert list(sort_orders["Rank 0"]) == [0, 1, 2, 3, 4, 5, 6]
+    # The missing rank should be at the end
+    assert list(sort_orders["Rank 1"]) == [1, 6, 0, 5, 2, 4, 3]
+    assert sort_orders["Rank 1"].dtype == np.int32
+
+
+def test_gen_rank_lod():
+    """Tests that gen_rank_lod() keeps the extremes of each bin."""
+
+    rank_data = pd.DataFrame({
+        "Rank 0": [-5, -3, -1, 0, 2, 4, 6],
+        "Rank 1": [1, -8, 3, np.nan, 9, 2, -1]
+    })
+    sort_orders = gen_rank_sort_orders(rank_data, ["Rank 0", "Rank 1"])
+    lod = gen_rank_lod(rank_data, sort_orders, 4)
+    assert lod["max_bars"] == 4
+    # 2 bins of 4 features each (the second bin is just 3 features long)
+    assert list(lod["rows"]["Rank 0"]) == [0, 3, 4, 6]
+    # Bins are made in order of each column's ranks: here, the first bin is
+    # rows [1, 6, 0, 5] and the second is rows [2, 4, 3]
+    assert list(lod["rows"]["Rank 1"]) == [1, 2, 3, 4, 5]
+    assert lod["rows"]["Rank 0"].dtype == np.int32
+
+
+def test_gen_rank_plot_max_bars():
+    """Tests that gen_rank_plot() only includes LOD data when it's needed."""
+
+    V = pd.DataFrame({0: np.arange(10.0), 1: np.arange(10.0)[::-1]},
+                     index=["F{}".format(i) for i in range(10)])
+    datasets = gen_rank_plot(V.copy())["datasets"]
+    assert "rankratioviz_rank_lod" not in datasets
+    datasets = gen_rank_plot(V.copy(), max_bars=10)["datasets"]
+    assert "rankratioviz_rank_lod" not in datasets
+    datasets = gen_rank_plot(V.copy(), max_bars=4)["datasets"]
+    assert list(datasets["rankratioviz_rank_sort_orders"]["Rank 1"]) == \
+        list(range(9, -1, -1))
+    lod = datasets["rankratioviz_rank_lod"]
+    assert sorted(lod["rows"].keys()) == ["Rank 0", "Rank 1"]
+    # Every feature is at the extreme of its bin here
+    assert list(lod["rows"]["Rank 0"]) == [0, 4, 5, 9]
+    assert list(lod["rows"]["Rank 1"]) == [0, 4, 5, 9]
+
+
+def test_output_is_deterministic(tmpdir):
+    """Tests that generating the same visualization twice produces the same
+       JSON files.
+    """
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "byrd")
+    out_dirs = [str(tmpdir.join("output1")), str(tmpdir.join("output2"))]
+    for out_dir in out_dirs:
+        result = CliRunner().invoke(rrvp.plot, [
+            "--ranks", os.path.join(in_dir, "byrd_differentials.tsv"),
+            "--table", os.path.join(in_dir, "byrd_skin_table.biom"),
+            "--sample-metadata", os.path.join(in_dir, "byrd_metadata.txt"),
+            "--output-dir", out_dir
+        ])
+        assert result.exit_code == 0
+    for name in ("rank_plot.json", "sample_plot.json"):
+        contents = []
+        for out_dir in out_dirs:
+            with open(os.path.join(out_dir, name), "rb") as f:
+                contents.append(f.read())
+        assert contents[0] == contents[1]
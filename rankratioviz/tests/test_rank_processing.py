@@ -0,0 +1,45 @@
+import os
+import numpy as np
+import skbio
+from pandas.testing import assert_frame_equal
+from rankratioviz._rank_processing import (
+    rank_file_to_df, ordination_to_df, differentials_to_df
+)
+
+sleep_apnea_ord_loc = os.path.join("rankratioviz", "tests", "input",
+                                   "sleep_apnea", "ordination.txt")
+byrd_diff_loc = os.path.join("rankratioviz", "tests", "input", "byrd",
+                             "byrd_differentials.tsv")
+
+
+def test_ordination_to_df_matches_skbio():
+    """Tests that reading just the feature section of an ordination gives
+       the same result as reading the entire ordination using skbio.
+    """
+
+    expected = skbio.OrdinationResults.read(sleep_apnea_ord_loc).features
+    assert_frame_equal(ordination_to_df(sleep_apnea_ord_loc), expected)
+
+
+def test_differentials_to_df_dtypes():
+    """Tests that differentials are read as floats, with string IDs."""
+
+    differentials = differentials_to_df(byrd_diff_loc)
+    assert differentials.shape == (2859, 3)
+    assert all(dt == np.float64 for dt in differentials.dtypes)
+    assert all(isinstance(i, str) for i in differentials.index)
+
+
+def test_rank_file_to_df_cache(tmpdir):
+    """Tests that caching parsed ranks works."""
+
+    cache_dir = str(tmpdir.mkdir("cache"))
+    for loc in (sleep_apnea_ord_loc, byrd_diff_loc):
+        uncached = rank_file_to_df(loc)
+        # The first call should populate the cache, and the second call
+        # should load from it. Both should match the uncached result.
+        assert_frame_equal(rank_file_to_df(loc, cache_dir=cache_dir),
+                           uncached)
+        assert_frame_equal(rank_file_to_df(loc, cache_dir=cache_dir),
+                           uncached)
+    assert len(os.listdir(os.path.join(cache_dir, "ranks"))) == 2
@@ -0,0 +1,34 @@
+from rankratioviz.generate import gen_search_index
+
+
+def test_gen_search_index():
+    """Tests that gen_search_index() builds the expected index."""
+
+    ids = ["a;b;c|x|y", "a;d", "e", "a;a;b|q;a"]
+    index = gen_search_index(ids)
+    tokens = index["tokens"]
+    assert tokens == ["a", "b", "c", "d", "e"]
+
+    # Each token should list the features whose lineages contain it (once)
+    def features_with(token):
+        t = tokens.index(token)
+        start = index["token_indptr"][t]
+        end = index["token_indptr"][t + 1]
+        return list(index["token_features"][start:end])
+
+    assert features_with("a") == [0, 1, 3]
+    assert features_with("b") == [0, 3]
+    assert features_with("c") == [0]
+    assert features_with("d") == [1]
+    assert features_with("e") == [2]
+    # Stuff after the first | shouldn't be indexed
+    assert "x" not in tokens and "q" not in tokens
+
+    # The lineages should be stored in order, including repeated ranks
+    lineages = []
+    for f in range(len(ids)):
+        start = index["lineage_indptr"][f]
+        end = index["lineage_indptr"][f + 1]
+        lineage = index["lineage_tokens"][start:end]
+        lineages.append([tokens[t] for t in lineage])
+    assert lineages == [["a", "b", "c"], ["a", "d"], ["e"], ["a", "a", "b"]]
@@ -0,0 +1,96 @@
+import gzip
+import os
+import threading
+import urllib.request
+import warnings
+import pytest
+from rankratioviz import _compression
+from rankratioviz.scripts._serve import accepted_encodings, make_server
+
+out_dir = os.path.join("rankratioviz", "tests", "output", "precompressed")
+
+
+def write_data_file():
+    os.makedirs(out_dir, exist_ok=True)
+    data_loc = os.path.join(out_dir, "rank_plot.json")
+    with open(data_loc, "w") as f:
+        f.write('{"datasets": {"x": [' + ", ".join(["1.5"] * 1000) + ']}}')
+    return data_loc
+
+
+def test_precompress():
+    """Tests that precompressed files decompress to the original, and that
+       they can be removed again.
+    """
+
+    data_loc = write_data_file()
+    with warnings.catch_warnings():
+        # (about brotli not being installed, if it isn't)
+        warnings.simplefilter("ignore")
+        written = _compression.precompress([data_loc])
+    assert data_loc + ".gz" in written
+    with open(data_loc, "rb") as f:
+        data = f.read()
+    with open(data_loc + ".gz", "rb") as f:
+        assert gzip.decompress(f.read()) == data
+    _compression.remove_precompressed([data_loc])
+    assert not os.path.exists(data_loc + ".gz")
+    assert not os.path.exists(data_loc + ".br")
+    assert os.path.exists(data_loc)
+
+
+def test_precompress_brotli():
+    brotli = pytest.importorskip("brotli")
+    data_loc = write_data_file()
+    _compression.precompress([data_loc])
+    with open(data_loc, "rb") as f, open(data_loc + ".br", "rb") as bf:
+        assert brotli.decompress(bf.read()) == f.read()
+
+
+def test_accepted_encodings():
+    assert accepted_encodings("") == set()
+    assert accepted_encodings("gzip, deflate, br") == {"gzip", "deflate",
+                                                       "br"}
+    assert accepted_encodings("GZip;q=0.5, br;q=0") == {"gzip"}
+
+
+def test_serve_precompressed():
+    """Tests that the server sends precompressed files when it can."""
+
+    data_loc = write_data_file()
+    with open(data_loc, "rb") as f:
+        data = f.read()
+    # Just use gzip, so this test works whether or not brotli is installed
+    with open(data_loc + ".gz", "wb") as f:
+        f.write(gzip.compress(data))
+    server = make_server(out_dir, "127.0.0.1", 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}/".format(server.server_address[1])
+
+    def get(path, accept_encoding=None):
+        request = urllib.request.Request(url + path)
+        if accept_encoding is not None:
+            request.add_header("Accept-Encoding", accept_encoding)
+        with urllib.request.urlopen(request) as response:
+            return response.headers, response.read()
+
+    try:
+        headers, body = get("rank_plot.json", "gzip")
+        assert headers["Content-Encoding"] == "gzip"
+        assert headers["Content-Type"] == "application/json"
+        assert gzip.decompress(body) == data
+        # Clients that don't accept gzip get the original file
+        headers, body = get("rank_plot.json", "identity")
+        assert headers["Content-Encoding"] is None
+        assert body == data
+        # The .gz file itself is sent as-is
+        headers, body = get("rank_plot.json.gz", "gzip")
+        assert headers["Content-Encoding"] is None
+        assert headers["Content-Type"] == "application/gzip"
+        assert gzip.decompress(body) == data
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+        os.remove(data_loc + ".gz")
@@ -25,3 +25,84 @@ def test_sleep_apnea_basic():
     # Validate rank plot JSON
     rank_plot_loc = os.path.join(out_dir, "rank_plot.json")
     testing_utilities.validate_rank_plot_json(rloc, rank_plot_loc)
+
+
+def test_sleep_apnea_binary_counts():
+    """Tests that writing the feature counts to a binary file works."""
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+
+    rloc = os.path.join(in_dir, "ordination.txt")
+    tloc = os.path.join(in_dir, "qiita_10422_table.biom")
+    sloc = os.path.join(in_dir, "qiita_10422_metadata.tsv")
+    floc = os.path.join(in_dir, "taxonomy.tsv")
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "sleep_apnea_binary")
+    runner = CliRunner()
+    result = runner.invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--feature-metadata", floc, "--output-dir", out_dir,
+        "--binary-counts"
+    ])
+    assert result.exit_code == 0
+    assert os.path.exists(os.path.join(out_dir, "counts.bin"))
+    # The counts stored in the binary file should be the same as those that
+    # would've been stored in the JSON.
+    json_out_dir = os.path.join("rankratioviz", "tests", "output",
+                                "sleep_apnea_json")
+    result = runner.invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--feature-metadata", floc, "--output-dir", json_out_dir
+    ])
+    assert result.exit_code == 0
+    testing_utilities.validate_sample_plot_log_ratios(
+        tloc, os.path.join(out_dir, "sample_plot.json")
+    )
+    bin_sids, bin_counts = testing_utilities.load_feature_counts(
+        os.path.join(out_dir, "sample_plot.json")
+    )
+    json_sids, json_counts = testing_utilities.load_feature_counts(
+        os.path.join(json_out_dir, "sample_plot.json")
+    )
+    assert bin_sids == json_sids
+    assert (bin_counts != json_counts).nnz == 0
+
+
+def test_sleep_apnea_chunked_counts():
+    """Tests that splitting the feature counts into chunks works."""
+
+    in_dir = os.path.join("rankratioviz", "tests", "input", "sleep_apnea")
+
+    rloc = os.path.join(in_dir, "ordination.txt")
+    tloc = os.path.join(in_dir, "qiita_10422_table.biom")
+    sloc = os.path.join(in_dir, "qiita_10422_metadata.tsv")
+    floc = os.path.join(in_dir, "taxonomy.tsv")
+    out_dir = os.path.join("rankratioviz", "tests", "output",
+                           "sleep_apnea_chunked")
+    runner = CliRunner()
+    args = ["--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+            "--feature-metadata", floc, "--output-dir", out_dir]
+    result = runner.invoke(rrvp.plot, args + ["--count-chunk-size", "1000"])
+    assert result.exit_code == 0
+    # Chunks left over from an earlier run with a different chunk size
+    # shouldn't stick around
+    result = runner.invoke(rrvp.plot, args + ["--count-chunk-size", "300"])
+    assert result.exit_code == 0
+    chunk_sids, chunk_counts = testing_utilities.load_feature_counts(
+        os.path.join(out_dir, "sample_plot.json")
+    )
+    num_features = chunk_counts.shape[0]
+    num_chunks = len(os.listdir(os.path.join(out_dir, "counts")))
+    assert num_chunks == -(-num_features // 300)
+    json_out_dir = os.path.join("rankratioviz", "tests", "output",
+                                "sleep_apnea_json")
+    result = runner.invoke(rrvp.plot, [
+        "--ranks", rloc, "--table", tloc, "--sample-metadata", sloc,
+        "--feature-metadata", floc, "--output-dir", json_out_dir
+    ])
+    assert result.exit_code == 0
+    json_sids, json_counts = testing_utilities.load_feature_counts(
+        os.path.join(json_out_dir, "sample_plot.json")
+    )
+    assert chunk_sids == json_sids
+    assert (chunk_counts != json_counts).nnz == 0
@@ -0,0 +1,38 @@
+import subprocess
+import sys
+
+# Dependencies that take a while to import. These shouldn't be imported until
+# they're actually needed.
+HEAVY_MODULES = ("numpy", "pandas", "scipy", "biom", "altair", "skbio")
+
+
+def imported_heavy_modules(code):
+    """Runs code in a fresh Python process, and returns the heavy modules
+       that were imported by the end of it.
+    """
+
+    check = ("import sys; {}; print(' '.join(m for m in {!r} "
+             "if m in sys.modules))").format(code, HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, "-c", check])
+    return output.decode("utf-8").split()
+
+
+def test_scripts_import_quickly():
+    """Tests that the command-line scripts (and so their --help output and
+       argument checking) don't import any heavy dependencies.
+    """
+
+    assert imported_heavy_modules(
+        "import rankratioviz.scripts._plot, rankratioviz.scripts._batch, "
+        "rankratioviz.scripts._serve"
+    ) == []
+
+
+def test_lazy_altair_and_skbio():
+    """Tests that altair and skbio are only imported when they're needed."""
+
+    imported = imported_heavy_modules(
+        "import rankratioviz.generate, rankratioviz._rank_processing"
+    )
+    assert "altair" not in imported
+    assert "skbio" not in imported
@@ -1,5 +1,10 @@
 import json
+import os
+import numpy as np
 from pytest import approx
+from biom import load_table
+from scipy.sparse import csr_matrix, vstack
+from rankratioviz import logratio
 from rankratioviz._rank_processing import rank_file_to_df
 
 
@@ -72,6 +77,65 @@ def validate_rank_plot_json(input_ranks_loc, rank_json_loc):
             prev_x_val = feature["x"]
 
 
+def read_binary_counts(header, base_dir):
+    """Reads a binary counts file, given its header from a sample plot JSON
+    file, as a scipy.sparse.csr_matrix.
+    """
+
+    with open(os.path.join(base_dir, header["file"]), "rb") as countsfile:
+        buf = countsfile.read()
+    arrays = {}
+    for array_name, layout in header["arrays"].items():
+        arrays[array_name] = np.frombuffer(
+            buf, dtype=np.dtype(layout["dtype"]).newbyteorder("<"),
+            count=layout["length"], offset=layout["offset"]
+        )
+    return csr_matrix(
+        (arrays["data"], arrays["indices"], arrays["indptr"]),
+        shape=header["shape"]
+    )
+
+
+def load_feature_counts(sample_json_loc):
+    """Loads the feature counts stored for a sample plot JSON file.
+
+    This works regardless of whether the counts are stored in the JSON file
+    itself, in a separate binary file, or in chunks of binary files.
+
+    Returns:
+
+    (sample_ids, counts), where sample_ids is a list of sample IDs and counts
+    is a scipy.sparse.csr_matrix of counts (with shape features x samples).
+    """
+
+    with open(sample_json_loc, "r") as sampleplotfile:
+        sample_plot = json.load(sampleplotfile)
+    feature_counts = sample_plot["datasets"]["rankratioviz_feature_counts"]
+    sample_ids = feature_counts["sample_ids"]
+    num_features = len(sample_plot["datasets"]["rankratioviz_feature_col_ids"])
+    base_dir = os.path.dirname(sample_json_loc)
+    if "chunks" in feature_counts:
+        assert feature_counts["shape"] == [num_features, len(sample_ids)]
+        chunk_size = feature_counts["chunk_size"]
+        chunks = []
+        for header in feature_counts["chunks"]:
+            chunk = read_binary_counts(header, base_dir)
+            assert chunk.shape[0] <= chunk_size
+            chunks.append(chunk)
+        # Only the last chunk can be smaller than chunk_size
+        assert all(c.shape[0] == chunk_size for c in chunks[:-1])
+        return sample_ids, vstack(chunks, format="csr")
+    if "file" in feature_counts:
+        assert feature_counts["shape"] == [num_features, len(sample_ids)]
+        return sample_ids, read_binary_counts(feature_counts, base_dir)
+    counts = csr_matrix(
+        (feature_counts["data"], feature_counts["indices"],
+         feature_counts["indptr"]),
+        shape=(num_features, len(sample_ids))
+    )
+    return sample_ids, counts
+
+
 def validate_sample_plot_json(biom_table_loc, metadata_loc, sample_json_loc):
     with open(sample_json_loc, "r") as sampleplotfile:
         sample_plot = json.load(sampleplotfile)
@@ -80,5 +144,37 @@ def validate_sample_plot_json(biom_table_loc, metadata_loc, sample_json_loc):
         basic_vegalite_json_validation(sample_plot)
         # dn = sample_plot["data"]["name"]
         # TODO check that all metadata samples are accounted for in BIOM table
-        # TODO check that every log ratio is correct! I guess that'll make us
-        # load the rank plots file, but it's worth it (tm)
+    validate_sample_plot_log_ratios(biom_table_loc, sample_json_loc)
+
+
+def validate_sample_plot_log_ratios(biom_table_loc, sample_json_loc):
+    """Checks that log ratios computed from the feature counts stored for a
+       sample plot (which is what the JS code computes them from) are the
+       same as log ratios computed directly from the BIOM table.
+    """
+
+    with open(sample_json_loc, "r") as sampleplotfile:
+        sample_plot = json.load(sampleplotfile)
+    sample_ids, counts = load_feature_counts(sample_json_loc)
+    col_ids = sample_plot["datasets"]["rankratioviz_feature_col_ids"]
+    table = load_table(biom_table_loc).sort_order(sample_ids, axis="sample")
+    # If feature metadata was given, feature IDs in the JSON are the original
+    # IDs followed by |-separated metadata values
+    table_ids = set(table.ids(axis="observation"))
+    feature_ids = [f if f in table_ids else f.split("|")[0]
+                   for f in sorted(col_ids, key=lambda f: col_ids[f])]
+
+    # A few kinds of log ratios: of single features (including one with the
+    # same feature on both sides), and of many features
+    numerators = [[feature_ids[0]], [feature_ids[-1]], feature_ids[::7]]
+    denominators = [[feature_ids[1]], [feature_ids[-1]], feature_ids[1::11]]
+    for zero_fill in (0, 1):
+        expected = logratio.log_ratios(table, numerators, denominators,
+                                       zero_fill=zero_fill)
+        actual = logratio.log_ratios_of_counts(
+            counts,
+            logratio.feature_selection_matrix(numerators, feature_ids),
+            logratio.feature_selection_matrix(denominators, feature_ids),
+            zero_fill=zero_fill
+        )
+        assert np.allclose(actual, expected.values, equal_nan=True)
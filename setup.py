@@ -71,12 +71,17 @@ setup(
         'pandas >= 0.20.0',
         'scikit-bio > 0.5.3',
         'pytest >= 4.2'],
+    extras_require={
+        # Lets --precompress write brotli-compressed files
+        'brotli': ['brotli']},
     classifiers=classifiers,
     entry_points={
         'qiime2.plugins':
         ['q2-rankratioviz=rankratioviz.q2.plugin_setup:plugin'],
         'console_scripts':
-        ['rankratioviz=rankratioviz.scripts._plot:plot']
+        ['rankratioviz=rankratioviz.scripts._plot:plot',
+         'rankratioviz-batch=rankratioviz.scripts._batch:batch',
+         'rankratioviz-serve=rankratioviz.scripts._serve:serve']
     },
     zip_safe=False
 )